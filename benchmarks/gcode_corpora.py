@@ -0,0 +1,144 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+# Synthetic, reproducible G-code corpora for the benchmarks (same seed, same lines). Each corpus mimics one kind of
+# slicer output.
+#
+# Usage (from the repository root), writes one .gcode file per corpus:
+#     python benchmarks/gcode_corpora.py outputFolder [numberOfLines]
+
+import math
+import os
+import random
+import sys
+
+
+def _extrusionMove(random, e, relative):
+    delta = random.uniform(0.01, 0.1)
+    return "G1 X{:.3f} Y{:.3f} E{:.5f}".format(random.uniform(0, 250), random.uniform(0, 210),
+                                               delta if relative else e + delta), e + delta
+
+
+# mostly absolute G1 extrusion moves, some travel and temperature lines
+def createG1HeavyCorpus(count, seed=4711):
+    generator = random.Random(seed)
+    lines = ["G21", "G90", "M82", "G28"]
+    e = 0.0
+    while (len(lines) < count):
+        kind = len(lines) % 50
+        if kind == 0:
+            lines.append("G1 Z{:.2f} F600".format(len(lines) / 5000.0))
+        elif kind == 1:
+            lines.append("G0 X{:.3f} Y{:.3f} F9000".format(generator.uniform(0, 250), generator.uniform(0, 210)))
+        elif kind == 2:
+            lines.append("M105")
+        else:
+            line, e = _extrusionMove(generator, e, False)
+            lines.append(line)
+    return lines[:count]
+
+
+# curved perimeters as G2/G3, half with I/J and half with R, e.g. from ArcWelder
+def createArcHeavyCorpus(count, seed=4711):
+    generator = random.Random(seed)
+    lines = ["G21", "G90", "M83", "G28"]
+    x, y = 100.0, 100.0
+    while (len(lines) < count):
+        kind = len(lines) % 4
+        if kind == 0:
+            x, y = generator.uniform(50, 200), generator.uniform(50, 160)
+            lines.append("G1 X{:.3f} Y{:.3f} E{:.5f}".format(x, y, generator.uniform(0.01, 0.1)))
+        elif kind == 1 or kind == 2:
+            angle = generator.uniform(0, 2 * math.pi)
+            radius = generator.uniform(2, 20)
+            i, j = radius * math.cos(angle), radius * math.sin(angle)
+            x, y = x + i + radius * math.cos(angle + 2.5), y + j + radius * math.sin(angle + 2.5)
+            lines.append("{} X{:.3f} Y{:.3f} I{:.3f} J{:.3f} E{:.5f}".format(
+                "G2" if kind == 1 else "G3", x, y, -i, -j, generator.uniform(0.1, 1.0)))
+        else:
+            x, y = x + generator.uniform(-5, 5), y + generator.uniform(-5, 5)
+            lines.append("G3 X{:.3f} Y{:.3f} R{:.3f} E{:.5f}".format(x, y, generator.uniform(5, 30),
+                                                                    generator.uniform(0.1, 1.0)))
+    return lines[:count]
+
+
+# relative extrusion (M83) with retractions and G92 resets
+def createRelativeECorpus(count, seed=4711):
+    generator = random.Random(seed)
+    lines = ["G21", "G90", "M83", "G28"]
+    while (len(lines) < count):
+        kind = len(lines) % 30
+        if kind == 0:
+            lines.append("G1 E-0.8 F2100")
+        elif kind == 1:
+            lines.append("G0 X{:.3f} Y{:.3f} F9000".format(generator.uniform(0, 250), generator.uniform(0, 210)))
+        elif kind == 2:
+            lines.append("G1 E0.8 F2100")
+        elif kind == 3:
+            lines.append("G92 E0")
+        else:
+            line, e = _extrusionMove(generator, 0.0, True)
+            lines.append(line)
+    return lines[:count]
+
+
+# two tools with tool changes every 200 lines and an IDEX duplication part
+def createMultiToolCorpus(count, seed=4711):
+    generator = random.Random(seed)
+    lines = ["G21", "G90", "M83", "G28", "T0"]
+    tool = 0
+    while (len(lines) < count):
+        if len(lines) % 200 == 0:
+            tool = 1 - tool
+            lines.append("T" + str(tool))
+        elif len(lines) % 5000 == 1:
+            lines.append("M605 S2" if generator.random() < 0.5 else "M605 S0")
+        else:
+            line, e = _extrusionMove(generator, 0.0, True)
+            lines.append(line)
+    return lines[:count]
+
+
+# PrusaSlicer/Cura-like output: many comment lines, inline comments and a thumbnail block
+def createCommentHeavyCorpus(count, seed=4711):
+    generator = random.Random(seed)
+    lines = ["; generated by a slicer", "; thumbnail begin 220x124 12345"]
+    lines += ["; " + "".join(generator.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/")
+                             for _ in range(78)) for _ in range(200)]
+    lines += ["; thumbnail end", "G21", "G90", "M82"]
+    e = 0.0
+    while (len(lines) < count):
+        kind = len(lines) % 10
+        if kind == 0:
+            lines.append(";LAYER_CHANGE")
+        elif kind == 1:
+            lines.append(";TYPE:External perimeter")
+        elif kind == 2:
+            lines.append(";WIDTH:0.45")
+        else:
+            line, e = _extrusionMove(generator, e, False)
+            lines.append(line + " ; perimeter")
+    return lines[:count]
+
+
+CORPORA = {
+    "g1Heavy": createG1HeavyCorpus,
+    "arcHeavy": createArcHeavyCorpus,
+    "relativeE": createRelativeECorpus,
+    "multiTool": createMultiToolCorpus,
+    "commentHeavy": createCommentHeavyCorpus
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python benchmarks/gcode_corpora.py outputFolder [numberOfLines]")
+        sys.exit(1)
+    outputFolder = sys.argv[1]
+    numberOfLines = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    os.makedirs(outputFolder, exist_ok=True)
+    for corpusName, createCorpus in CORPORA.items():
+        fileLocation = os.path.join(outputFolder, corpusName + ".gcode")
+        with open(fileLocation, "w") as corpusFile:
+            corpusFile.write("\n".join(createCorpus(numberOfLines)) + "\n")
+        print(fileLocation)
@@ -0,0 +1,145 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+# Allocation benchmark of the Odometer position handling, before (dict-backed Vector3D, new vectors for every move) and
+# after (Vector3D with __slots__, position updated in place). The position handling like it was done before is part of
+# this script (LegacyOdometer). The lines are parsed up front (parseGCodeLine is the same for both), only the command
+# handlers (position update, totals) are measured with tracemalloc:
+# - handler peak: for each line the traced memory peak during the handler minus the traced memory before it, summed
+#   up. The temporary position vectors of a move are alive at the same time, so this is close to their size. It is
+#   a lower bound of the allocated bytes, not the exact allocated size.
+# - retained: difference of two tracemalloc snapshots (before/after the loop), memory blocks and bytes still allocated
+#   after the loop, e.g. growing state or leaks. The allocation sites with the biggest difference are listed.
+#
+# tracemalloc slows the loop down a lot, so the default is 200000 lines, the results are scaled to 1M lines.
+#
+# Usage (from the repository root):
+#     python benchmarks/odometer_allocation_benchmark.py [numberOfLines]
+
+import math
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from octoprint_MaintenanceManager.utils.odometer import Odometer, parseGCodeLine
+
+from odometer_parser_benchmark import createGCodeLines
+
+
+# the Vector3D like it was before: no __slots__ (an instance dict per vector), every operation returns a new vector
+class LegacyVector3D(object):
+
+    def __init__(self, x, y, z):
+        self.x = x
+        self.y = y
+        self.z = z
+
+    def __add__(self, other):
+        return LegacyVector3D(self.x + other.x, self.y + other.y, self.z + other.z)
+
+    def __sub__(self, other):
+        return LegacyVector3D(self.x - other.x, self.y - other.y, self.z - other.z)
+
+
+# the position handling like it was before: lastPos takes the old position object, a new position vector for every
+# move (plus one for the sum in relative mode) and a difference vector for the totals
+class LegacyOdometer(Odometer):
+
+    def reset(self):
+        Odometer.reset(self)
+        self.lastPos = LegacyVector3D(0.0, 0.0, 0.0)
+        self.pos = LegacyVector3D(0.0, 0.0, 0.0)
+
+    def _moveTo(self, x, y, z):
+        self.lastPos = self.pos
+        pos = self.pos
+        scale = self.scale
+        relativeMode = self.relativeMode
+        newPos = LegacyVector3D(
+            x * scale if x is not None else (0.0 if relativeMode else pos.x),
+            y * scale if y is not None else (0.0 if relativeMode else pos.y),
+            z * scale if z is not None else (0.0 if relativeMode else pos.z),
+        )
+        if relativeMode:
+            self.pos += newPos
+        else:
+            self.pos = newPos
+
+    def _addAxisTraveling(self):
+        currentAxisTraveling = self.pos - self.lastPos
+        totalAxisTraveling = self.totalAxisTraveling
+        totalAxisTraveling.x = totalAxisTraveling.x + abs(currentAxisTraveling.x)
+        totalAxisTraveling.y = totalAxisTraveling.y + abs(currentAxisTraveling.y)
+        totalAxisTraveling.z = totalAxisTraveling.z + abs(currentAxisTraveling.z)
+
+
+# tracemalloc snapshot without the allocations of tracemalloc itself
+def _takeSnapshot():
+    return tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ])
+
+
+# (handler peak bytes per line, retained blocks per line, retained bytes per line, top statistics)
+def measureHandlers(odometerClass, lines, topCount=3):
+    odometer = odometerClass()
+    commandHandlers = odometer._commandHandlers
+    handlerCalls = []
+    for line in lines:
+        gcode, tool, parameters = parseGCodeLine(line)
+        commandHandler = commandHandlers.get(gcode)
+        if commandHandler is not None:
+            handlerCalls.append((commandHandler[1], gcode, tool, parameters))
+
+    getTracedMemory = tracemalloc.get_traced_memory
+    resetPeak = tracemalloc.reset_peak
+    peakSize = 0
+    tracemalloc.start()
+    startSnapshot = _takeSnapshot()
+    for handler, gcode, tool, parameters in handlerCalls:
+        resetPeak()
+        handlerStartSize = getTracedMemory()[0]
+        handler(gcode, tool, parameters)
+        peakSize += getTracedMemory()[1] - handlerStartSize
+    endSnapshot = _takeSnapshot()
+    tracemalloc.stop()
+
+    statistics = endSnapshot.compare_to(startSnapshot, "lineno")
+    retainedBlocks = sum(statistic.count_diff for statistic in statistics)
+    retainedSize = sum(statistic.size_diff for statistic in statistics)
+    lineCount = float(len(lines))
+    return peakSize / lineCount, retainedBlocks / lineCount, retainedSize / lineCount, statistics[:topCount]
+
+
+if __name__ == "__main__":
+    numberOfLines = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    lines = createGCodeLines(numberOfLines)
+    relativeLines = ["G91"] + lines
+
+    # both paths must compute the same totals, otherwise the comparison is worthless
+    for gcodeLines in (lines, relativeLines):
+        legacyOdometer = LegacyOdometer()
+        odometer = Odometer()
+        for line in gcodeLines:
+            legacyOdometer.processGCodeLine(line)
+            odometer.processGCodeLine(line)
+        legacyValues = legacyOdometer.getSnapshot()[:3]
+        values = odometer.getSnapshot()[:3]
+        assert all(math.isclose(legacy, value) for legacy, value in zip(legacyValues, values)), (legacyValues, values)
+
+    print("per 1M lines                   {:>22} {:>16} {:>16}".format(
+        "handler peak", "retained blocks", "retained bytes"))
+    for name, odometerClass, gcodeLines in [
+        ("before (absolute)", LegacyOdometer, lines),
+        ("after  (absolute)", Odometer, lines),
+        ("before (relative)", LegacyOdometer, relativeLines),
+        ("after  (relative)", Odometer, relativeLines),
+    ]:
+        peakPerLine, retainedBlocksPerLine, retainedPerLine, topStatistics = measureHandlers(odometerClass, gcodeLines)
+        print("{:<30} {:>16,.0f} bytes {:>16,.0f} {:>10,.0f} bytes".format(
+            name, peakPerLine * 1000000, retainedBlocksPerLine * 1000000, retainedPerLine * 1000000))
+        for statistic in topStatistics:
+            print("    {}".format(statistic))
@@ -0,0 +1,103 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+# Micro-benchmark: G-code parameter parsing of the Odometer, before (regex + repeated str.find) and after
+# (single-pass tokenizer).
+#
+# Usage (from the repository root):
+#     python benchmarks/odometer_parser_benchmark.py [numberOfLines]
+
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from octoprint_MaintenanceManager.utils.odometer import Odometer, parseGCodeLine, regex_command
+
+
+def createGCodeLines(count, seed=4711):
+    random.seed(seed)
+    lines = []
+    e = 0.0
+    for index in range(count):
+        kind = index % 20
+        if kind == 0:
+            lines.append("M105")
+        elif kind == 1:
+            lines.append(";TYPE:Perimeter")
+        elif kind == 2:
+            lines.append("G1 F1800 ; feedrate with an X in the comment")
+        else:
+            e += random.uniform(0.01, 0.1)
+            lines.append("G1 X{:.3f} Y{:.3f} E{:.5f}".format(random.uniform(0, 250), random.uniform(0, 210), e))
+    return lines
+
+
+# the parsing like it was done before: regex for the command and one str.find-scan per parameter
+def _getCode(line, code, c):
+    n = line.find(code) + 1
+    if n < 1:
+        return None
+    m = line.find(" ", n)
+    try:
+        if m < 0:
+            result = c(line[n:])
+        else:
+            result = c(line[n:m])
+    except ValueError:
+        return None
+
+    if math.isnan(result) or math.isinf(result):
+        return None
+
+    return result
+
+
+def legacyParseGCodeLine(line):
+    match = regex_command.search(line)
+    gcode = tool = None
+    if match:
+        values = match.groupdict()
+        if "codeGM" in values and values["codeGM"]:
+            gcode = values["codeGM"]
+        elif "codeT" in values and values["codeT"]:
+            gcode = values["codeT"]
+            tool = int(values["tool"])
+    if gcode in ("G0", "G1"):
+        x = _getCode(line, "X", float)
+        y = _getCode(line, "Y", float)
+        z = _getCode(line, "Z", float)
+        e = _getCode(line, "E", float)
+        f = _getCode(line, "F", float)
+    return gcode, tool
+
+
+def measure(name, function, lines, rounds=5):
+    def processLines():
+        for line in lines:
+            function(line)
+    measureBatch(name, processLines, lines, rounds)
+
+
+def measureBatch(name, processLinesFunction, lines, rounds=5):
+    best = None
+    for _ in range(rounds):
+        startTime = time.perf_counter()
+        processLinesFunction()
+        duration = time.perf_counter() - startTime
+        best = duration if best is None else min(best, duration)
+    print("{:<40} {:>12,.0f} lines/sec".format(name, len(lines) / best))
+
+
+if __name__ == "__main__":
+    numberOfLines = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    lines = createGCodeLines(numberOfLines)
+
+    measure("before: regex + str.find parsing", legacyParseGCodeLine, lines)
+    measure("after: parseGCodeLine", parseGCodeLine, lines)
+    measure("Odometer.processGCodeLine", Odometer().processGCodeLine, lines)
+    batchOdometer = Odometer()
+    measureBatch("Odometer.processGCodeLines", lambda: batchOdometer.processGCodeLines(lines), lines)
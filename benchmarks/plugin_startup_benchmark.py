@@ -0,0 +1,115 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+# Startup time of the plugin, each measurement in a fresh Python process (median of the runs):
+# - import: "import octoprint_MaintenanceManager", after OctoPrint and flask are already imported (like in the server)
+# - initialize: blocks the loading of all plugins
+# - on_after_startup: runs after the server startup
+#
+# before: the startup like it was done before the deferred initialization, emulated with the current code. The
+# services and the odometer are imported together with the plugin and everything on_after_startup does now (loading
+# the values, timers, publisher) is done in initialize.
+# after: the current plugin, services imported and created in on_after_startup.
+#
+# Usage (from the repository root):
+#     python benchmarks/plugin_startup_benchmark.py [runs]
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPOSITORY_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+MEASUREMENT_SCRIPT = """
+import json, logging, sys, tempfile, time
+sys.path.insert(0, sys.argv[1])
+import octoprint.plugin, octoprint.events, flask
+
+deferred = sys.argv[2] == "after"
+
+startTime = time.perf_counter()
+import octoprint_MaintenanceManager
+if (deferred == False):
+    import octoprint_MaintenanceManager.services.MaintenanceService
+    import octoprint_MaintenanceManager.services.TrackingService
+    import octoprint_MaintenanceManager.services.TrackingPublisher
+    import octoprint_MaintenanceManager.services.GCodeFileAnalyzer
+    import octoprint_MaintenanceManager.services.FileAnalysisCache
+    import octoprint_MaintenanceManager.services.MetricsService
+    import octoprint_MaintenanceManager.utils.odometer
+importDuration = time.perf_counter() - startTime
+
+
+# the plugin settings with their defaults, like OctoPrint's PluginSettings
+class DefaultSettings():
+    def __init__(self, defaults):
+        self._defaults = defaults
+
+    def get(self, path):
+        return self._defaults[path[0]]
+
+    def get_boolean(self, path):
+        return bool(self.get(path))
+
+    def get_int(self, path):
+        return int(self.get(path))
+
+    def get_float(self, path):
+        return float(self.get(path))
+
+
+class IdlePrinter():
+    def is_printing(self):
+        return False
+
+    def is_paused(self):
+        return False
+
+
+dataFolder = tempfile.TemporaryDirectory()
+plugin = octoprint_MaintenanceManager.MaintenanceManagerPlugin()
+plugin._identifier = "MaintenanceManager"
+plugin._plugin_version = "benchmark"
+plugin._logger = logging.getLogger("benchmark")
+plugin._printer = IdlePrinter()
+plugin.get_plugin_data_folder = lambda: dataFolder.name
+plugin._settings = DefaultSettings(plugin.get_settings_defaults())
+plugin._settings._defaults["fileAnalysisEnabled"] = False
+
+startTime = time.perf_counter()
+plugin.initialize()
+if (deferred == False):
+    plugin.on_after_startup()
+initializeDuration = time.perf_counter() - startTime
+
+startTime = time.perf_counter()
+if (deferred == True):
+    plugin.on_after_startup()
+startupDuration = time.perf_counter() - startTime
+
+plugin.on_shutdown()
+print(json.dumps({"import": importDuration, "initialize": initializeDuration, "on_after_startup": startupDuration}))
+"""
+
+
+# variant: "before" or "after"
+def measureOnce(variant):
+    output = subprocess.check_output([sys.executable, "-c", MEASUREMENT_SCRIPT, REPOSITORY_FOLDER, variant],
+                                     stderr=subprocess.DEVNULL).decode()
+    return json.loads(output.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    # interleaved, so both variants see the same load of the machine
+    measurements = {"before": [], "after": []}
+    for _ in range(runs):
+        for variant in measurements:
+            measurements[variant].append(measureOnce(variant))
+    print("{:<20} {:>11} {:>11}".format("", "before", "after"))
+    for phase in ("import", "initialize", "on_after_startup"):
+        print("{:<20} {:>8.2f} ms {:>8.2f} ms".format(phase, *[
+            statistics.median(measurement[phase] for measurement in measurements[variant]) * 1000.0
+            for variant in ("before", "after")]))
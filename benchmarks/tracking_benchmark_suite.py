@@ -0,0 +1,253 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+# Benchmark suite of the G-code tracking hot path, for all corpora of gcode_corpora.py:
+# - Odometer.processGCodeLine
+# - TrackingService.processGCodeLine, normal and fast mode
+# - MaintenanceManagerPlugin.sentGCodeHook (tracking, maintenance rule check and sampled latency, like OctoPrint
+#   calls it)
+# - TrackingStorage.save (persistence, one call per changed value set), JSON and SQLite backend
+#
+# Reported: lines/sec (best of the rounds), p99 latency per line/call (separate pass, each call timed with
+# perf_counter_ns, so it includes ~50ns timer overhead) and the memory allocated per 1000 lines (tracemalloc peak).
+# The results are stored as benchmarks/results/<commit>.json, --compare prints the change against another commit.
+#
+# The comparison is local only: the absolute numbers depend on the machine and its load, so no reference results are
+# committed (benchmarks/results/ is ignored by git). To compare against another commit, check it out and run the
+# suite there first, on the same machine.
+#
+# Usage (from the repository root):
+#     python benchmarks/tracking_benchmark_suite.py [--lines 100000] [--rounds 3] [--compare <commit>]
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARK_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARK_FOLDER, ".."))
+
+from octoprint_MaintenanceManager import MaintenanceManagerPlugin
+from octoprint_MaintenanceManager.services.MaintenanceService import MaintenanceService
+from octoprint_MaintenanceManager.services.MetricsService import MetricsService
+from octoprint_MaintenanceManager.services.TrackingService import TrackingService
+from octoprint_MaintenanceManager.services.TrackingStorage import STORAGE_BACKEND_JSON, STORAGE_BACKEND_SQLITE, createTrackingStorage
+from octoprint_MaintenanceManager.utils.odometer import Odometer
+
+from gcode_corpora import CORPORA
+
+RESULTS_FOLDER = os.path.join(BENCHMARK_FOLDER, "results")
+
+
+class _TrackingServiceBenchmark():
+    # a TrackingService without storage timer, in a temporary data folder
+    def __init__(self, fastMode=False):
+        self._dataFolder = tempfile.TemporaryDirectory()
+        self.trackingService = TrackingService()
+        self.trackingService.initialize(self._dataFolder.name, fastMode=fastMode)
+        self.trackingService._storageTimer.cancel()
+
+    def close(self):
+        self.trackingService.shutdown()
+        self._dataFolder.cleanup()
+
+
+def _createOdometerTarget():
+    return Odometer().processGCodeLine, None
+
+
+def _createTrackingServiceTarget():
+    benchmark = _TrackingServiceBenchmark()
+    return benchmark.trackingService.processGCodeLine, benchmark.close
+
+
+def _createFastTrackingServiceTarget():
+    benchmark = _TrackingServiceBenchmark(fastMode=True)
+    return benchmark.trackingService.processGCodeLine, benchmark.close
+
+
+def _createSentGCodeHookTarget():
+    benchmark = _TrackingServiceBenchmark()
+    maintenanceService = MaintenanceService()
+    maintenanceService.initialize(benchmark._dataFolder.name, benchmark.trackingService.getCounterFunctions())
+    # typical rules: one per axis, the nozzle and the print time, none of them gets due
+    maintenanceService.setRules([
+        {"id": counterName, "name": counterName, "counter": counterName, "interval": 1e15}
+        for counterName in ("x", "y", "z", "t0", "printTime")
+    ])
+    plugin = MaintenanceManagerPlugin()
+    plugin.trackingService = benchmark.trackingService
+    plugin.maintenanceService = maintenanceService
+    plugin.metricsService = MetricsService()
+    plugin.metricsService.initialize(benchmark.trackingService)
+
+    def sentGCodeHook(line):
+        plugin.sentGCodeHook(None, "sent", line, None, None)
+    return sentGCodeHook, benchmark.close
+
+
+# one save per line: each line changes the values like one storage timer tick does
+def _createPersistenceTarget(backend):
+    dataFolder = tempfile.TemporaryDirectory()
+    storage = createTrackingStorage(backend, dataFolder.name)
+    storage.load()
+    odometer = Odometer()
+
+    def save(line):
+        odometer.processGCodeLine(line)
+        odometerSnapshot = odometer.getSnapshot()
+        storage.save({
+            "totalDuration": 0,
+            "axisTraveling.x": odometerSnapshot.axisTravelingX,
+            "axisTraveling.y": odometerSnapshot.axisTravelingY,
+            "axisTraveling.z": odometerSnapshot.axisTravelingZ,
+            "extrusionTraveling": list(odometerSnapshot.extrusionTraveling),
+            "arcLength": odometerSnapshot.arcLength
+        })
+
+    def close():
+        storage.close()
+        dataFolder.cleanup()
+    return save, close
+
+
+# name -> (create function returning (target, close function), lines per corpus; persistence is fsync bound)
+TARGETS = {
+    "Odometer.processGCodeLine": (_createOdometerTarget, None),
+    "TrackingService.processGCodeLine": (_createTrackingServiceTarget, None),
+    "TrackingService.processGCodeLine(fast)": (_createFastTrackingServiceTarget, None),
+    "sentGCodeHook": (_createSentGCodeHookTarget, None),
+    "TrackingStorage.save(json)": (lambda: _createPersistenceTarget(STORAGE_BACKEND_JSON), 500),
+    "TrackingStorage.save(sqlite)": (lambda: _createPersistenceTarget(STORAGE_BACKEND_SQLITE), 500)
+}
+
+
+def _measureThroughput(createTarget, lines, rounds):
+    best = None
+    for _ in range(rounds):
+        target, close = createTarget()
+        startTime = time.perf_counter()
+        for line in lines:
+            target(line)
+        duration = time.perf_counter() - startTime
+        if close != None:
+            close()
+        best = duration if best == None else min(best, duration)
+    return len(lines) / best
+
+
+def _measureLatency(createTarget, lines):
+    target, close = createTarget()
+    clock = time.perf_counter_ns
+    latencies = []
+    for line in lines:
+        startTime = clock()
+        target(line)
+        latencies.append(clock() - startTime)
+    if close != None:
+        close()
+    latencies.sort()
+    return {
+        "p50": latencies[len(latencies) // 2],
+        "p99": latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+    }
+
+
+def _measureAllocations(createTarget, lines):
+    target, close = createTarget()
+    tracemalloc.start()
+    startSize = tracemalloc.get_traced_memory()[0]
+    for line in lines:
+        target(line)
+    currentSize, peakSize = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if close != None:
+        close()
+    return {
+        "peakBytesPer1000Lines": (peakSize - startSize) * 1000.0 / len(lines),
+        "retainedBytesPer1000Lines": (currentSize - startSize) * 1000.0 / len(lines)
+    }
+
+
+def runSuite(numberOfLines, rounds):
+    results = {}
+    for corpusName, createCorpus in CORPORA.items():
+        corpusLines = createCorpus(numberOfLines)
+        for targetName, (createTarget, maxLines) in TARGETS.items():
+            lines = corpusLines if maxLines == None else corpusLines[:maxLines]
+            result = {
+                "lines": len(lines),
+                "linesPerSecond": _measureThroughput(createTarget, lines, rounds)
+            }
+            latency = _measureLatency(createTarget, lines)
+            result["p50LatencyNs"] = latency["p50"]
+            result["p99LatencyNs"] = latency["p99"]
+            result.update(_measureAllocations(createTarget, lines))
+            results[corpusName + "/" + targetName] = result
+            print("{:<54} {:>12,.0f} lines/sec {:>9,.0f} ns p99 {:>10,.0f} bytes/1000 lines".format(
+                corpusName + "/" + targetName, result["linesPerSecond"], result["p99LatencyNs"],
+                result["peakBytesPer1000Lines"]))
+    return results
+
+
+def _currentCommit():
+    try:
+        commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARK_FOLDER,
+                                         stderr=subprocess.DEVNULL).decode().strip()
+        dirty = subprocess.call(["git", "diff", "--quiet", "HEAD"], cwd=BENCHMARK_FOLDER,
+                                stderr=subprocess.DEVNULL) != 0
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compareResults(results, otherResults):
+    print("")
+    if (otherResults["python"] != results["python"] or otherResults["machine"] != results["machine"]):
+        print("Warning: the results of " + otherResults["commit"] + " were measured with Python " +
+              otherResults["python"] + " on " + otherResults["machine"] + ", the numbers are not comparable")
+    print("Change against " + otherResults["commit"] + " (lines/sec, p99):")
+    for name, result in results["results"].items():
+        otherResult = otherResults["results"].get(name)
+        if otherResult == None:
+            continue
+        print("{:<54} {:>+8.1f}% {:>+8.1f}%".format(
+            name,
+            (result["linesPerSecond"] / otherResult["linesPerSecond"] - 1.0) * 100.0,
+            (result["p99LatencyNs"] / float(max(otherResult["p99LatencyNs"], 1)) - 1.0) * 100.0))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark suite of the G-code tracking hot path")
+    parser.add_argument("--lines", type=int, default=100000, help="lines per corpus")
+    parser.add_argument("--rounds", type=int, default=3, help="throughput rounds, the best one counts")
+    parser.add_argument("--compare", help="commit of stored results to compare with")
+    arguments = parser.parse_args()
+
+    results = {
+        "commit": _currentCommit(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "lines": arguments.lines,
+        "results": runSuite(arguments.lines, arguments.rounds)
+    }
+
+    os.makedirs(RESULTS_FOLDER, exist_ok=True)
+    resultsFileLocation = os.path.join(RESULTS_FOLDER, results["commit"] + ".json")
+    with open(resultsFileLocation, "w") as resultsFile:
+        json.dump(results, resultsFile, indent=4)
+    print("Results: " + resultsFileLocation)
+
+    if arguments.compare != None:
+        otherResultsFileLocation = os.path.join(RESULTS_FOLDER, arguments.compare + ".json")
+        if (os.path.exists(otherResultsFileLocation) == False):
+            sys.exit("No results of " + arguments.compare + " in " + RESULTS_FOLDER + ", the results are only stored "
+                     "locally: run the suite on that commit first")
+        with open(otherResultsFileLocation) as otherResultsFile:
+            compareResults(results, json.load(otherResultsFile))
@@ -3,30 +3,120 @@ from __future__ import absolute_import
 
 
 
+import os
+from time import perf_counter
+
 import octoprint.plugin
 from octoprint.events import Events
 
 from octoprint_MaintenanceManager.api.MaintenanceManagerAPI import MaintenanceManagerAPI
-from octoprint_MaintenanceManager.services.MaintenanceService import MaintenanceService
-from octoprint_MaintenanceManager.services.TrackingService import TrackingService
 
 
 class MaintenanceManagerPlugin(
     MaintenanceManagerAPI,
+    octoprint.plugin.StartupPlugin,
     octoprint.plugin.SettingsPlugin,
     octoprint.plugin.AssetPlugin,
     octoprint.plugin.TemplatePlugin,
-    octoprint.plugin.EventHandlerPlugin
+    octoprint.plugin.EventHandlerPlugin,
+    octoprint.plugin.ShutdownPlugin
 ):
 
     def initialize(self):
+        # the services are created in on_after_startup, until then hook, events and API do nothing: G-code lines and
+        # PRINT_* events that arrive before are not tracked (see on_after_startup)
+        self.trackingService = None
+        self.maintenanceService = None
+        self.metricsService = None
+        self.trackingPublisher = None
+        self.gcodeFileAnalyzer = None
+
+    # services imported, values loaded and timers started after the server startup, so they don't delay the
+    # loading of all plugins
+    def on_after_startup(self):
+        from octoprint_MaintenanceManager.services.MaintenanceService import MaintenanceService
+        from octoprint_MaintenanceManager.services.TrackingService import TrackingService
+        from octoprint_MaintenanceManager.services.TrackingPublisher import TrackingPublisher
+        from octoprint_MaintenanceManager.services.GCodeFileAnalyzer import GCodeFileAnalyzer
+        from octoprint_MaintenanceManager.services.FileAnalysisCache import FileAnalysisCache
+        from octoprint_MaintenanceManager.services.MetricsService import MetricsService
+
+        trackingService = TrackingService()
+        trackingService.initialize(self.get_plugin_data_folder(), self._logger,
+                                   asyncProcessing=self._settings.get_boolean(["asyncTrackingEnabled"]),
+                                   asyncQueueSize=self._settings.get_int(["asyncTrackingQueueSize"]),
+                                   arcAxisProjection=self._settings.get_boolean(["arcAxisProjection"]),
+                                   storageMaxStaleness=self._settings.get_float(["storageMaxStaleness"]),
+                                   fastMode=self._settings.get_boolean(["fastTrackingEnabled"]),
+                                   storageBackend=self._settings.get(["storageBackend"]))
+        self.metricsService = MetricsService()
+        self.metricsService.initialize(trackingService)
         self.maintenanceService = MaintenanceService()
-        self.trackingService = TrackingService()
-        self.trackingService.initialize(self.get_plugin_data_folder(), self._logger)
+        self.maintenanceService.initialize(self.get_plugin_data_folder(), trackingService.getCounterFunctions(),
+                                           self._onMaintenanceDue, self._logger)
+        self.maintenanceService.setRules(self._settings.get(["maintenanceRules"]))
+        fileAnalysisCache = FileAnalysisCache(os.path.join(self.get_plugin_data_folder(), "fileAnalysisCache.json"),
+                                              maxSize=self._settings.get_int(["fileAnalysisCacheSize"]) * 1024,
+                                              logger=self._logger)
+        fileAnalysisCache.load()
+        self.gcodeFileAnalyzer = GCodeFileAnalyzer(fileAnalysisCache,
+                                                   arcAxisProjection=self._settings.get_boolean(["arcAxisProjection"]),
+                                                   maxWorkers=self._settings.get_int(["fileAnalysisWorkers"]),
+                                                   logger=self._logger)
+        if (self._settings.get_boolean(["fileAnalysisEnabled"])):
+            self.gcodeFileAnalyzer.start()
+        # last, the hook starts tracking as soon as it is assigned
+        self.trackingService = trackingService
+        # normally nothing is printed before the server is up. If a job is already running, its PRINT_STARTED was
+        # ignored, so the tracking starts now (the lines sent so far are missing)
+        if (self._printer.is_printing() or self._printer.is_paused()):
+            currentJob = self._printer.get_current_job()
+            jobFile = currentJob["file"] if currentJob != None and currentJob.get("file") != None else {}
+            trackingService.startTracking({
+                "fileName": jobFile.get("name"),
+                "filePath": jobFile.get("path"),
+                "origin": jobFile.get("origin"),
+                "user": currentJob.get("user") if currentJob != None else None
+            })
+            if (self._printer.is_paused()):
+                trackingService.pauseTracking()
+
+        self.trackingPublisher = TrackingPublisher(self._getRawTrackingInformation, self._sendPluginMessage,
+                                                   maxRate=self._settings.get_float(["pushUpdateMaxRate"]),
+                                                   logger=self._logger)
+        self.trackingPublisher.start()
+
+    def on_shutdown(self):
+        if (self.trackingPublisher != None):
+            self.trackingPublisher.stop()
+        if (self.gcodeFileAnalyzer != None):
+            self.gcodeFileAnalyzer.stop()
+        if (self.trackingService != None):
+            self.trackingService.shutdown()
+
+    def _sendPluginMessage(self, data):
+        self._plugin_manager.send_plugin_message(self._identifier, data)
+
+    # a maintenance rule is due (called once per rule, until it is marked as done)
+    def _onMaintenanceDue(self, ruleInformation):
+        self._logger.info("Maintenance due: '" + ruleInformation["name"] + "'")
+        self._event_bus.fire("plugin_" + self._identifier + "_maintenance_due", ruleInformation)
+        self._sendPluginMessage({
+            "action": "maintenanceDue",
+            "rule": ruleInformation
+        })
 
     def on_event(self, event, payload):
+        if (self.trackingService == None):
+            # before on_after_startup
+            return
         if event == Events.PRINT_STARTED:
-            self.trackingService.startTracking()
+            self.trackingService.startTracking({
+                "fileName": payload.get("name"),
+                "filePath": payload.get("path"),
+                "origin": payload.get("origin"),
+                "user": payload.get("user")
+            })
             return
         if event == Events.PRINT_PAUSED:
             self.trackingService.pauseTracking()
@@ -34,23 +124,86 @@ class MaintenanceManagerPlugin(
         if event == Events.PRINT_RESUMED:
             self.trackingService.resumeTracking()
             return
-        if event == Events.PRINT_DONE or event == Events.PRINT_FAILED or event == Events.PRINT_CANCELLED:
-            self.trackingService.stopTracking()
+        if event == Events.PRINT_DONE:
+            self.trackingService.stopTracking("done")
+            return
+        if event == Events.PRINT_FAILED:
+            self.trackingService.stopTracking("failed")
+            return
+        if event == Events.PRINT_CANCELLED:
+            self.trackingService.stopTracking("cancelled")
+            return
+        if event == Events.FILE_ADDED:
+            # also sent if an existing file is overwritten or moved (after FILE_REMOVED of the source)
+            if payload["storage"] == "local" and payload["type"] != None and "gcode" in payload["type"]:
+                filePath = self._file_manager.path_on_disk(payload["storage"], payload["path"])
+                self.gcodeFileAnalyzer.removeFile(filePath)
+                self.gcodeFileAnalyzer.analyseFile(filePath)
+            return
+        if event == Events.FILE_REMOVED:
+            if payload["storage"] == "local":
+                self.gcodeFileAnalyzer.removeFile(self._file_manager.path_on_disk(payload["storage"], payload["path"]))
+            return
+        if event == Events.FOLDER_REMOVED:
+            if payload["storage"] == "local":
+                self.gcodeFileAnalyzer.removeFolder(self._file_manager.path_on_disk(payload["storage"], payload["path"]))
             return
 
     # eval g-code (comm.sending_thread)
     def sentGCodeHook(self, comm_instance, phase, cmd, cmd_type, gcode, *args, **kwargs):
-        # self.maintenanceService.analyseGCode(gcode, cmd) # cmd = M110 N0, gcode = M110
+        if (self.trackingService == None):
+            # before on_after_startup
+            return
+        # only every n-th line is timed, to keep the overhead low
+        hookLatency = self.metricsService.hookLatency
+        hookLatency.callCount += 1
+        sampled = hookLatency.callCount % hookLatency.sampleInterval == 0
+        if (sampled):
+            startTime = perf_counter()
+
         self.trackingService.processGCodeLine(cmd) # cmd = M110 N0, gcode = M110
+        self.maintenanceService.checkDue()
+
+        if (sampled):
+            hookLatency.observe(perf_counter() - startTime)
 
         return
 
     ##~~ SettingsPlugin mixin
     def get_settings_defaults(self):
         return dict(
-            installed_version=self._plugin_version
+            installed_version=self._plugin_version,
+            # evaluate the sent G-code in a separate thread, needs a restart
+            asyncTrackingEnabled=False,
+            asyncTrackingQueueSize=10000,
+            # reduced G0/G1 evaluation for very high line rates, with a sampled accuracy check, needs a restart
+            fastTrackingEnabled=False,
+            # X/Y movement of G2/G3 along the arc (True) or like a linear move (False)
+            arcAxisProjection=True,
+            # while printing, changed tracking values are written at most every n seconds
+            storageMaxStaleness=10.0,
+            # "json" or "sqlite", after a switch the values are migrated from the previous storage
+            storageBackend="json",
+            # push changed tracking values to the browser at most n times per second, 0 = only polling
+            pushUpdateMaxRate=2.0,
+            # pre-compute the travel of uploaded G-code files in separate processes
+            fileAnalysisEnabled=True,
+            fileAnalysisWorkers=1,
+            # kB of analysis results kept in the plugin data folder, least recently used are removed first
+            fileAnalysisCacheSize=1024,
+            # [{"id", "name", "counter", "interval"}], counter: printTime (seconds), x, y, z, arcLength, t0..t9 (mm)
+            maintenanceRules=[]
         )
 
+    def on_settings_save(self, data):
+        octoprint.plugin.SettingsPlugin.on_settings_save(self, data)
+        if (self.maintenanceService != None):
+            self.maintenanceService.setRules(self._settings.get(["maintenanceRules"]))
+
+    ##~~ Custom events, fired as "plugin_MaintenanceManager_maintenance_due"
+    def register_custom_events(self, *args, **kwargs):
+        return ["maintenance_due"]
+
     ##~~ TemplatePlugin mixin
     def get_template_configs(self):
         return [
@@ -129,4 +282,5 @@ def __plugin_load__():
     __plugin_hooks__ = {
         "octoprint.plugin.softwareupdate.check_config": __plugin_implementation__.get_update_information,
         "octoprint.comm.protocol.gcode.sent": __plugin_implementation__.sentGCodeHook,
+        "octoprint.events.register_custom_events": __plugin_implementation__.register_custom_events,
     }
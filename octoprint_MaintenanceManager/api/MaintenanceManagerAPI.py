@@ -1,47 +1,274 @@
 # coding=utf-8
 from __future__ import absolute_import
 
-import logging
-
 import octoprint.plugin
-import datetime
 import flask
-from flask import jsonify, request, make_response, Response, send_file, abort
+from flask import request, Response, abort
 import json
+import os
+import time
 
 from octoprint_MaintenanceManager.utils import StringUtils
 
 
 class MaintenanceManagerAPI(octoprint.plugin.BlueprintPlugin):
 
+    # values of the current state version and the (lazy) created responses
+    _trackingInformationCache = None
+
+    # the services are created in on_after_startup
+    def _abortIfNotStarted(self):
+        if (self.trackingService == None):
+            abort(503, description="MaintenanceManager is starting")
+
+    def _getTrackingInformationCache(self):
+        odometerSnapshot = self.trackingService.getOdometerSnapshot()
+        currentTotalDuration = self.trackingService.getCurrentTotalDuration()
+        stateVersion = self.trackingService.getStateVersion(odometerSnapshot, currentTotalDuration)
+
+        cache = self._trackingInformationCache
+        if (cache == None or cache["stateVersion"] != stateVersion):
+            cache = {
+                "stateVersion": stateVersion,
+                "odometerSnapshot": odometerSnapshot,
+                "currentTotalDuration": currentTotalDuration,
+                "text": None,
+                "raw": None
+            }
+            self._trackingInformationCache = cache
+        return cache
+
+    # formatted tracking information of the current state version: (stateVersion, trackingInformation, json body)
+    def _getTrackingInformation(self):
+        cache = self._getTrackingInformationCache()
+        if (cache["text"] == None):
+            trackingInformation = self._createTrackingInformation(cache["odometerSnapshot"], cache["currentTotalDuration"])
+            cache["text"] = (cache["stateVersion"], trackingInformation, json.dumps({
+                "trackingInformation": trackingInformation
+            }))
+        return cache["text"]
+
+    # raw numbers of the current state version: (stateVersion, trackingValues, json body), also used for the push messages
+    def _getRawTrackingInformation(self):
+        cache = self._getTrackingInformationCache()
+        if (cache["raw"] == None):
+            trackingValues = self._createRawTrackingInformation(cache["odometerSnapshot"], cache["currentTotalDuration"])
+            cache["raw"] = (cache["stateVersion"], trackingValues, json.dumps({
+                "version": 2,
+                "trackingInformation": trackingValues
+            }))
+        return cache["raw"]
+
+    # all distances in mm, durations in seconds
+    def _createRawTrackingInformation(self, odometerSnapshot, currentTotalDuration):
+        trackingSince = self.trackingService.getTrackingSince()
+        trackingValues = {
+            "trackingSince": trackingSince.isoformat() if trackingSince != None else None,
+            "trackingState": self.trackingService.currentTrackingState,
+            "totalPrintTime": currentTotalDuration,
+            "axisTraveling": {
+                "x": odometerSnapshot.axisTravelingX,
+                "y": odometerSnapshot.axisTravelingY,
+                "z": odometerSnapshot.axisTravelingZ
+            },
+            # index = tool id
+            "extrusionTraveling": list(odometerSnapshot.extrusionTraveling),
+            "arcLength": odometerSnapshot.arcLength
+        }
+        return trackingValues
+
+    def _createTrackingInformation(self, odometerSnapshot, currentTotalDuration):
+        trackingSince = self.trackingService.getTrackingSince()
+
+        trackingSince = StringUtils.formatDateTime(trackingSince)
+        totalPrintTime = StringUtils.secondsToText(currentTotalDuration)
+        xMovement = StringUtils.mmToText(odometerSnapshot.axisTravelingX)
+        yMovement = StringUtils.mmToText(odometerSnapshot.axisTravelingY)
+        zMovement = StringUtils.mmToText(odometerSnapshot.axisTravelingZ)
+
+        eMovement = StringUtils.mmToText(odometerSnapshot.extrusionTraveling[0])
+        # T0 is always listed, the other tools only if they were used
+        toolMovements = {}
+        for toolIndex, extrusion in enumerate(odometerSnapshot.extrusionTraveling):
+            if (toolIndex == 0 or extrusion != 0.0):
+                toolMovements["T" + str(toolIndex)] = StringUtils.mmToText(extrusion)
+        trackingInformation = {
+            "trackingSince": trackingSince,
+            "totalPrintTime": totalPrintTime,
+            "xMovement": xMovement,
+            "yMovement": yMovement,
+            "zMovement": zMovement,
+            "eMovement": eMovement,
+            "toolMovements": toolMovements
+        }
+        return trackingInformation
+
     #######################################################################################   LOAD TRACKING INFORMATION
+    # The formatted response is cached per state version of the tracking values. The version is also the ETag, so a
+    # poll with an unchanged version gets a "304 Not Modified" without body.
+    # ?format=raw: numbers instead of formatted text (mm, seconds), the client is responsible for the formatting
     @octoprint.plugin.BlueprintPlugin.route("/trackingInformation", methods=["GET"])
     def loadDatabaseMetaData(self):
 
-        trackingInformation = None
-
-        if (self.trackingService != None):
-            trackingSince = self.trackingService.getTrackingSince()
-            totalPrintTime = self.trackingService.getCurrentTotalDuration()
-            axisTraveleing = self.trackingService.getAxisTraveling()
-            extrusionTraveleing = self.trackingService.getExtrusionTraveling()
-
-            trackingSince = StringUtils.formatDateTime(trackingSince)
-            totalPrintTime = StringUtils.secondsToText(totalPrintTime)
-            xMovement = StringUtils.mmToText(axisTraveleing.x)
-            yMovement = StringUtils.mmToText(axisTraveleing.y)
-            zMovement = StringUtils.mmToText(axisTraveleing.z)
-
-            eMovement = StringUtils.mmToText(extrusionTraveleing[0])
-            trackingInformation = {
-                "trackingSince": trackingSince,
-                "totalPrintTime": totalPrintTime,
-                "xMovement": xMovement,
-                "yMovement": yMovement,
-                "zMovement": zMovement,
-                "eMovement": eMovement
+        if (self.trackingService == None):
+            return flask.jsonify({
+                "trackingInformation": None
+            })
+
+        if (request.values.get("format") == "raw"):
+            stateVersion, trackingInformation, responseBody = self._getRawTrackingInformation()
+            stateVersion = stateVersion + "-raw"
+        else:
+            stateVersion, trackingInformation, responseBody = self._getTrackingInformation()
+
+        if (stateVersion in request.if_none_match):
+            response = Response(status=304)
+        else:
+            response = Response(responseBody, mimetype="application/json")
+
+        response.set_etag(stateVersion)
+        # the browser must ask each time, but can reuse its cached body
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    #######################################################################################   JOB FORECAST
+    # travel a G-code file will add (raw numbers, mm), and the totals after printing it
+    # ?origin=local&path=folder/file.gcode, the analysis is started if the file is not analysed yet
+    @octoprint.plugin.BlueprintPlugin.route("/jobForecast", methods=["GET"])
+    def loadJobForecast(self):
+        self._abortIfNotStarted()
+        origin = request.values.get("origin", "local")
+        path = request.values.get("path")
+        if (path == None):
+            abort(400, description="path is missing")
+
+        jobForecast = {
+            "state": None,
+            "job": None,
+            "afterJob": None,
+            # maintenance rules that will be due after the job
+            "dueRules": []
+        }
+        if (origin != "local"):
+            # e.g. files on the printer SD card
+            return flask.jsonify({
+                "jobForecast": jobForecast
+            })
+
+        filePath = self._file_manager.path_on_disk(origin, path)
+        if (os.path.isfile(filePath) == False):
+            abort(404, description="file not found")
+
+        self.gcodeFileAnalyzer.analyseFile(filePath)
+        state, jobValues = self.gcodeFileAnalyzer.getAnalysis(filePath)
+        jobForecast["state"] = state
+        if (jobValues != None):
+            currentValues = self._getRawTrackingInformation()[1]
+            jobForecast["job"] = jobValues
+            jobForecast["afterJob"] = {
+                "axisTraveling": {
+                    axis: currentValues["axisTraveling"][axis] + jobValues["axisTraveling"][axis]
+                    for axis in ("x", "y", "z")
+                },
+                "extrusionTraveling": [
+                    current + job
+                    for current, job in zip(currentValues["extrusionTraveling"], jobValues["extrusionTraveling"])
+                ],
+                "arcLength": currentValues["arcLength"] + jobValues["arcLength"]
+            }
+            # the print time of a job is unknown here
+            counterDeltas = {
+                "x": jobValues["axisTraveling"]["x"],
+                "y": jobValues["axisTraveling"]["y"],
+                "z": jobValues["axisTraveling"]["z"],
+                "arcLength": jobValues["arcLength"]
             }
+            for toolIndex, extrusion in enumerate(jobValues["extrusionTraveling"]):
+                counterDeltas["t" + str(toolIndex)] = extrusion
+            jobForecast["dueRules"] = self.maintenanceService.getDueRulesAfter(counterDeltas)
+
+        return flask.jsonify({
+            "jobForecast": jobForecast
+        })
+
+    #######################################################################################   MAINTENANCE RULES
+    # all rules with their state: currentValue, nextDueValue, remaining (negative if overdue), due
+    @octoprint.plugin.BlueprintPlugin.route("/maintenanceRules", methods=["GET"])
+    def loadMaintenanceRules(self):
+        self._abortIfNotStarted()
+        return flask.jsonify({
+            "maintenanceRules": self.maintenanceService.getRules()
+        })
+
+    # the maintenance was done, the next interval starts now
+    @octoprint.plugin.BlueprintPlugin.route("/maintenanceRules/<ruleId>/done", methods=["POST"])
+    def markMaintenanceDone(self, ruleId):
+        self._abortIfNotStarted()
+        ruleInformation = self.maintenanceService.markDone(ruleId)
+        if (ruleInformation == None):
+            abort(404, description="maintenance rule not found")
+        return flask.jsonify({
+            "maintenanceRule": ruleInformation
+        })
+
+    #######################################################################################   TRACKING HISTORY
+    # cumulative counter records, e.g. for the travel per week
+    # ?from=<seconds since epoch, default one week ago>&to=<default now>&resolution=<minute|hour|day, default finest>
+    @octoprint.plugin.BlueprintPlugin.route("/trackingHistory", methods=["GET"])
+    def loadTrackingHistory(self):
+        self._abortIfNotStarted()
+        try:
+            endTime = float(request.values.get("to", time.time()))
+            startTime = float(request.values.get("from", endTime - 7 * 24 * 3600))
+        except ValueError:
+            abort(400, description="from/to must be seconds since epoch")
+        resolution = request.values.get("resolution")
+        if (resolution not in (None, "minute", "hour", "day")):
+            abort(400, description="unknown resolution")
+
+        return flask.jsonify({
+            "trackingHistory": self.trackingService.getHistory(startTime, endTime, resolution)
+        })
+
+    #######################################################################################   JOB LEDGER
+    # what each print job added, newest first
+    # ?page=0&pageSize=20&file=<file name>&from=<seconds since epoch>&to=<seconds since epoch>
+    # "totals" is the sum of all jobs matching the filter, not only of the page
+    @octoprint.plugin.BlueprintPlugin.route("/jobLedger", methods=["GET"])
+    def loadJobLedger(self):
+        self._abortIfNotStarted()
+        try:
+            page = int(request.values.get("page", 0))
+            pageSize = int(request.values.get("pageSize", 20))
+            startTime = float(request.values["from"]) if "from" in request.values else None
+            endTime = float(request.values["to"]) if "to" in request.values else None
+        except ValueError:
+            abort(400, description="page/pageSize must be integers, from/to seconds since epoch")
+        if (page < 0 or pageSize < 1 or pageSize > 500):
+            abort(400, description="page must be >= 0, pageSize between 1 and 500")
+
+        jobs = self.trackingService.getJobs(request.values.get("file"), startTime, endTime)
+
+        return flask.jsonify({
+            "jobs": self.trackingService.getJobPage(jobs, page, pageSize),
+            "page": page,
+            "pageSize": pageSize,
+            "jobCount": len(jobs),
+            "totals": self.trackingService.getJobTotals(jobs)
+        })
+
+    #######################################################################################   TRACKING TRANSITIONS
+    # last start/pause/resume/stop events, including the ignored ones, oldest first
+    @octoprint.plugin.BlueprintPlugin.route("/trackingTransitions", methods=["GET"])
+    def loadTrackingTransitions(self):
+        self._abortIfNotStarted()
         return flask.jsonify({
-            "trackingInformation": trackingInformation
+            "trackingTransitions": self.trackingService.getTransitionLog()
         })
 
+    #######################################################################################   METRICS
+    # hot path instrumentation in the Prometheus text format, for scraping
+    @octoprint.plugin.BlueprintPlugin.route("/metrics", methods=["GET"])
+    def loadMetrics(self):
+        self._abortIfNotStarted()
+        return Response(self.metricsService.renderPrometheusText(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,207 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+from collections import deque
+
+# counters compared by the accuracy check, see FastTracking.getStatistics
+CHECKED_COUNTERS = ("x", "y", "z", "arcLength") + tuple("t" + str(toolIndex) for toolIndex in range(10))
+
+
+class FastTracking():
+    """
+    Fast mode of the TrackingService for very high line rates (e.g. small-segment G-code), when the lines are evaluated
+    in the sending thread.
+
+    The sent lines are only collected, every runLength lines the whole run is evaluated by Odometer.processGCodeLines,
+    the loop that keeps the state in local variables and handles the G0/G1 lines inline. So the per-line costs of
+    Odometer.processGCodeLine (handler dispatch, line statistics, seqlock and position copy per line) are paid only once
+    per run. The totals of the Odometer lag behind by at most runLength lines, flush evaluates the collected lines
+    (e.g. before the values are persisted).
+
+    Runs where most lines need a handler of the Odometer (arcs, tool changes, mode changes...), e.g. ArcWelder output,
+    are not faster than the line by line evaluation. After such a run, the next lineByLineLength lines are evaluated
+    line by line, so the fast mode is never slower than the normal one.
+
+    Accuracy self-check: after every checkInterval lines, the next checkLength lines are also replayed line by line
+    through a full Odometer that starts with the same position and modes. The difference between both results is
+    summed up as drift.
+
+    >>> from octoprint_MaintenanceManager.utils.odometer import Odometer
+    >>> odometer = Odometer()
+    >>> fastTracking = FastTracking(odometer, runLength=3, checkInterval=2, checkLength=3)
+    >>> for line in ["G1 X10 E1", "G1 X12", "G91", "G1 X3 E1 ; relative", "M83", "G1 Y-2 E0.5", "G1 Z0.2"]:
+    ...     fastTracking.processGCodeLine(line)
+    >>> odometer.getSnapshot()[:3], fastTracking.getQueueDepth()
+    ((15.0, 2.0, 0.0), 1)
+    >>> fastTracking.flush()
+    >>> odometer.getSnapshot()[:3], odometer.getTotalExtrusionTraveling()[0]
+    ((15.0, 2.0, 0.2), 2.5)
+    >>> statistics = fastTracking.getStatistics()
+    >>> statistics["runs"], statistics["checks"], statistics["checkedLines"], statistics["relativeDrift"]
+    (5, 1, 3, 0.0)
+
+    A run of handler lines, the following lines are evaluated line by line:
+
+    >>> for line in ["T1", "G2 X20 Y2 I0 J5", "G92 E0", "G1 X25"]:
+    ...     fastTracking.processGCodeLine(line)
+    >>> fastTracking.getQueueDepth(), fastTracking.getStatistics()["lineByLineLines"]
+    (0, 1)
+    """
+
+    RUN_LENGTH = 100
+    LINE_BY_LINE_LENGTH = 10000
+    # share of handler lines in a run, above it the lines are evaluated line by line
+    MAX_HANDLER_LINE_SHARE = 0.5
+    CHECK_INTERVAL = 10000
+    CHECK_LENGTH = 100
+    # a check with more relative drift is logged (once)
+    DRIFT_WARNING_THRESHOLD = 0.000001
+
+    def __init__(self, odometer, runLength=RUN_LENGTH, lineByLineLength=LINE_BY_LINE_LENGTH,
+                 checkInterval=CHECK_INTERVAL, checkLength=CHECK_LENGTH, logger=None):
+        self.odometer = odometer
+        self.runLength = runLength
+        self.lineByLineLength = lineByLineLength
+        self.checkInterval = checkInterval
+        self.checkLength = checkLength
+        self._logger = logger
+
+        # appended by the sending thread, evaluated by whoever holds the _processingLock
+        self._pendingLines = deque()
+        self._processingLock = threading.Lock()
+        # > 0: lines left to evaluate line by line, see processGCodeLine
+        self._linesLineByLine = 0
+        self._handlerLineCount = self._countHandlerLines()
+
+        # <= 0 during a check, see processGCodeLines
+        self._linesUntilCheck = checkInterval
+        self._checkOdometer = None
+        self._checkStartSnapshot = None
+        self._driftWarningLogged = False
+
+        self.lineCount = 0
+        self.runCount = 0
+        self.lineByLineCount = 0
+        self.checkCount = 0
+        self.checkedLineCount = 0
+        # counterName -> summed up difference (mm) between fast mode and full Odometer
+        self.drift = dict.fromkeys(CHECKED_COUNTERS, 0.0)
+        # summed up movement of the checked lines (mm), full Odometer
+        self.checkedTravel = 0.0
+
+    # called from comm.sending_thread, keep it cheap. Only the sending thread appends, so the lines keep their order
+    def processGCodeLine(self, line):
+        if (self._linesLineByLine > 0):
+            # nothing is pending (see below), so a flush of another thread doesn't touch the Odometer
+            self._linesLineByLine -= 1
+            self.lineByLineCount += 1
+            self.odometer.processGCodeLine(line)
+            return
+        pendingLines = self._pendingLines
+        pendingLines.append(line)
+        if (len(pendingLines) >= self.runLength):
+            self.flush()
+            handlerLineCount = self._countHandlerLines()
+            if (handlerLineCount - self._handlerLineCount > self.runLength * self.MAX_HANDLER_LINE_SHARE):
+                self._linesLineByLine = self.lineByLineLength
+            self._handlerLineCount = handlerLineCount
+
+    # evaluate all collected lines in the calling thread, e.g. before the values are persisted
+    def flush(self):
+        with self._processingLock:
+            pendingLines = self._pendingLines
+            count = len(pendingLines)
+            if (count == 0):
+                return
+            popleft = pendingLines.popleft
+            self.processGCodeLines([popleft() for _ in range(count)])
+
+    def getQueueDepth(self):
+        return len(self._pendingLines)
+
+    # all lines of a list, returns the number of lines (like Odometer.processGCodeLines)
+    def processGCodeLines(self, lines):
+        lineCount = len(lines)
+        index = 0
+        while (index < lineCount):
+            checking = self._linesUntilCheck <= 0
+            if (checking == True):
+                # (the rest of) a check
+                runEnd = min(lineCount, index + self.checkLength + self._linesUntilCheck)
+            else:
+                runEnd = min(lineCount, index + self._linesUntilCheck)
+            runLines = lines[index:runEnd]
+            self._linesUntilCheck -= runEnd - index
+            if (checking == True):
+                self._checkLines(runLines)
+            else:
+                self.odometer.processGCodeLines(runLines)
+            self.runCount += 1
+            index = runEnd
+        self.lineCount += lineCount
+        return lineCount
+
+    def getStatistics(self):
+        totalDrift = sum(self.drift.values())
+        return {
+            "lines": self.lineCount,
+            "runs": self.runCount,
+            "lineByLineLines": self.lineByLineCount,
+            "checks": self.checkCount,
+            "checkedLines": self.checkedLineCount,
+            "drift": dict(self.drift),
+            "relativeDrift": totalDrift / self.checkedTravel if self.checkedTravel > 0.0 else 0.0
+        }
+
+    def _countHandlerLines(self):
+        lineStatistics = self.odometer.lineStatistics
+        return lineStatistics["arc"] + lineStatistics["state"] + lineStatistics["tool"]
+
+    # lines of an accuracy check: the run loop under test and line by line the full Odometer
+    def _checkLines(self, lines):
+        if (self._checkOdometer == None):
+            self._checkOdometer = self.odometer.copyWithoutTotals()
+            self._checkStartSnapshot = self.odometer.getSnapshot()
+        self.odometer.processGCodeLines(lines)
+        for line in lines:
+            self._checkOdometer.processGCodeLine(line)
+        self.checkedLineCount += len(lines)
+        if (self._linesUntilCheck <= -self.checkLength):
+            self._finishCheck()
+            self._linesUntilCheck = self.checkInterval
+
+    def _finishCheck(self):
+        startSnapshot = self._checkStartSnapshot
+        endSnapshot = self.odometer.getSnapshot()
+        checkSnapshot = self._checkOdometer.getSnapshot()
+        self._checkOdometer = None
+        self._checkStartSnapshot = None
+
+        fastValues = [endSnapshot.axisTravelingX - startSnapshot.axisTravelingX,
+                      endSnapshot.axisTravelingY - startSnapshot.axisTravelingY,
+                      endSnapshot.axisTravelingZ - startSnapshot.axisTravelingZ,
+                      endSnapshot.arcLength - startSnapshot.arcLength]
+        fastValues += [endExtrusion - startExtrusion for endExtrusion, startExtrusion in
+                       zip(endSnapshot.extrusionTraveling, startSnapshot.extrusionTraveling)]
+        fullValues = [checkSnapshot.axisTravelingX, checkSnapshot.axisTravelingY, checkSnapshot.axisTravelingZ,
+                      checkSnapshot.arcLength] + list(checkSnapshot.extrusionTraveling)
+
+        checkDrift = 0.0
+        checkTravel = 0.0
+        for counterName, fastValue, fullValue in zip(CHECKED_COUNTERS, fastValues, fullValues):
+            difference = abs(fastValue - fullValue)
+            self.drift[counterName] += difference
+            checkDrift += difference
+            checkTravel += fullValue
+        self.checkedTravel += checkTravel
+        self.checkCount += 1
+
+        if (checkDrift > checkTravel * self.DRIFT_WARNING_THRESHOLD and self._driftWarningLogged == False):
+            self._driftWarningLogged = True
+            message = ("Fast tracking differs from the full odometer by " + str(checkDrift) + "mm of " +
+                       str(checkTravel) + "mm in " + str(self.checkLength) + " lines")
+            if (self._logger != None):
+                self._logger.warning(message)
+            else:
+                print(message)
@@ -0,0 +1,169 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class FileAnalysisCache():
+    """
+    Persistent cache of the G-code file analysis results (see GCodeFileAnalyzer).
+
+    - Files: path -> size, modification time and content key (GCodeFileAnalyzer.hashGCodeFile). A lookup only hits,
+      if size and modification time are unchanged, so a modified file is analysed again without reading it here.
+    - Results: content key -> odometer deltas, in least recently used order. The same file under several paths
+      shares one result. If the results exceed maxSize (bytes of JSON), the least recently used ones are evicted
+      together with their paths.
+
+    The cache is written as a whole (temp-file and rename) after each change. Without a cacheFileLocation it only
+    lives in memory. Losing it is harmless, the files are analysed again.
+    """
+
+    DEFAULT_MAX_SIZE = 1024 * 1024
+
+    def __init__(self, cacheFileLocation=None, maxSize=DEFAULT_MAX_SIZE, logger=None):
+        self.cacheFileLocation = cacheFileLocation
+        self.maxSize = maxSize
+        self._logger = logger
+        self._lock = threading.RLock()
+        # filePath -> {"fileSize", "fileModified", "fileHash"}
+        self._files = {}
+        # fileHash -> {"result", "size"}, least recently used first
+        self._results = OrderedDict()
+        self._totalSize = 0
+        self.hitCount = 0
+        self.missCount = 0
+        self.evictionCount = 0
+
+    def load(self):
+        if (self.cacheFileLocation == None):
+            return
+        try:
+            with open(self.cacheFileLocation, "rt") as cacheFile:
+                cacheValues = json.load(cacheFile)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            self._logWarning("File analysis cache '" + self.cacheFileLocation + "' is corrupt, starting empty: " + str(e))
+            return
+
+        with self._lock:
+            self._files = cacheValues["files"]
+            self._results = OrderedDict()
+            self._totalSize = 0
+            # stored in least recently used order
+            for fileHash, result in cacheValues["results"]:
+                self._addResult(fileHash, result)
+            self._evict()
+
+    # the cached result or None, if the file is unknown or changed
+    def get(self, filePath, fileSize, fileModified):
+        with self._lock:
+            fileEntry = self._files.get(filePath)
+            if (fileEntry == None or fileEntry["fileSize"] != fileSize or fileEntry["fileModified"] != fileModified or
+                fileEntry["fileHash"] not in self._results):
+                self.missCount += 1
+                return None
+            self.hitCount += 1
+            self._results.move_to_end(fileEntry["fileHash"])
+            return self._results[fileEntry["fileHash"]]["result"]
+
+    def getHashes(self):
+        with self._lock:
+            return frozenset(self._results.keys())
+
+    # result None: the content is already cached (by hash), only the path is added
+    def put(self, filePath, fileSize, fileModified, fileHash, result=None):
+        with self._lock:
+            if (result != None):
+                if (fileHash in self._results):
+                    self._removeResult(fileHash)
+                self._addResult(fileHash, result)
+            elif (fileHash in self._results):
+                self._results.move_to_end(fileHash)
+            else:
+                # evicted in the meantime
+                return
+            self._files[filePath] = {
+                "fileSize": fileSize,
+                "fileModified": fileModified,
+                "fileHash": fileHash
+            }
+            self._evict()
+            self._save()
+
+    # file removed or modified, the result stays for other paths with the same content
+    def invalidate(self, filePath):
+        with self._lock:
+            if (self._files.pop(filePath, None) != None):
+                self._save()
+
+    # all files in the folder (and its subfolders)
+    def invalidateFolder(self, folderPath):
+        folderPrefix = os.path.join(folderPath, "")
+        with self._lock:
+            filePaths = [filePath for filePath in self._files if filePath.startswith(folderPrefix)]
+            for filePath in filePaths:
+                del self._files[filePath]
+            if (len(filePaths) > 0):
+                self._save()
+
+    def getStatistics(self):
+        with self._lock:
+            return {
+                "fileCount": len(self._files),
+                "resultCount": len(self._results),
+                "size": self._totalSize,
+                "maxSize": self.maxSize,
+                "hitCount": self.hitCount,
+                "missCount": self.missCount,
+                "evictionCount": self.evictionCount
+            }
+
+    def _addResult(self, fileHash, result):
+        size = len(json.dumps(result, separators=(",", ":")))
+        self._results[fileHash] = {
+            "result": result,
+            "size": size
+        }
+        self._totalSize += size
+
+    def _removeResult(self, fileHash):
+        self._totalSize -= self._results.pop(fileHash)["size"]
+
+    def _evict(self):
+        evictedHashes = set()
+        while (self._totalSize > self.maxSize and len(self._results) > 0):
+            fileHash = next(iter(self._results))
+            self._removeResult(fileHash)
+            evictedHashes.add(fileHash)
+            self.evictionCount += 1
+        if (len(evictedHashes) > 0):
+            self._files = {
+                filePath: fileEntry
+                for filePath, fileEntry in self._files.items()
+                if fileEntry["fileHash"] not in evictedHashes
+            }
+
+    def _save(self):
+        if (self.cacheFileLocation == None):
+            return
+        cacheValues = {
+            "files": self._files,
+            "results": [(fileHash, entry["result"]) for fileHash, entry in self._results.items()]
+        }
+        temporaryFileLocation = self.cacheFileLocation + ".tmp"
+        try:
+            with open(temporaryFileLocation, "wt") as temporaryFile:
+                temporaryFile.write(json.dumps(cacheValues, separators=(",", ":")))
+            os.replace(temporaryFileLocation, self.cacheFileLocation)
+        except OSError as e:
+            self._logWarning("Could not write file analysis cache '" + self.cacheFileLocation + "': " + str(e))
+
+    def _logWarning(self, message):
+        if (self._logger != None):
+            self._logger.warning(message)
+        else:
+            print(message)
@@ -0,0 +1,218 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import hashlib
+import mmap
+import os
+import threading
+
+from octoprint_MaintenanceManager.services.FileAnalysisCache import FileAnalysisCache
+from octoprint_MaintenanceManager.utils.odometer import Odometer
+
+ANALYSIS_STATE_PENDING = "pending"
+ANALYSIS_STATE_DONE = "done"
+ANALYSIS_STATE_FAILED = "failed"
+
+
+# bytes read from the beginning and from the end of a file for its hash
+HASH_SAMPLE_SIZE = 64 * 1024
+
+
+def hashGCodeFile(filePath):
+    """
+    Fast content key of a file: hash of its size, modification time and the first/last HASH_SAMPLE_SIZE bytes. Only
+    these samples are read, hashing the whole file would cost about as much as the analysis it should skip. A copy
+    or move that keeps the modification time (e.g. a file moved to another folder) gets the same key.
+
+    >>> import tempfile
+    >>> with tempfile.NamedTemporaryFile("wb", suffix=".gcode", delete=False) as file:
+    ...     _ = file.write(b"G1 X10 E1\\n" * 20000)
+    >>> fileHash = hashGCodeFile(file.name)
+    >>> len(fileHash), fileHash == hashGCodeFile(file.name)
+    (32, True)
+
+    Same size and modification time, but another end of the file (the middle is not read):
+
+    >>> fileStat = os.stat(file.name)
+    >>> with open(file.name, "r+b") as changedFile:
+    ...     _ = changedFile.seek(-2, os.SEEK_END)
+    ...     _ = changedFile.write(b"2\\n")
+    >>> os.utime(file.name, ns=(fileStat.st_atime_ns, fileStat.st_mtime_ns))
+    >>> fileHash == hashGCodeFile(file.name)
+    False
+    >>> os.remove(file.name)
+    """
+    contentHash = hashlib.blake2b(digest_size=16)
+    with open(filePath, "rb") as file:
+        fileStat = os.fstat(file.fileno())
+        contentHash.update((str(fileStat.st_size) + ":" + str(fileStat.st_mtime_ns) + ":").encode("ascii"))
+        contentHash.update(file.read(HASH_SAMPLE_SIZE))
+        if (fileStat.st_size > HASH_SAMPLE_SIZE):
+            file.seek(max(HASH_SAMPLE_SIZE, fileStat.st_size - HASH_SAMPLE_SIZE))
+            contentHash.update(file.read(HASH_SAMPLE_SIZE))
+    return contentHash.hexdigest()
+
+
+# replay a whole file through a fresh Odometer, line by line from the memory mapped file
+# knownHashes: nothing is replayed if the content is already analysed, "result" is None in that case
+# runs in the worker process of the GCodeFileAnalyzer
+def analyseGCodeFile(filePath, arcAxisProjection=True, knownHashes=()):
+    fileHash = hashGCodeFile(filePath)
+    analysis = {
+        "fileHash": fileHash,
+        "result": None
+    }
+    if (fileHash in knownHashes):
+        return analysis
+
+    odometer = Odometer(arcAxisProjection=arcAxisProjection)
+    lineCount = 0
+    if (os.path.getsize(filePath) > 0):
+        with open(filePath, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as fileMap:
+                lines = (line.decode("utf-8", "replace") for line in iter(fileMap.readline, b""))
+                lineCount = odometer.processGCodeLines(lines)
+
+    odometerSnapshot = odometer.getSnapshot()
+    # same keys/units as the raw trackingInformation
+    analysis["result"] = {
+        "lineCount": lineCount,
+        "axisTraveling": {
+            "x": odometerSnapshot.axisTravelingX,
+            "y": odometerSnapshot.axisTravelingY,
+            "z": odometerSnapshot.axisTravelingZ
+        },
+        "extrusionTraveling": list(odometerSnapshot.extrusionTraveling),
+        "arcLength": odometerSnapshot.arcLength
+    }
+    return analysis
+
+
+class GCodeFileAnalyzer():
+    """
+    Computes the travel a G-code file will add, before it is printed. The files are analysed in a process pool, so
+    neither the event thread nor the GIL of the server is blocked by multi-hundred-MB files.
+
+    The results are stored in the FileAnalysisCache, by path (size/modification time) and by content key (see
+    hashGCodeFile), so the same file moved to another path or printed again is not replayed again.
+    """
+
+    def __init__(self, analysisCache=None, arcAxisProjection=True, maxWorkers=1, logger=None):
+        self.analysisCache = analysisCache if analysisCache != None else FileAnalysisCache()
+        self.arcAxisProjection = arcAxisProjection
+        self.maxWorkers = maxWorkers
+        self._logger = logger
+        self._executor = None
+        self._lock = threading.Lock()
+        # filePath -> {"state", "fileSize", "fileModified", "error", "future"}, only running and failed analyses
+        self._files = {}
+        self.analysedFileCount = 0
+
+    def start(self):
+        if (self._executor != None):
+            return
+        # imported only if the analysis is enabled
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn instead of fork: the server process runs several threads
+        self._executor = ProcessPoolExecutor(max_workers=self.maxWorkers,
+                                             mp_context=multiprocessing.get_context("spawn"))
+
+    def stop(self):
+        if (self._executor != None):
+            # cancel_futures of shutdown needs Python 3.9, so the pending analyses are cancelled here
+            with self._lock:
+                futures = [fileInfo["future"] for fileInfo in self._files.values() if fileInfo["future"] != None]
+            for future in futures:
+                future.cancel()
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    # start the analysis in the background, if the file is unknown or changed since the last analysis
+    def analyseFile(self, filePath):
+        fileStat = os.stat(filePath)
+        if (self.analysisCache.get(filePath, fileStat.st_size, fileStat.st_mtime) != None):
+            return ANALYSIS_STATE_DONE
+        with self._lock:
+            fileInfo = self._files.get(filePath)
+            if (fileInfo != None and fileInfo["state"] == ANALYSIS_STATE_PENDING and
+                fileInfo["fileSize"] == fileStat.st_size and fileInfo["fileModified"] == fileStat.st_mtime):
+                return ANALYSIS_STATE_PENDING
+            if (self._executor == None):
+                return None
+
+            fileInfo = {
+                "state": ANALYSIS_STATE_PENDING,
+                "fileSize": fileStat.st_size,
+                "fileModified": fileStat.st_mtime,
+                "error": None,
+                "future": None
+            }
+            self._files[filePath] = fileInfo
+
+        future = self._executor.submit(analyseGCodeFile, filePath, self.arcAxisProjection,
+                                       self.analysisCache.getHashes())
+        fileInfo["future"] = future
+        future.add_done_callback(lambda finishedFuture: self._analysisDone(filePath, fileInfo, finishedFuture))
+        return ANALYSIS_STATE_PENDING
+
+    def _analysisDone(self, filePath, fileInfo, future):
+        with self._lock:
+            if (self._files.get(filePath) is not fileInfo):
+                # removed or modified while the analysis was running
+                return
+            if (future.cancelled()):
+                fileInfo["state"] = ANALYSIS_STATE_FAILED
+                fileInfo["error"] = "cancelled"
+                return
+            error = future.exception()
+            if (error != None):
+                fileInfo["state"] = ANALYSIS_STATE_FAILED
+                fileInfo["error"] = str(error)
+                if (self._logger != None):
+                    self._logger.warning("Analysis of '" + filePath + "' failed: " + str(error))
+                return
+
+            analysis = future.result()
+            if (analysis["result"] != None):
+                self.analysedFileCount += 1
+            self.analysisCache.put(filePath, fileInfo["fileSize"], fileInfo["fileModified"],
+                                   analysis["fileHash"], analysis["result"])
+            del self._files[filePath]
+
+    # (state, result), state is None if the file was never analysed or changed since the analysis
+    def getAnalysis(self, filePath):
+        try:
+            fileStat = os.stat(filePath)
+        except FileNotFoundError:
+            return (None, None)
+        result = self.analysisCache.get(filePath, fileStat.st_size, fileStat.st_mtime)
+        if (result != None):
+            return (ANALYSIS_STATE_DONE, result)
+        with self._lock:
+            fileInfo = self._files.get(filePath)
+            if (fileInfo == None):
+                return (None, None)
+            return (fileInfo["state"], None)
+
+    # file removed or modified
+    def removeFile(self, filePath):
+        with self._lock:
+            self._files.pop(filePath, None)
+        self.analysisCache.invalidate(filePath)
+
+    def removeFolder(self, folderPath):
+        folderPrefix = os.path.join(folderPath, "")
+        with self._lock:
+            for filePath in [filePath for filePath in self._files if filePath.startswith(folderPrefix)]:
+                del self._files[filePath]
+        self.analysisCache.invalidateFolder(folderPath)
+
+    def getStatistics(self):
+        with self._lock:
+            statistics = {
+                "runningFileCount": len(self._files),
+                "analysedFileCount": self.analysedFileCount
+            }
+        statistics["cache"] = self.analysisCache.getStatistics()
+        return statistics
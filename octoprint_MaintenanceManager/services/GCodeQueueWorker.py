@@ -0,0 +1,132 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+from collections import deque
+
+
+class GCodeQueueWorker():
+    """
+    Bounded queue between the G-code sent hook (comm.sending_thread) and a dedicated consumer thread.
+
+    The producer only appends the raw line to a deque. The consumer wakes up every DRAIN_INTERVAL seconds (or earlier
+    when the queue is half full) and hands all queued lines as one batch to the processing function.
+    If the queue is full, the line is never dropped (a lost G90/G91, G92, T<n>... would corrupt all later totals): the
+    producer processes the queued lines and then the line itself (overflow). If the consumer is just processing a
+    batch, the producer has to wait for it (backpressure).
+    """
+
+    DRAIN_INTERVAL = 0.1
+
+    def __init__(self, processLinesFunction, maxQueueSize=10000, logger=None):
+        self._processLinesFunction = processLinesFunction
+        self._logger = logger
+        self.maxQueueSize = maxQueueSize
+        self._wakeUpSize = max(1, maxQueueSize // 2)
+
+        self._queue = deque()
+        self._processingLock = threading.Lock()
+        self._linesAvailableEvent = threading.Event()
+        self._running = False
+        self._thread = None
+
+        # statistics
+        self.enqueuedCount = 0
+        self.processedCount = 0
+        self.batchCount = 0
+        self.backpressureCount = 0
+        self.overflowCount = 0
+        self.maxQueueDepth = 0
+
+    def start(self):
+        if (self._running == True):
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._consumerLoop, name="MaintenanceManager.GCodeQueueWorker")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._linesAvailableEvent.set()
+        if (self._thread != None):
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    # called from comm.sending_thread, keep it cheap. Returns False if the queue was full and the line was processed
+    # synchronously
+    def enqueue(self, line):
+        queue = self._queue
+        queueDepth = len(queue)
+        if (queueDepth >= self.maxQueueSize):
+            self._processOverflow(line)
+            return False
+
+        queue.append(line)
+        self.enqueuedCount += 1
+        queueDepth += 1
+        if (queueDepth > self.maxQueueDepth):
+            self.maxQueueDepth = queueDepth
+        if (queueDepth >= self._wakeUpSize):
+            self._linesAvailableEvent.set()
+        return True
+
+    # process all queued lines in the calling thread, e.g. before the values are persisted
+    def flush(self):
+        with self._processingLock:
+            self._drainQueue()
+
+    def getQueueDepth(self):
+        return len(self._queue)
+
+    def getStatistics(self):
+        return {
+            "queueDepth": len(self._queue),
+            "maxQueueSize": self.maxQueueSize,
+            "maxQueueDepth": self.maxQueueDepth,
+            "enqueued": self.enqueuedCount,
+            "processed": self.processedCount,
+            "batches": self.batchCount,
+            "backpressure": self.backpressureCount,
+            "overflow": self.overflowCount
+        }
+
+    def _consumerLoop(self):
+        while (self._running):
+            self._linesAvailableEvent.wait(self.DRAIN_INTERVAL)
+            self._linesAvailableEvent.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                if (self._logger != None):
+                    self._logger.exception("Error during processing of queued G-code lines: " + str(e))
+
+    # the queued lines first, the order matters (e.g. a G91 before the moves). Only the sending thread enqueues, so no
+    # line can be queued between draining and processing
+    def _processOverflow(self, line):
+        self.overflowCount += 1
+        if (self.overflowCount == 1 and self._logger != None):
+            self._logger.warning("G-code queue is full (" + str(self.maxQueueSize) + " lines), processing the lines " +
+                                 "in the sending thread. Consider a bigger queue size.")
+        if (self._processingLock.acquire(False) == False):
+            self.backpressureCount += 1
+            self._processingLock.acquire()
+        try:
+            self._drainQueue()
+            self._processLinesFunction([line])
+            self.processedCount += 1
+        finally:
+            self._processingLock.release()
+
+    def _drainQueue(self):
+        queue = self._queue
+        count = len(queue)
+        if (count == 0):
+            return
+        popleft = queue.popleft
+        lines = [popleft() for _ in range(count)]
+
+        self._processLinesFunction(lines)
+        self.processedCount += count
+        self.batchCount += 1
@@ -0,0 +1,142 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import bisect
+import json
+import os
+import threading
+
+
+class JobLedger():
+    """
+    One entry per print job (PRINT_STARTED until DONE/FAILED/CANCELLED) with what the job added to the counters:
+    {"fileName", "filePath", "origin", "user", "startTime", "endTime", "result", "duration",
+     "axisTraveling": {"x", "y", "z"}, "extrusionTraveling": [...], "arcLength"}
+    Times are seconds since epoch, durations in seconds, all distances in mm.
+
+    The entries are appended as JSON lines to one file, an incomplete last line (power cut) is ignored. In memory
+    the entries are sorted by startTime (date range queries via bisect) and indexed by file name.
+    """
+
+    FILENAME = "jobLedger.jsonl"
+
+    def __init__(self, folder, logger=None):
+        self._logger = logger
+        self.ledgerFileLocation = os.path.join(folder, self.FILENAME)
+        self._lock = threading.Lock()
+        self._entries = []
+        self._startTimes = []
+        # fileName -> entries, sorted by startTime
+        self._entriesByFile = {}
+
+    def load(self):
+        entries = []
+        try:
+            with open(self.ledgerFileLocation, "rt") as ledgerFile:
+                for line in ledgerFile:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        self._logWarning("Ignoring incomplete job ledger entry '" + line.strip() + "'")
+                        break
+        except FileNotFoundError:
+            # Firsttime, no job printed yet
+            pass
+
+        with self._lock:
+            self._entries = []
+            self._startTimes = []
+            self._entriesByFile = {}
+            for entry in sorted(entries, key=lambda entry: entry["startTime"]):
+                self._addToIndex(entry)
+
+    def addJob(self, entry):
+        with self._lock:
+            with open(self.ledgerFileLocation, "at") as ledgerFile:
+                ledgerFile.write(json.dumps(entry, separators=(",", ":")) + "\n")
+                ledgerFile.flush()
+                os.fsync(ledgerFile.fileno())
+            self._addToIndex(entry)
+
+    # entries sorted by startTime, optional filtered by file name and/or startTime range (seconds since epoch)
+    def query(self, fileName=None, startTime=None, endTime=None):
+        with self._lock:
+            if (fileName != None):
+                entries = self._entriesByFile.get(fileName, [])
+                startTimes = [entry["startTime"] for entry in entries]
+            else:
+                entries = self._entries
+                startTimes = self._startTimes
+            low = 0 if startTime == None else bisect.bisect_left(startTimes, startTime)
+            high = len(entries) if endTime == None else bisect.bisect_right(startTimes, endTime)
+            return entries[low:high]
+
+    def getPage(self, entries, page, pageSize):
+        """
+        Page of the entries (sorted by startTime, see query), newest first. Page 0 are the newest pageSize entries.
+
+        >>> import shutil, tempfile
+        >>> folder = tempfile.mkdtemp()
+        >>> jobLedger = JobLedger(folder)
+        >>> for startTime in range(5):
+        ...     jobLedger.addJob({"fileName": "cube.gcode" if startTime % 2 == 0 else "benchy.gcode",
+        ...                       "startTime": float(startTime)})
+        >>> def startTimes(entries):
+        ...     return [entry["startTime"] for entry in entries]
+        >>> entries = jobLedger.query()
+        >>> [startTimes(jobLedger.getPage(entries, page, 2)) for page in range(4)]
+        [[4.0, 3.0], [2.0, 1.0], [0.0], []]
+
+        Filtered by file name and startTime range, then paged (also after a reload):
+
+        >>> jobLedger = JobLedger(folder)
+        >>> jobLedger.load()
+        >>> startTimes(jobLedger.getPage(jobLedger.query("cube.gcode", startTime=1.0), 0, 20))
+        [4.0, 2.0]
+        >>> startTimes(jobLedger.getPage(jobLedger.query(startTime=1.0, endTime=3.0), 1, 2))
+        [1.0]
+        >>> shutil.rmtree(folder)
+        """
+        pageEnd = len(entries) - page * pageSize
+        pageEntries = entries[max(pageEnd - pageSize, 0):max(pageEnd, 0)]
+        pageEntries.reverse()
+        return pageEntries
+
+    # sum of duration and all counters of the entries
+    def getTotals(self, entries):
+        totals = {
+            "jobCount": len(entries),
+            "duration": 0.0,
+            "axisTraveling": {"x": 0.0, "y": 0.0, "z": 0.0},
+            "extrusionTraveling": [],
+            "arcLength": 0.0
+        }
+        for entry in entries:
+            totals["duration"] += entry["duration"]
+            for axis in ("x", "y", "z"):
+                totals["axisTraveling"][axis] += entry["axisTraveling"][axis]
+            extrusionTraveling = totals["extrusionTraveling"]
+            for toolIndex, extrusion in enumerate(entry["extrusionTraveling"]):
+                if (toolIndex < len(extrusionTraveling)):
+                    extrusionTraveling[toolIndex] += extrusion
+                else:
+                    extrusionTraveling.append(extrusion)
+            totals["arcLength"] += entry["arcLength"]
+        return totals
+
+    def _addToIndex(self, entry):
+        # nearly always appended at the end, only out of order if the clock was changed
+        index = bisect.bisect_right(self._startTimes, entry["startTime"])
+        self._startTimes.insert(index, entry["startTime"])
+        self._entries.insert(index, entry)
+        fileEntries = self._entriesByFile.setdefault(entry["fileName"], [])
+        fileIndex = len(fileEntries)
+        while (fileIndex > 0 and fileEntries[fileIndex - 1]["startTime"] > entry["startTime"]):
+            fileIndex -= 1
+        fileEntries.insert(fileIndex, entry)
+
+    def _logWarning(self, message):
+        if (self._logger != None):
+            self._logger.warning(message)
+        else:
+            print(message)
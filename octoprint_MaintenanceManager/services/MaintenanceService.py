@@ -1,13 +1,229 @@
 # coding=utf-8
 from __future__ import absolute_import
-import re
+
+import json
+import math
+import os
+import threading
+from datetime import datetime
+
 
 class MaintenanceService():
+    """
+    Rules engine for maintenance tasks, e.g. "lubricate Z rods every 50km Z travel" or "change nozzle every 500h".
+
+    A rule is defined by {"id", "name", "counter", "interval"}, the counter is one of the TrackingService counters
+    (printTime in seconds, x, y, z, arcLength, t0..t9 in mm). Its state (counter value when the maintenance was done
+    the last time, already notified) is stored in the plugin data folder.
+
+    Each rule has a precomputed next-due value (lastDoneValue + interval) and per counter only the smallest one is
+    kept, so checkDue (called for every G-code line) is a single comparison per used counter. Rules are evaluated
+    only if one of them is due, the dueListener is called once per rule until it is marked as done.
+
+    >>> import shutil, tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> counterValues = {"z": 1000.0}
+    >>> service = MaintenanceService()
+    >>> service.initialize(folder, {"z": lambda: counterValues["z"]},
+    ...                    dueListener=lambda ruleInformation: print("due: " + ruleInformation["name"]))
+    >>> service.setRules([{"id": "1", "name": "Lubricate Z rods", "counter": "z", "interval": 500}])
+    >>> counterValues["z"] = 1499.0
+    >>> service.checkDue()
+    >>> counterValues["z"] = 1500.0
+    >>> service.checkDue()
+    due: Lubricate Z rods
+    >>> service.checkDue()
+    >>> rule = service.getRules()[0]
+    >>> rule["due"], rule["nextDueValue"], rule["remaining"]
+    (True, 1500.0, 0.0)
+
+    Marked as done, the next interval starts with the current counter value (also after a restart):
+
+    >>> rule = service.markDone("1")
+    >>> rule["due"], rule["nextDueValue"]
+    (False, 2000.0)
+    >>> service = MaintenanceService()
+    >>> service.initialize(folder, {"z": lambda: counterValues["z"]})
+    >>> service.setRules([{"id": "1", "name": "Lubricate Z rods", "counter": "z", "interval": 500}])
+    >>> service.getRules()[0]["nextDueValue"]
+    2000.0
+    >>> shutil.rmtree(folder)
+    """
+
+    STATE_FILENAME = "maintenanceState.json"
 
     def __init__(self):
+        self._logger = None
+        self._stateFileLocation = None
+        self._counterFunctions = {}
+        self._dueListener = None
+        self._lock = threading.RLock()
+        self._rules = []
+        # ruleId -> {"counter", "lastDoneValue", "lastDoneDateTime", "dueNotified"}
+        self._ruleStates = {}
+        # ((counterName, counterFunction, nextDueValue), ...), only counters with not notified rules
+        self._dueChecks = ()
         pass
 
+    # counterFunctions: counterName -> function returning the current value, see TrackingService.getCounterFunctions
+    # dueListener: called with the rule information (see getRules) when a rule becomes due
+    def initialize(self, pluginDataFolder, counterFunctions, dueListener=None, logger=None):
+        self._logger = logger
+        self._stateFileLocation = os.path.join(pluginDataFolder, self.STATE_FILENAME)
+        self._counterFunctions = counterFunctions
+        self._dueListener = dueListener
+        self._loadRuleStates()
+
+    # rules from the plugin settings, invalid rules are ignored
+    def setRules(self, rules):
+        with self._lock:
+            self._rules = []
+            for rule in rules:
+                if (rule.get("id") in (None, "") or rule.get("counter") not in self._counterFunctions):
+                    self._logWarning("Ignoring invalid maintenance rule: " + str(rule))
+                    continue
+                try:
+                    interval = float(rule.get("interval"))
+                except (TypeError, ValueError):
+                    interval = 0.0
+                if (interval <= 0.0 or math.isfinite(interval) == False):
+                    self._logWarning("Ignoring maintenance rule without interval: " + str(rule))
+                    continue
+                self._rules.append({
+                    "id": str(rule["id"]),
+                    "name": rule.get("name", ""),
+                    "counter": rule["counter"],
+                    "interval": interval
+                })
+                ruleState = self._ruleStates.get(str(rule["id"]))
+                if (ruleState != None and "counter" not in ruleState):
+                    # state of an older version, the counter was not stored
+                    ruleState["counter"] = rule["counter"]
+                if (ruleState == None or ruleState["counter"] != rule["counter"]):
+                    # new rule or other counter (lastDoneValue in another unit), the interval starts now
+                    self._ruleStates[str(rule["id"])] = self._createRuleState(rule["counter"])
+            self._updateDueChecks()
+            self._saveRuleStates()
+
+    # hot path, called for every G-code line
+    def checkDue(self):
+        for counterName, counterFunction, nextDueValue in self._dueChecks:
+            if (counterFunction() >= nextDueValue):
+                self._notifyDueRules(counterName)
+
+    # maintenance was done, the next interval starts with the current counter value
+    def markDone(self, ruleId):
+        with self._lock:
+            rule = self._findRule(ruleId)
+            if (rule == None):
+                return None
+            self._ruleStates[rule["id"]] = self._createRuleState(rule["counter"])
+            self._updateDueChecks()
+            self._saveRuleStates()
+            return self._createRuleInformation(rule)
+
+    # all rules with their state, "remaining" is negative if the rule is overdue
+    def getRules(self):
+        with self._lock:
+            return [self._createRuleInformation(rule) for rule in self._rules]
+
+    # rules that are due after adding the counter deltas (e.g. of a G-code file) to the current counter values
+    def getDueRulesAfter(self, counterDeltas):
+        with self._lock:
+            dueRules = []
+            for rule in self._rules:
+                ruleInformation = self._createRuleInformation(rule)
+                if (ruleInformation["remaining"] - counterDeltas.get(rule["counter"], 0.0) <= 0.0):
+                    dueRules.append(ruleInformation)
+            return dueRules
+
+    def _notifyDueRules(self, counterName):
+        dueRules = []
+        with self._lock:
+            currentValue = self._counterFunctions[counterName]()
+            for rule in self._rules:
+                ruleState = self._ruleStates[rule["id"]]
+                if (rule["counter"] != counterName or ruleState["dueNotified"] == True or
+                    currentValue < ruleState["lastDoneValue"] + rule["interval"]):
+                    continue
+                ruleState["dueNotified"] = True
+                dueRules.append(self._createRuleInformation(rule))
+            self._updateDueChecks()
+            self._saveRuleStates()
+
+        # outside of the lock, the listener may call getRules
+        if (self._dueListener != None):
+            for ruleInformation in dueRules:
+                self._dueListener(ruleInformation)
+
+    def _updateDueChecks(self):
+        nextDueValues = {}
+        for rule in self._rules:
+            ruleState = self._ruleStates[rule["id"]]
+            if (ruleState["dueNotified"] == True):
+                continue
+            nextDueValue = ruleState["lastDoneValue"] + rule["interval"]
+            counterName = rule["counter"]
+            nextDueValues[counterName] = min(nextDueValue, nextDueValues.get(counterName, math.inf))
+        self._dueChecks = tuple((counterName, self._counterFunctions[counterName], nextDueValue)
+                                for counterName, nextDueValue in nextDueValues.items())
+
+    def _createRuleState(self, counterName):
+        return {
+            "counter": counterName,
+            "lastDoneValue": self._counterFunctions[counterName](),
+            "lastDoneDateTime": datetime.now().isoformat(),
+            "dueNotified": False
+        }
+
+    def _createRuleInformation(self, rule):
+        ruleState = self._ruleStates[rule["id"]]
+        currentValue = self._counterFunctions[rule["counter"]]()
+        nextDueValue = ruleState["lastDoneValue"] + rule["interval"]
+        ruleInformation = dict(rule)
+        ruleInformation.update({
+            "lastDoneValue": ruleState["lastDoneValue"],
+            "lastDoneDateTime": ruleState["lastDoneDateTime"],
+            "nextDueValue": nextDueValue,
+            "currentValue": currentValue,
+            "remaining": nextDueValue - currentValue,
+            "due": currentValue >= nextDueValue
+        })
+        return ruleInformation
+
+    def _findRule(self, ruleId):
+        for rule in self._rules:
+            if (rule["id"] == ruleId):
+                return rule
+        return None
+
+    def _loadRuleStates(self):
+        try:
+            with open(self._stateFileLocation, "rt") as stateFile:
+                self._ruleStates = json.load(stateFile)
+        except FileNotFoundError:
+            # Firsttime, no rules defined yet
+            self._ruleStates = {}
+        except ValueError as e:
+            self._logWarning("Maintenance state '" + self._stateFileLocation + "' is corrupt, intervals restart: " + str(e))
+            self._ruleStates = {}
+
+    def _saveRuleStates(self):
+        if (self._stateFileLocation == None):
+            return
+        # states of deleted rules are removed
+        ruleIds = set(rule["id"] for rule in self._rules)
+        ruleStates = {ruleId: ruleState for ruleId, ruleState in self._ruleStates.items() if ruleId in ruleIds}
+        temporaryFileLocation = self._stateFileLocation + ".tmp"
+        with open(temporaryFileLocation, "wt") as temporaryFile:
+            temporaryFile.write(json.dumps(ruleStates, indent=4))
+        os.replace(temporaryFileLocation, self._stateFileLocation)
 
+    def _logWarning(self, message):
+        if (self._logger != None):
+            self._logger.warning(message)
+        else:
+            print(message)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,186 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import bisect
+
+
+class LatencyHistogram():
+    """
+    Cumulative histogram of durations in seconds (Prometheus style buckets: upper bounds, "+Inf" is implicit).
+
+    observe is only a bisect and two additions, no lock: a scrape during an observation may see the count one ahead
+    of the buckets, which is fine for monitoring. With sampleInterval n the caller should only time every n-th call,
+    callCount counts all of them.
+    """
+
+    def __init__(self, buckets, sampleInterval=1):
+        self.buckets = tuple(buckets)
+        self.sampleInterval = sampleInterval
+        self.bucketCounts = [0] * (len(self.buckets) + 1)
+        self.observationCount = 0
+        self.observationSum = 0.0
+        self.callCount = 0
+
+    def observe(self, duration):
+        self.bucketCounts[bisect.bisect_left(self.buckets, duration)] += 1
+        self.observationCount += 1
+        self.observationSum += duration
+
+
+class MetricsService():
+    """
+    Instrumentation of the hot path, rendered in the Prometheus text format (see MaintenanceManagerAPI /metrics).
+
+    - hookLatency: sentGCodeHook duration, only every HOOK_SAMPLE_INTERVAL-th line is timed
+    - G-code lines per odometer path (move, arc, state, tool, ignored, filtered), counted by the Odometer anyway
+    - storage writes, avoided writes and write duration of the TrackingService
+    - queue depth and counters of the async G-code processing, if enabled
+    - line counts and drift of the fast tracking mode, if enabled
+
+    Before the TrackingService exists, only the hook metrics (here with two buckets):
+
+    >>> metricsService = MetricsService()
+    >>> metricsService.hookLatency = LatencyHistogram((0.00001, 0.0001), sampleInterval=2)
+    >>> metricsService.hookLatency.callCount = 4
+    >>> metricsService.hookLatency.observe(0.000005)
+    >>> metricsService.hookLatency.observe(0.00005)
+    >>> print(metricsService.renderPrometheusText(), end="")
+    # HELP maintenancemanager_hook_latency_seconds Duration of sentGCodeHook, sampled every 2 lines
+    # TYPE maintenancemanager_hook_latency_seconds histogram
+    maintenancemanager_hook_latency_seconds_bucket{le="1e-05"} 1
+    maintenancemanager_hook_latency_seconds_bucket{le="0.0001"} 2
+    maintenancemanager_hook_latency_seconds_bucket{le="+Inf"} 2
+    maintenancemanager_hook_latency_seconds_sum 5.5e-05
+    maintenancemanager_hook_latency_seconds_count 2
+    # HELP maintenancemanager_hook_calls_total Calls of sentGCodeHook
+    # TYPE maintenancemanager_hook_calls_total counter
+    maintenancemanager_hook_calls_total 4.0
+
+    With a TrackingService, e.g. the lines and the travel of the odometer:
+
+    >>> import shutil, tempfile
+    >>> from octoprint_MaintenanceManager.services.TrackingService import TrackingService
+    >>> folder = tempfile.mkdtemp()
+    >>> trackingService = TrackingService()
+    >>> trackingService.initialize(folder)
+    >>> metricsService.initialize(trackingService)
+    >>> for line in ["G1 X10 Y5", "M105", "T1", "G1 X12"]:
+    ...     trackingService.processGCodeLine(line)
+    >>> for line in metricsService.renderPrometheusText().splitlines():
+    ...     if (line.startswith("maintenancemanager_gcode_lines_total") or
+    ...         line.startswith("maintenancemanager_axis_traveling_mm_total")):
+    ...         print(line)
+    maintenancemanager_gcode_lines_total{path="arc"} 0.0
+    maintenancemanager_gcode_lines_total{path="filtered"} 1.0
+    maintenancemanager_gcode_lines_total{path="ignored"} 0.0
+    maintenancemanager_gcode_lines_total{path="move"} 2.0
+    maintenancemanager_gcode_lines_total{path="state"} 0.0
+    maintenancemanager_gcode_lines_total{path="tool"} 1.0
+    maintenancemanager_axis_traveling_mm_total{axis="x"} 12.0
+    maintenancemanager_axis_traveling_mm_total{axis="y"} 5.0
+    maintenancemanager_axis_traveling_mm_total{axis="z"} 0.0
+    >>> trackingService.shutdown()
+    >>> shutil.rmtree(folder)
+    """
+
+    HOOK_SAMPLE_INTERVAL = 64
+    # 1us .. 10ms
+    HOOK_LATENCY_BUCKETS = (0.000001, 0.0000025, 0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+                            0.001, 0.01)
+    # 100us .. 5s, fsync on an SD card can take long
+    STORAGE_LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+    def __init__(self):
+        self.hookLatency = LatencyHistogram(self.HOOK_LATENCY_BUCKETS, self.HOOK_SAMPLE_INTERVAL)
+        self.trackingService = None
+
+    def initialize(self, trackingService):
+        self.trackingService = trackingService
+
+    def renderPrometheusText(self):
+        lines = []
+        self._addHistogram(lines, "maintenancemanager_hook_latency_seconds",
+                           "Duration of sentGCodeHook, sampled every " + str(self.hookLatency.sampleInterval) +
+                           " lines", self.hookLatency)
+        self._addMetric(lines, "maintenancemanager_hook_calls_total", "counter",
+                        "Calls of sentGCodeHook", [("", self.hookLatency.callCount)])
+
+        trackingService = self.trackingService
+        if (trackingService != None and trackingService.odometer != None):
+            lineStatistics = trackingService.odometer.getLineStatistics()
+            self._addMetric(lines, "maintenancemanager_gcode_lines_total", "counter",
+                            "Evaluated G-code lines by odometer path",
+                            [('{path="' + path + '"}', count) for path, count in sorted(lineStatistics.items())])
+
+            odometerSnapshot = trackingService.getOdometerSnapshot()
+            self._addMetric(lines, "maintenancemanager_axis_traveling_mm_total", "counter", "Total axis movement",
+                            [('{axis="x"}', odometerSnapshot.axisTravelingX),
+                             ('{axis="y"}', odometerSnapshot.axisTravelingY),
+                             ('{axis="z"}', odometerSnapshot.axisTravelingZ)])
+            self._addMetric(lines, "maintenancemanager_extrusion_traveling_mm_total", "counter",
+                            "Total extrusion per tool",
+                            [('{tool="T' + str(toolIndex) + '"}', extrusion)
+                             for toolIndex, extrusion in enumerate(odometerSnapshot.extrusionTraveling)])
+            self._addMetric(lines, "maintenancemanager_print_time_seconds_total", "counter",
+                            "Total print time, pause excluded", [("", trackingService.getCurrentTotalDuration())])
+            self._addMetric(lines, "maintenancemanager_tracking_state", "gauge", "Current tracking state",
+                            [('{state="' + state + '"}', 1 if trackingService.currentTrackingState == state else 0)
+                             for state in (trackingService.TRACKING_STATE_STOPPED,
+                                           trackingService.TRACKING_STATE_TRACKING,
+                                           trackingService.TRACKING_STATE_PAUSE)])
+
+            storageStatistics = trackingService.getStorageStatistics()
+            self._addMetric(lines, "maintenancemanager_storage_writes_total", "counter",
+                            "Writes of the tracking values", [("", storageStatistics["writes"])])
+            self._addMetric(lines, "maintenancemanager_storage_writes_avoided_total", "counter",
+                            "Skipped writes (unchanged or not stale)", [("", storageStatistics["writesAvoided"])])
+            self._addHistogram(lines, "maintenancemanager_storage_write_duration_seconds",
+                               "Duration of writing the tracking values", trackingService.storageWriteLatency)
+
+            queueStatistics = trackingService.getGCodeQueueStatistics()
+            if (queueStatistics != None):
+                self._addMetric(lines, "maintenancemanager_queue_depth", "gauge",
+                                "Queued G-code lines (async processing)", [("", queueStatistics["queueDepth"])])
+                self._addMetric(lines, "maintenancemanager_queue_max_depth", "gauge",
+                                "Maximal queue depth since start", [("", queueStatistics["maxQueueDepth"])])
+                for key, help in (("enqueued", "Queued lines"),
+                                  ("processed", "Processed lines"),
+                                  ("batches", "Processed batches"),
+                                  ("backpressure", "Overflow lines that had to wait for the worker"),
+                                  ("overflow", "Lines processed synchronously because the queue was full")):
+                    self._addMetric(lines, "maintenancemanager_queue_" + key + "_total", "counter", help,
+                                    [("", queueStatistics[key])])
+
+            fastTrackingStatistics = trackingService.getFastTrackingStatistics()
+            if (fastTrackingStatistics != None):
+                self._addMetric(lines, "maintenancemanager_fast_tracking_lines_total", "counter",
+                                "Lines evaluated by the fast mode", [("", fastTrackingStatistics["lines"])])
+                self._addMetric(lines, "maintenancemanager_fast_tracking_runs_total", "counter",
+                                "Runs of lines evaluated by the fast mode", [("", fastTrackingStatistics["runs"])])
+                self._addMetric(lines, "maintenancemanager_fast_tracking_checked_lines_total", "counter",
+                                "Lines compared with the full odometer", [("", fastTrackingStatistics["checkedLines"])])
+                self._addMetric(lines, "maintenancemanager_fast_tracking_drift_mm_total", "counter",
+                                "Difference of the fast mode to the full odometer in the checked lines",
+                                [('{counter="' + counterName + '"}', drift)
+                                 for counterName, drift in fastTrackingStatistics["drift"].items()])
+                self._addMetric(lines, "maintenancemanager_fast_tracking_relative_drift", "gauge",
+                                "Drift relative to the movement of the checked lines",
+                                [("", fastTrackingStatistics["relativeDrift"])])
+        return "\n".join(lines) + "\n"
+
+    def _addMetric(self, lines, name, metricType, help, samples):
+        lines.append("# HELP " + name + " " + help)
+        lines.append("# TYPE " + name + " " + metricType)
+        for labels, value in samples:
+            lines.append(name + labels + " " + repr(float(value)))
+
+    def _addHistogram(self, lines, name, help, histogram):
+        lines.append("# HELP " + name + " " + help)
+        lines.append("# TYPE " + name + " histogram")
+        cumulativeCount = 0
+        for bucket, bucketCount in zip(histogram.buckets, histogram.bucketCounts):
+            cumulativeCount += bucketCount
+            lines.append(name + '_bucket{le="' + repr(bucket) + '"} ' + str(cumulativeCount))
+        lines.append(name + '_bucket{le="+Inf"} ' + str(histogram.observationCount))
+        lines.append(name + "_sum " + repr(histogram.observationSum))
+        lines.append(name + "_count " + str(histogram.observationCount))
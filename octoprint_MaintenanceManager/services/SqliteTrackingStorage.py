@@ -0,0 +1,140 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import json
+import os
+import sqlite3
+import threading
+
+from octoprint_MaintenanceManager.services.TrackingStorage import SQLITE_DATABASE_FILENAME, JsonTrackingStorage, TrackingStorage
+
+
+class SqliteTrackingStorage(TrackingStorage):
+    """
+    Storage of the tracking values in an embedded SQLite database, one row (key, JSON value) per value.
+
+    - WAL mode: a save only appends the changed rows to the write-ahead log, nothing is rewritten. synchronous=FULL,
+      so each committed save survives a power cut (like the fsynced journal of the JsonTrackingStorage).
+    - All changed values of one save are written in one transaction, with one parameterized statement (compiled once
+      and kept in the statement cache of the connection).
+    - Migration, always from the storage that was used last to the selected one. The files of the other storage are
+      renamed to "<name>.migrated" afterwards, so if they exist, they are newer than the other storage:
+      - JSON -> SQLite: if the JSON files of the JsonTrackingStorage exist, load imports their values into the database
+      - SQLite -> JSON: if the database exists when the JSON storage is selected, createTrackingStorage exports its
+        values as JSON snapshot (see exportToJsonStorage)
+
+    save is called by the storage timer, load/compact/close by other threads, so the connection is shared and all
+    access is serialized by a lock.
+    """
+
+    DATABASE_FILENAME = SQLITE_DATABASE_FILENAME
+
+    def __init__(self, folder, databaseFilename=DATABASE_FILENAME, logger=None):
+        self._logger = logger
+        self.folder = folder
+        self.databaseFileLocation = os.path.join(folder, databaseFilename)
+        self._lock = threading.Lock()
+        self._connection = None
+        self._persistedValues = {}
+
+    def load(self):
+        migratedValues = self._migrateJsonStorage()
+        if (migratedValues != None):
+            return migratedValues
+
+        with self._lock:
+            connection = self._getConnection()
+            values = {}
+            for key, value in connection.execute("SELECT key, value FROM trackingValues"):
+                values[key] = json.loads(value)
+            if (len(values) == 0):
+                return None
+            self._persistedValues = values
+            return dict(values)
+
+    # only the changed values are written
+    def save(self, values):
+        with self._lock:
+            changedRows = []
+            for key, value in values.items():
+                if (key not in self._persistedValues or self._persistedValues[key] != value):
+                    changedRows.append((key, json.dumps(value, default=str)))
+            if (len(changedRows) == 0):
+                return
+            self._writeRows(changedRows)
+            self._persistedValues = dict(values)
+
+    # all values, then the write-ahead log is moved into the database file and truncated
+    def compact(self, values):
+        with self._lock:
+            self._writeRows([(key, json.dumps(value, default=str)) for key, value in values.items()])
+            self._persistedValues = dict(values)
+            self._connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def close(self):
+        with self._lock:
+            if (self._connection != None):
+                self._connection.close()
+                self._connection = None
+
+    # all values as snapshot of the jsonStorage, then the database is closed and renamed to "<name>.migrated".
+    # Returns the values, None if the database was empty
+    def exportToJsonStorage(self, jsonStorage):
+        values = self.load()
+        if (values != None):
+            jsonStorage.compact(values)
+        self.close()
+        os.replace(self.databaseFileLocation, self.databaseFileLocation + ".migrated")
+        for suffix in ("-wal", "-shm"):
+            if (os.path.exists(self.databaseFileLocation + suffix)):
+                os.remove(self.databaseFileLocation + suffix)
+        self._logInfo("Tracking values exported from '" + self.databaseFileLocation + "' into '" +
+                      jsonStorage.snapshotFileLocation + "'")
+        return values
+
+    def _getConnection(self):
+        if (self._connection == None):
+            # autocommit, the transactions are started explicitly in _writeRows
+            connection = sqlite3.connect(self.databaseFileLocation, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=FULL")
+            connection.execute("CREATE TABLE IF NOT EXISTS trackingValues (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._connection = connection
+        return self._connection
+
+    def _writeRows(self, rows):
+        connection = self._getConnection()
+        connection.execute("BEGIN")
+        try:
+            connection.executemany("INSERT OR REPLACE INTO trackingValues (key, value) VALUES (?, ?)", rows)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    # values of the JSON storage (snapshot and journal), written into the database. None if there is nothing to import.
+    # The JSON files only exist if the JSON storage was used after the database (see class description)
+    def _migrateJsonStorage(self):
+        jsonStorage = JsonTrackingStorage(self.folder, logger=self._logger)
+        if (os.path.exists(jsonStorage.snapshotFileLocation) == False and
+            os.path.exists(jsonStorage.journalFileLocation) == False):
+            return None
+        values = jsonStorage.load()
+        jsonStorage.close()
+        if (values == None):
+            return None
+
+        self.compact(values)
+        # the database is the master now, keep the old file only for a manual recovery
+        os.replace(jsonStorage.snapshotFileLocation, jsonStorage.snapshotFileLocation + ".migrated")
+        if (os.path.exists(jsonStorage.journalFileLocation)):
+            os.remove(jsonStorage.journalFileLocation)
+        self._logInfo("Tracking values imported from '" + jsonStorage.snapshotFileLocation + "' into '" +
+                      self.databaseFileLocation + "'")
+        return values
+
+    def _logInfo(self, message):
+        if (self._logger != None):
+            self._logger.info(message)
+        else:
+            print(message)
@@ -0,0 +1,225 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import mmap
+import os
+import struct
+import threading
+
+# each record: time (seconds since epoch) and all counters, as little-endian doubles
+HISTORY_FIELDS = ("time", "totalDuration", "x", "y", "z", "arcLength") + tuple("t" + str(toolIndex) for toolIndex in range(10))
+
+
+class TrackingHistory():
+    """
+    Time-series of the cumulative tracking counters, e.g. to answer "how much Y travel per week".
+
+    Each tier is an append-only file of fixed-width records (struct packed doubles, see HISTORY_FIELDS):
+    - minute: at most one record per SAMPLE_INTERVAL, kept for MINUTE_RETENTION
+    - hour: the first record of each hour, kept for HOUR_RETENTION
+    - day: the first record of each day, kept forever
+
+    The counters are cumulative, so downsampling only drops records and the travel between two points in time is the
+    difference of their records. Unchanged counters are not sampled again. Range queries read the files via mmap
+    and find the start record with a binary search over the (ascending) time field.
+
+    >>> import shutil, tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> history = TrackingHistory(folder)
+    >>> def counterValues(y):
+    ...     return {"totalDuration": 0, "axisTraveling.x": 0.0, "axisTraveling.y": y, "axisTraveling.z": 0.0,
+    ...             "arcLength": 0.0, "extrusionTraveling": [0.0]}
+    >>> for sampleTime, y in [(0, 0.0), (30, 1.0), (60, 1.0), (3600, 5.0), (7200, 5.0), (90000, 9.0)]:
+    ...     history.sample(sampleTime, counterValues(y))
+    >>> statistics = history.getStatistics()
+    >>> statistics["minuteRecords"], statistics["hourRecords"], statistics["dayRecords"]
+    (4, 3, 2)
+
+    A range query includes the last record before the start, so the travel in the range is the difference of the
+    first and the last record:
+
+    >>> result = history.query(3000, 4000)
+    >>> result["resolution"], [(record["time"], record["y"]) for record in result["records"]]
+    ('minute', [(60.0, 1.0), (3600.0, 5.0)])
+    >>> result = history.query(0, 90000, history.RESOLUTION_DAY)
+    >>> [(record["time"], record["y"]) for record in result["records"]]
+    [(0.0, 0.0), (90000.0, 9.0)]
+    >>> shutil.rmtree(folder)
+    """
+
+    SAMPLE_INTERVAL = 60.0
+    MINUTE_RETENTION = 7 * 24 * 3600.0
+    HOUR_RETENTION = 365 * 24 * 3600.0
+    # older records are removed in one go, after this extra time
+    RETENTION_SLACK = 24 * 3600.0
+
+    RESOLUTION_MINUTE = "minute"
+    RESOLUTION_HOUR = "hour"
+    RESOLUTION_DAY = "day"
+
+    RECORD_STRUCT = struct.Struct("<" + str(len(HISTORY_FIELDS)) + "d")
+    TIME_STRUCT = struct.Struct("<d")
+
+    def __init__(self, folder, logger=None):
+        self._logger = logger
+        self._lock = threading.Lock()
+        # finest first: (resolution, bucket size in seconds, retention in seconds)
+        self._tiers = (
+            (self.RESOLUTION_MINUTE, self.SAMPLE_INTERVAL, self.MINUTE_RETENTION),
+            (self.RESOLUTION_HOUR, 3600.0, self.HOUR_RETENTION),
+            (self.RESOLUTION_DAY, 86400.0, None)
+        )
+        self._fileLocations = {
+            resolution: os.path.join(folder, "trackingHistory_" + resolution + ".bin")
+            for resolution, bucketSize, retention in self._tiers
+        }
+        # last record (tuple) of each tier
+        self._lastRecords = {}
+        for resolution, bucketSize, retention in self._tiers:
+            self._lastRecords[resolution] = self._repairAndReadLastRecord(self._fileLocations[resolution])
+        self.recordCount = 0
+
+    # store the current counters, if the last sample is older than SAMPLE_INTERVAL and something changed
+    # counterValues: see TrackingService._collectCurrentValues
+    def sample(self, sampleTime, counterValues):
+        extrusionTraveling = list(counterValues["extrusionTraveling"])[:10]
+        extrusionTraveling += [0.0] * (10 - len(extrusionTraveling))
+        record = (float(sampleTime), float(counterValues["totalDuration"]),
+                  counterValues["axisTraveling.x"], counterValues["axisTraveling.y"], counterValues["axisTraveling.z"],
+                  counterValues["arcLength"]) + tuple(extrusionTraveling)
+
+        with self._lock:
+            for resolution, bucketSize, retention in self._tiers:
+                lastRecord = self._lastRecords[resolution]
+                if (lastRecord != None):
+                    if (resolution == self.RESOLUTION_MINUTE):
+                        if (sampleTime - lastRecord[0] < bucketSize or lastRecord[1:] == record[1:]):
+                            # too early or nothing changed, so the coarser tiers neither
+                            return
+                    elif (sampleTime // bucketSize == lastRecord[0] // bucketSize):
+                        # already a record in this bucket, so the coarser tiers as well
+                        return
+                self._appendRecord(resolution, record)
+                # once per bucket of this tier, the finer tier gets too old records
+                if (lastRecord != None and resolution != self.RESOLUTION_MINUTE):
+                    self._removeOldRecords(self._tiers[self._tierIndex(resolution) - 1], sampleTime)
+
+    # records [{"time", "totalDuration", "x", ...}] between startTime and endTime (seconds since epoch), including the
+    # last record before startTime (the counter values at startTime). Resolution None: the finest tier that covers
+    # startTime
+    def query(self, startTime, endTime, resolution=None):
+        with self._lock:
+            if (resolution == None):
+                resolution = self.RESOLUTION_DAY
+                for tierResolution, bucketSize, retention in self._tiers:
+                    firstRecordTime = self._readFirstRecordTime(self._fileLocations[tierResolution])
+                    if (firstRecordTime != None and firstRecordTime <= startTime):
+                        resolution = tierResolution
+                        break
+            records = self._readRecords(self._fileLocations[resolution], startTime, endTime)
+        return {
+            "resolution": resolution,
+            "records": [dict(zip(HISTORY_FIELDS, record)) for record in records]
+        }
+
+    def getStatistics(self):
+        with self._lock:
+            statistics = {
+                "recordCount": self.recordCount
+            }
+            for resolution, fileLocation in self._fileLocations.items():
+                try:
+                    statistics[resolution + "Records"] = os.path.getsize(fileLocation) // self.RECORD_STRUCT.size
+                except FileNotFoundError:
+                    statistics[resolution + "Records"] = 0
+            return statistics
+
+    def _tierIndex(self, resolution):
+        for tierIndex, tier in enumerate(self._tiers):
+            if (tier[0] == resolution):
+                return tierIndex
+        raise ValueError("Unknown resolution '" + resolution + "'")
+
+    def _appendRecord(self, resolution, record):
+        with open(self._fileLocations[resolution], "ab") as historyFile:
+            historyFile.write(self.RECORD_STRUCT.pack(*record))
+        self._lastRecords[resolution] = record
+        self.recordCount += 1
+
+    # rewrite the file without the records older than the retention
+    def _removeOldRecords(self, tier, currentTime):
+        resolution, bucketSize, retention = tier
+        if (retention == None):
+            return
+        fileLocation = self._fileLocations[resolution]
+        firstRecordTime = self._readFirstRecordTime(fileLocation)
+        if (firstRecordTime == None or currentTime - firstRecordTime < retention + self.RETENTION_SLACK):
+            return
+        records = self._readRecords(fileLocation, currentTime - retention, None)
+        temporaryFileLocation = fileLocation + ".tmp"
+        with open(temporaryFileLocation, "wb") as temporaryFile:
+            for record in records:
+                temporaryFile.write(self.RECORD_STRUCT.pack(*record))
+        os.replace(temporaryFileLocation, fileLocation)
+
+    def _readFirstRecordTime(self, fileLocation):
+        try:
+            with open(fileLocation, "rb") as historyFile:
+                data = historyFile.read(self.TIME_STRUCT.size)
+        except FileNotFoundError:
+            return None
+        if (len(data) < self.TIME_STRUCT.size):
+            return None
+        return self.TIME_STRUCT.unpack(data)[0]
+
+    # endTime None: up to the last record
+    def _readRecords(self, fileLocation, startTime, endTime):
+        try:
+            historyFile = open(fileLocation, "rb")
+        except FileNotFoundError:
+            return []
+        with historyFile:
+            recordSize = self.RECORD_STRUCT.size
+            recordCount = os.fstat(historyFile.fileno()).st_size // recordSize
+            if (recordCount == 0):
+                return []
+            with mmap.mmap(historyFile.fileno(), recordCount * recordSize, access=mmap.ACCESS_READ) as historyMap:
+                # first record with time > startTime, the one before holds the values at startTime
+                low = 0
+                high = recordCount
+                while (low < high):
+                    middle = (low + high) // 2
+                    if (self.TIME_STRUCT.unpack_from(historyMap, middle * recordSize)[0] <= startTime):
+                        low = middle + 1
+                    else:
+                        high = middle
+                records = []
+                for recordIndex in range(max(low - 1, 0), recordCount):
+                    record = self.RECORD_STRUCT.unpack_from(historyMap, recordIndex * recordSize)
+                    if (endTime != None and record[0] > endTime):
+                        break
+                    records.append(record)
+                return records
+
+    # an incomplete last record (e.g. power cut during the write) is removed
+    def _repairAndReadLastRecord(self, fileLocation):
+        try:
+            with open(fileLocation, "r+b") as historyFile:
+                recordSize = self.RECORD_STRUCT.size
+                fileSize = os.fstat(historyFile.fileno()).st_size
+                if (fileSize % recordSize != 0):
+                    self._logWarning("Removing incomplete record of tracking history '" + fileLocation + "'")
+                    historyFile.truncate(fileSize - fileSize % recordSize)
+                    fileSize -= fileSize % recordSize
+                if (fileSize == 0):
+                    return None
+                historyFile.seek(fileSize - recordSize)
+                return self.RECORD_STRUCT.unpack(historyFile.read(recordSize))
+        except FileNotFoundError:
+            return None
+
+    def _logWarning(self, message):
+        if (self._logger != None):
+            self._logger.warning(message)
+        else:
+            print(message)
@@ -0,0 +1,63 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+from octoprint.util import RepeatedTimer
+
+
+class TrackingPublisher():
+    """
+    Pushes the changed tracking information to all connected clients (plugin message), at most maxRate times per
+    second. Only the values that changed since the last message are sent, nothing is sent if nothing changed.
+
+    Message: {"action": "trackingInformation", "version": "...", "changed": {"totalPrintTime": 123, ...}}
+    """
+
+    def __init__(self, getTrackingInformationFunction, sendMessageFunction, maxRate=2.0, logger=None):
+        # getTrackingInformationFunction returns a tuple (stateVersion, trackingInformation, ...)
+        self._getTrackingInformationFunction = getTrackingInformationFunction
+        self._sendMessageFunction = sendMessageFunction
+        self.maxRate = maxRate
+        self._logger = logger
+        self._timer = None
+        self._lastVersion = None
+        self._lastTrackingInformation = {}
+        self.messageCount = 0
+
+    def start(self):
+        if (self.maxRate <= 0 or self._timer != None):
+            return
+        self._timer = RepeatedTimer(1.0 / self.maxRate, self._publish)
+        self._timer.start()
+
+    def stop(self):
+        if (self._timer != None):
+            self._timer.cancel()
+            self._timer = None
+
+    def _publish(self):
+        try:
+            trackingState = self._getTrackingInformationFunction()
+            stateVersion = trackingState[0]
+            if (stateVersion == self._lastVersion):
+                return
+            trackingInformation = trackingState[1]
+
+            changedValues = {}
+            for key, value in trackingInformation.items():
+                if (self._lastTrackingInformation.get(key) != value):
+                    changedValues[key] = value
+            self._lastVersion = stateVersion
+            self._lastTrackingInformation = trackingInformation
+            if (len(changedValues) == 0):
+                # e.g. a line without visible change
+                return
+
+            self._sendMessageFunction({
+                "action": "trackingInformation",
+                "version": stateVersion,
+                "changed": changedValues
+            })
+            self.messageCount += 1
+        except Exception as e:
+            if (self._logger != None):
+                self._logger.exception("Could not publish tracking information: " + str(e))
@@ -1,50 +1,175 @@
 # coding=utf-8
 from __future__ import absolute_import
 
-import sys
+import threading
 import time
-import json
-import os
-from time import perf_counter as now
+from collections import deque
+from time import monotonic as now
 
 from datetime import datetime
 
 from octoprint_MaintenanceManager.utils import StringUtils
 from octoprint_MaintenanceManager.utils.odometer import Odometer
 from octoprint_MaintenanceManager.utils.odometer import Vector3D
+from octoprint_MaintenanceManager.services.FastTracking import FastTracking
+from octoprint_MaintenanceManager.services.GCodeQueueWorker import GCodeQueueWorker
+from octoprint_MaintenanceManager.services.TrackingStorage import STORAGE_BACKEND_JSON, createTrackingStorage
+from octoprint_MaintenanceManager.services.TrackingHistory import TrackingHistory
+from octoprint_MaintenanceManager.services.JobLedger import JobLedger
+from octoprint_MaintenanceManager.services.MetricsService import LatencyHistogram, MetricsService
 from octoprint.util import RepeatedTimer
 
 
 class TrackingService():
+    """
+    Print time and odometer totals of the printer, stored in the plugin data folder.
+
+    The tracking state follows TRACKING_TRANSITIONS, the print time only counts while tracking (here with a fake
+    clock):
+
+    >>> import shutil, tempfile
+    >>> clock = [1000.0]
+    >>> folder = tempfile.mkdtemp()
+    >>> service = TrackingService(clock=lambda: clock[0])
+    >>> service.initialize(folder)
+    >>> service.startTracking({"fileName": "cube.gcode"})
+    >>> clock[0] += 10.0
+    >>> service.pauseTracking()
+    >>> clock[0] += 100.0
+    >>> service.currentTrackingState, service.getCurrentTotalDuration()
+    ('pause', 10.0)
+
+    Stop after pause, the paused time is not added:
+
+    >>> service.stopTracking("cancelled")
+    >>> service.currentTrackingState, service.getTotalDuration()
+    ('stopped', 10.0)
+    >>> [(job["fileName"], job["result"], job["duration"]) for job in service.getJobs()]
+    [('cube.gcode', 'cancelled', 10.0)]
+
+    Duplicate and out-of-order events are ignored:
+
+    >>> service.stopTracking("done")
+    >>> service.pauseTracking()
+    >>> service.resumeTracking()
+    >>> service.startTracking({"fileName": "vase.gcode"})
+    >>> clock[0] += 20.0
+    >>> service.resumeTracking()
+    >>> service.currentTrackingState, service.getCurrentTotalDuration()
+    ('tracking', 30.0)
+
+    A start without stop (e.g. PRINT_DONE missing after a reconnect) stops the running job implicitly:
+
+    >>> service.startTracking({"fileName": "benchy.gcode"})
+    >>> clock[0] += 5.0
+    >>> service.stopTracking("done")
+    >>> [(job["fileName"], job["result"], job["duration"]) for job in service.getJobs()]
+    [('cube.gcode', 'cancelled', 10.0), ('vase.gcode', 'interrupted', 20.0), ('benchy.gcode', 'done', 5.0)]
+    >>> for transition in service.getTransitionLog():
+    ...     print(transition["event"], transition["fromState"], transition["toState"], transition["action"])
+    start stopped tracking transition
+    pause tracking pause transition
+    stop pause stopped transition
+    stop stopped stopped ignored
+    pause stopped stopped ignored
+    resume stopped stopped ignored
+    start stopped tracking transition
+    resume tracking tracking ignored
+    stop tracking stopped implicitStop
+    start stopped tracking transition
+    stop tracking stopped transition
+
+    >>> service.shutdown()
+    >>> shutil.rmtree(folder)
+    """
 
     STORAGE_TIMER_INTERVAL = 1.0
-
-    STORAGE_FILENAME = "trackingValues.json"
+    # while printing, changed values are written at most every n seconds
+    STORAGE_MAX_STALENESS = 10.0
 
     TRACKING_STATE_STOPPED = "stopped"
     TRACKING_STATE_TRACKING = "tracking"
     TRACKING_STATE_PAUSE = "pause"
 
-    def __init__(self):
+    TRACKING_EVENT_START = "start"
+    TRACKING_EVENT_PAUSE = "pause"
+    TRACKING_EVENT_RESUME = "resume"
+    TRACKING_EVENT_STOP = "stop"
+
+    # (state, event) -> new state, all other combinations are ignored (see _handleTrackingEvent)
+    TRACKING_TRANSITIONS = {
+        (TRACKING_STATE_STOPPED, TRACKING_EVENT_START): TRACKING_STATE_TRACKING,
+        (TRACKING_STATE_TRACKING, TRACKING_EVENT_PAUSE): TRACKING_STATE_PAUSE,
+        (TRACKING_STATE_TRACKING, TRACKING_EVENT_STOP): TRACKING_STATE_STOPPED,
+        (TRACKING_STATE_PAUSE, TRACKING_EVENT_RESUME): TRACKING_STATE_TRACKING,
+        (TRACKING_STATE_PAUSE, TRACKING_EVENT_STOP): TRACKING_STATE_STOPPED
+    }
+
+    TRANSITION_LOG_SIZE = 100
+
+    # clock: monotonic time in seconds, for the print time and the storage staleness
+    def __init__(self, clock=now):
+        self._clock = clock
         self.currentTrackingState = self.TRACKING_STATE_STOPPED
         self.trackingStartedDateTime = None
+        # monotonic time of the last start/resume
         self.startTime = None
         self.odometer = None
+        self._stateLock = threading.RLock()
+        self._transitionLog = deque(maxlen=self.TRANSITION_LOG_SIZE)
 
         self.pluginDataFolder = None
         self.totalDuration = 0
+        # (state, startTime, totalDuration), replaced as a whole on each change, see getCurrentTotalDuration
+        self._durationState = (self.currentTrackingState, self.startTime, self.totalDuration)
         self.axisTraveling = None
         self.extrusionTraveling = None
-
+        self.arcLength = 0.0
+
+        self._logger = None
+        self._gcodeQueueWorker = None
+        self._fastTracking = None
+        self._storageTimer = None
+        self._storage = None
+        self._history = None
+        self._jobLedger = None
+        # values at the start of the current job, see stopTracking
+        self._currentJob = None
         self._isInitiallized = False
+        # changes with every start/pause/resume/stop, the instance id makes it unique across restarts
+        self._instanceId = str(int(time.time() * 1000))
+        self._stateChangeCount = 0
+
+        self.storageMaxStaleness = self.STORAGE_MAX_STALENESS
+        self._lastSavedValues = None
+        self._lastSaveTime = None
+        self.storageWriteCount = 0
+        self.storageWritesAvoided = 0
+        self.storageWriteLatency = LatencyHistogram(MetricsService.STORAGE_LATENCY_BUCKETS)
         pass
 
-    def initialize(self, pluinDataFolder, logger = None):
+    # asyncProcessing: G-code lines are only queued by processGCodeLine and evaluated by a separate worker thread
+    # arcAxisProjection: X/Y traveling of arc moves (G2/G3) along the arc, otherwise like a linear move
+    # storageMaxStaleness: while printing, changed values are written at most every n seconds
+    # fastMode: the lines are evaluated in runs, with a sampled accuracy check (see FastTracking). Only without
+    #           asyncProcessing, the worker already evaluates the queued lines in runs
+    # storageBackend: where the values are stored, see TrackingStorage.createTrackingStorage
+    def initialize(self, pluinDataFolder, logger = None, asyncProcessing = False, asyncQueueSize = 10000, arcAxisProjection = True,
+                   storageMaxStaleness = STORAGE_MAX_STALENESS, fastMode = False, storageBackend = STORAGE_BACKEND_JSON):
         self.pluginDataFolder = pluinDataFolder
+        self._logger = logger
+        self.storageMaxStaleness = storageMaxStaleness
+        self._storage = createTrackingStorage(storageBackend, pluinDataFolder, logger)
+        self._history = TrackingHistory(pluinDataFolder, logger)
+        self._jobLedger = JobLedger(pluinDataFolder, logger)
+        self._jobLedger.load()
 
         self._loadInitialValues()
+        self._publishDurationState()
         self.odometer = Odometer(totalAxisTraveling=self.axisTraveling,
-                                 totalExtrusionTraveleing=self.extrusionTraveling)
+                                 totalExtrusionTraveleing=self.extrusionTraveling,
+                                 totalArcLength=self.arcLength,
+                                 arcAxisProjection=arcAxisProjection)
 
         if (self.trackingStartedDateTime == None):
             self.trackingStartedDateTime = datetime.now()
@@ -52,25 +177,63 @@ class TrackingService():
 
         self._initStorageTimer()
 
+        if (asyncProcessing == True):
+            self._gcodeQueueWorker = GCodeQueueWorker(self.odometer.processGCodeLines, asyncQueueSize, logger)
+            self._gcodeQueueWorker.start()
+        elif (fastMode == True):
+            self._fastTracking = FastTracking(self.odometer, logger=logger)
+
         self._isInitiallized = True
         pass
 
+    # stop the timer/worker and write the current values
+    def shutdown(self):
+        if (self._storageTimer != None):
+            self._storageTimer.cancel()
+            # a running tick must not write after the final compact
+            self._storageTimer.join()
+            self._storageTimer = None
+        if (self._gcodeQueueWorker != None):
+            self._gcodeQueueWorker.stop()
+        if (self._fastTracking != None):
+            self._fastTracking.flush()
+        if (self._isInitiallized == True):
+            with self._stateLock:
+                if (self.currentTrackingState == self.TRACKING_STATE_TRACKING):
+                    self.totalDuration = self._calcTotalDuration()
+                    self.startTime = self._clock()
+                    self._publishDurationState()
+            # leave a complete snapshot and an empty journal
+            self._storage.compact(self._collectCurrentValues())
+            self._storage.close()
+
     def _storageTimerFunction(self):
-        self._saveCurrentValues()
+        # only write if something changed and, while printing, the last write is older then storageMaxStaleness
+        valuesAsDict = self._collectCurrentValues()
+        # at most one history record per TrackingHistory.SAMPLE_INTERVAL
+        self._history.sample(time.time(), valuesAsDict)
+        if (valuesAsDict == self._lastSavedValues):
+            self.storageWritesAvoided += 1
+            return
+        if (self.currentTrackingState == self.TRACKING_STATE_TRACKING and
+            self._lastSaveTime != None and
+            self._clock() - self._lastSaveTime < self.storageMaxStaleness):
+            self.storageWritesAvoided += 1
+            return
+        self._writeValues(valuesAsDict)
         # print(".")
         pass
 
     def _initStorageTimer(self):
-        storageTimer = RepeatedTimer(self.STORAGE_TIMER_INTERVAL, self._storageTimerFunction)
-        storageTimer.start()
+        self._storageTimer = RepeatedTimer(self.STORAGE_TIMER_INTERVAL, self._storageTimerFunction)
+        self._storageTimer.start()
 
     def _loadInitialValues(self):
-        result = {}
         try:
-            storageFileLocation = os.path.join(self.pluginDataFolder, self.STORAGE_FILENAME)
-            f = open(storageFileLocation, "rt")
-            dictAsJson = json.load(f)
-            result = dictAsJson
+            result = self._storage.load()
+            if (result == None):
+                # Firsttime, nothing stored
+                return
 
             # assign last values
             dateTimeStr = result["trackingStartedDateTime"]
@@ -86,91 +249,226 @@ class TrackingService():
                 self.axisTraveling = Vector3D(x,y,z)
 
             self.extrusionTraveling = result["extrusionTraveling"]
+            if ("arcLength" in result):
+                self.arcLength = result["arcLength"]
 
         except Exception as e:
-            # Firsttime we expect FileNotFoundError
-            if (type(e) != FileNotFoundError):
-                print("BOOOOOMMMM")
+            if (self._logger != None):
+                self._logger.exception("Could not load tracking values: " + str(e))
+            else:
                 print(e)
 
-
+    # write the current values, no matter if they changed or not
     def _saveCurrentValues(self):
+        self._writeValues(self._collectCurrentValues())
 
-        currentTotalDuration = self.getCurrentTotalDuration()
-        axisTraveling = self.getAxisTraveling()
-        extrusionTraveling =  self.getExtrusionTraveling()
+    def _collectCurrentValues(self):
+        # all totals from the same line, even if the odometer is processing in parallel
+        odometerSnapshot = self.getOdometerSnapshot()
 
-        axis = Vector3D(1.0, 2.0, 3.0)
         valuesAsDict = {
             "trackingStartedDateTime": self.trackingStartedDateTime,
             "totalDuration": self.totalDuration,
-            "axisTraveling.x": axisTraveling.x,
-            "axisTraveling.y": axisTraveling.y,
-            "axisTraveling.z": axisTraveling.z,
-            "extrusionTraveling": extrusionTraveling
+            "axisTraveling.x": odometerSnapshot.axisTravelingX,
+            "axisTraveling.y": odometerSnapshot.axisTravelingY,
+            "axisTraveling.z": odometerSnapshot.axisTravelingZ,
+            "extrusionTraveling": list(odometerSnapshot.extrusionTraveling),
+            "arcLength": odometerSnapshot.arcLength
         }
-        dictAsJson = json.dumps(valuesAsDict, indent=4, default=str)
+        return valuesAsDict
 
-        storageFileLocation = os.path.join(self.pluginDataFolder, self.STORAGE_FILENAME)
-        f = open(storageFileLocation, "wt")
-        f.write(dictAsJson)
-        f.close()
+    def _writeValues(self, valuesAsDict):
+        startTime = self._clock()
+        self._storage.save(valuesAsDict)
+        self.storageWriteLatency.observe(self._clock() - startTime)
 
+        self._lastSavedValues = valuesAsDict
+        self._lastSaveTime = self._clock()
+        self.storageWriteCount += 1
         pass
 
-    def startTracking(self):
+    def getStorageStatistics(self):
+        return {
+            "writes": self.storageWriteCount,
+            "writesAvoided": self.storageWritesAvoided
+        }
+
+    # counter records between startTime and endTime (seconds since epoch), see TrackingHistory.query
+    def getHistory(self, startTime, endTime, resolution=None):
+        return self._history.query(startTime, endTime, resolution)
+
+    # job entries between startTime and endTime (seconds since epoch), optional only of one file, see JobLedger.query
+    def getJobs(self, fileName=None, startTime=None, endTime=None):
+        return self._jobLedger.query(fileName, startTime, endTime)
+
+    def getJobPage(self, jobs, page, pageSize):
+        return self._jobLedger.getPage(jobs, page, pageSize)
+
+    def getJobTotals(self, jobs):
+        return self._jobLedger.getTotals(jobs)
+
+    # jobInformation: {"fileName", "filePath", "origin", "user"} of the print job
+    def startTracking(self, jobInformation=None):
         if (self._isInitiallized == False or self.pluginDataFolder == None):
             raise AssertionError("Before you start, you need to call 'initialize' and assign a pluginDataFolder")
-        if (self.currentTrackingState != self.TRACKING_STATE_STOPPED):
-            raise AssertionError("Start Tracking not possible, because tracking is currently not stopped. Current state: "+self.currentTrackingState)
-        print("Start Tracking ")
+        self._handleTrackingEvent(self.TRACKING_EVENT_START, jobInformation=jobInformation)
+
+    def pauseTracking(self):
+        self._handleTrackingEvent(self.TRACKING_EVENT_PAUSE)
 
+    def resumeTracking(self):
+        self._handleTrackingEvent(self.TRACKING_EVENT_RESUME)
+
+    # result: "done", "failed" or "cancelled" ("interrupted" if a new job starts without stop)
+    def stopTracking(self, result=None):
+        self._handleTrackingEvent(self.TRACKING_EVENT_STOP, result=result)
+
+    # last state transitions, oldest first: [{"dateTime", "monotonicTime", "event", "fromState", "toState", "action"}]
+    def getTransitionLog(self):
+        with self._stateLock:
+            return list(self._transitionLog)
+
+    # The events are not reliable: after a reconnect PRINT_DONE may be missing, events can be duplicated or arrive out
+    # of order. Instead of raising, each (state, event) is either a transition (TRACKING_TRANSITIONS), an implicit stop
+    # of the previous job (start while not stopped) or ignored. Everything is written to the transition log.
+    def _handleTrackingEvent(self, event, jobInformation=None, result=None):
+        with self._stateLock:
+            eventTime = self._clock()
+            fromState = self.currentTrackingState
+            if (event == self.TRACKING_EVENT_START and fromState != self.TRACKING_STATE_STOPPED):
+                # e.g. reconnect without PRINT_DONE, the previous job ends now
+                self._logTransition(eventTime, self.TRACKING_EVENT_STOP, fromState, self.TRACKING_STATE_STOPPED,
+                                    "implicitStop")
+                self._stop(eventTime, "interrupted")
+                fromState = self.currentTrackingState
+
+            toState = self.TRACKING_TRANSITIONS.get((fromState, event))
+            if (toState == None):
+                self._logTransition(eventTime, event, fromState, fromState, "ignored")
+                return
+
+            if (event == self.TRACKING_EVENT_START):
+                self._start(eventTime, jobInformation)
+            elif (event == self.TRACKING_EVENT_PAUSE):
+                self._pause(eventTime)
+            elif (event == self.TRACKING_EVENT_RESUME):
+                self._resume(eventTime)
+            elif (event == self.TRACKING_EVENT_STOP):
+                self._stop(eventTime, result)
+            self._logTransition(eventTime, event, fromState, toState, "transition")
+
+    def _start(self, eventTime, jobInformation):
+        # lines sent before the start don't belong to the job
+        self.flushGCodeQueue()
+        self._currentJob = {
+            "jobInformation": jobInformation if jobInformation != None else {},
+            "startTime": time.time(),
+            "totalDuration": self.totalDuration,
+            "odometerSnapshot": self.getOdometerSnapshot()
+        }
+        self.startTime = eventTime
         self.currentTrackingState = self.TRACKING_STATE_TRACKING
-        self.startTime = now()
-        pass
+        self._publishDurationState()
+        self._stateChangeCount += 1
 
-    def pauseTracking(self):
-        if (self.currentTrackingState != self.TRACKING_STATE_TRACKING):
-            raise AssertionError("Pause Tracking not possible, because tracking is currently not tracking. Current state: "+self.currentTrackingState)
-        print("Pause Tracking ")
+    def _pause(self, eventTime):
+        self.flushGCodeQueue()
+        self.totalDuration = self._calcTotalDuration(eventTime)
         self.currentTrackingState = self.TRACKING_STATE_PAUSE
-
-        # nowTime = int(now())
-        # startTime = int(self.startTime)
-        # currentDuration = (nowTime - startTime)
-        # self.totalDuration = self.totalDuration + currentDuration
-        self.totalDuration = self._calcTotalDuration()
+        self._publishDurationState()
+        self._stateChangeCount += 1
 
         self._saveCurrentValues()
 
-    def resumeTracking(self):
-        if (self.currentTrackingState != self.TRACKING_STATE_PAUSE):
-            raise AssertionError("Resume Tracking not possible, because tracking is currently not paused. Current state: "+self.currentTrackingState)
-        print("Resume Tracking ")
+    def _resume(self, eventTime):
+        self.startTime = eventTime
         self.currentTrackingState = self.TRACKING_STATE_TRACKING
-        self.startTime = now()
-
-    def stopTracking(self):
-        # if (self.currentTrackingState != self.TRACKING_STATE_TRACKING and self.currentTrackingState != self.TRACKING_STATE_PAUSE):
-        #     raise AssertionError("Stop Tracking not possible, because tracking is currently not tracking. Current state: "+self.currentTrackingState)
-        print("Stop Tracking ")
+        self._publishDurationState()
+        self._stateChangeCount += 1
+
+    def _stop(self, eventTime, result):
+        self.flushGCodeQueue()
+        # the paused time is already part of totalDuration
+        if (self.currentTrackingState == self.TRACKING_STATE_TRACKING):
+            self.totalDuration = self._calcTotalDuration(eventTime)
         self.currentTrackingState = self.TRACKING_STATE_STOPPED
-
-        if (self.currentTrackingState != self.TRACKING_STATE_PAUSE):
-            nowTime = int(now())
-            startTime = int(self.startTime)
-            currentDuration = (nowTime - startTime)
-            self.totalDuration = self.totalDuration + currentDuration
+        self._publishDurationState()
+        self._stateChangeCount += 1
 
         self._saveCurrentValues()
+        self._addJobToLedger(result)
+
+    def _logTransition(self, eventTime, event, fromState, toState, action):
+        self._transitionLog.append({
+            "dateTime": datetime.now().isoformat(),
+            "monotonicTime": eventTime,
+            "event": event,
+            "fromState": fromState,
+            "toState": toState,
+            "action": action
+        })
+        if (action != "transition" and self._logger != None):
+            self._logger.warning("Tracking event '" + event + "' in state '" + fromState + "': " + action)
+
+    def _addJobToLedger(self, result):
+        if (self._currentJob == None):
+            return
+        currentJob = self._currentJob
+        self._currentJob = None
+        startSnapshot = currentJob["odometerSnapshot"]
+        endSnapshot = self.getOdometerSnapshot()
+        jobInformation = currentJob["jobInformation"]
+        self._jobLedger.addJob({
+            "fileName": jobInformation.get("fileName"),
+            "filePath": jobInformation.get("filePath"),
+            "origin": jobInformation.get("origin"),
+            "user": jobInformation.get("user"),
+            "startTime": currentJob["startTime"],
+            "endTime": time.time(),
+            "result": result,
+            "duration": self.totalDuration - currentJob["totalDuration"],
+            "axisTraveling": {
+                "x": endSnapshot.axisTravelingX - startSnapshot.axisTravelingX,
+                "y": endSnapshot.axisTravelingY - startSnapshot.axisTravelingY,
+                "z": endSnapshot.axisTravelingZ - startSnapshot.axisTravelingZ
+            },
+            "extrusionTraveling": [endExtrusion - startExtrusion for endExtrusion, startExtrusion in
+                                   zip(endSnapshot.extrusionTraveling, startSnapshot.extrusionTraveling)],
+            "arcLength": endSnapshot.arcLength - startSnapshot.arcLength
+        })
 
     def processGCodeLine(self, gcodeLine:str):
         # if (self.currentTrackingState != self.TRACKING_STATE_TRACKING):
         #     raise AssertionError("Process Tracking not possible, because tracking is currently not tracking. Current state: "+self.currentTrackingState)
         # print("Process Tracking ")
+        if (self._gcodeQueueWorker != None):
+            self._gcodeQueueWorker.enqueue(gcodeLine)
+            return
+        if (self._fastTracking != None):
+            self._fastTracking.processGCodeLine(gcodeLine)
+            return
         self.odometer.processGCodeLine(gcodeLine)
         pass
 
+    # evaluate all queued G-code lines (async and fast mode), so the totals are up to date
+    def flushGCodeQueue(self):
+        if (self._gcodeQueueWorker != None):
+            self._gcodeQueueWorker.flush()
+        if (self._fastTracking != None):
+            self._fastTracking.flush()
+
+    # None, if async processing is not enabled
+    def getGCodeQueueStatistics(self):
+        if (self._gcodeQueueWorker == None):
+            return None
+        return self._gcodeQueueWorker.getStatistics()
+
+    # None, if the fast mode is not used. Otherwise line counts and drift, see FastTracking.getStatistics
+    def getFastTrackingStatistics(self):
+        if (self._fastTracking == None):
+            return None
+        return self._fastTracking.getStatistics()
+
     def getTrackingSince(self):
         return self.trackingStartedDateTime
 
@@ -178,26 +476,65 @@ class TrackingService():
     def getTotalDuration(self):
         return self.totalDuration
 
-    # Calculates the currentTotalDuration
+    # Calculates the currentTotalDuration. Without lock (printTime counter function, called by the sending thread for
+    # each line), from the state tuple of the last transition, so it never waits for a running pause/stop
     def getCurrentTotalDuration(self):
-        if (self.currentTrackingState == self.TRACKING_STATE_PAUSE or
-            self.currentTrackingState ==self.TRACKING_STATE_STOPPED or
-            self.startTime == None):
-            return self.totalDuration
-
-        return self._calcTotalDuration()
-
+        currentTrackingState, startTime, totalDuration = self._durationState
+        if (currentTrackingState != self.TRACKING_STATE_TRACKING or startTime == None):
+            return totalDuration
+        return totalDuration + max(self._clock() - startTime, 0.0)
+
+    # called by the writer after each change of currentTrackingState, startTime or totalDuration
+    def _publishDurationState(self):
+        self._durationState = (self.currentTrackingState, self.startTime, self.totalDuration)
+
+    # Version of the shown tracking values (as string, e.g. for an ETag). Changes with each state change and with the
+    # shown values: full seconds of print time and full mm of each total (the resolution of secondsToText/mmToText).
+    # Lines that change the totals by less than a mm keep the version, so a poll can get a "304 Not Modified" while
+    # printing. The raw values of a version may lag behind by less than a mm.
+    def getStateVersion(self, odometerSnapshot, currentTotalDuration):
+        shownValues = (int(currentTotalDuration), int(odometerSnapshot.axisTravelingX),
+                       int(odometerSnapshot.axisTravelingY), int(odometerSnapshot.axisTravelingZ),
+                       int(odometerSnapshot.arcLength)) + tuple(int(extrusion) for extrusion in
+                                                                odometerSnapshot.extrusionTraveling)
+        # the hash of a tuple of ints doesn't depend on PYTHONHASHSEED
+        return "{}-{}-{:x}".format(self._instanceId, self._stateChangeCount, hash(shownValues) & 0xffffffffffffffff)
+
+    # coherent copy of all odometer totals, never blocks the thread that processes the G-code
+    def getOdometerSnapshot(self):
+        return self.odometer.getSnapshot()
+
+    # the following getters return copies, use getOdometerSnapshot if you need more then one of them
     def getAxisTraveling(self):
-        return self.odometer.getTotalAxisTraveling()
+        odometerSnapshot = self.getOdometerSnapshot()
+        return Vector3D(odometerSnapshot.axisTravelingX, odometerSnapshot.axisTravelingY, odometerSnapshot.axisTravelingZ)
 
     def getExtrusionTraveling(self):
-        return self.odometer.getTotalExtrusionTraveling()
-
-    def _calcTotalDuration(self):
-        nowTime = int(now())
-        startTime = int(self.startTime)
-        currentDuration = (nowTime - startTime)
-        return self.totalDuration + currentDuration
+        return list(self.getOdometerSnapshot().extrusionTraveling)
+
+    def getArcLength(self):
+        return self.getOdometerSnapshot().arcLength
+
+    # counterName -> function returning the current value (printTime in seconds, all others in mm). Cheap enough to
+    # be called for every G-code line, e.g. by the MaintenanceService
+    def getCounterFunctions(self):
+        odometer = self.odometer
+        counterFunctions = {
+            "printTime": self.getCurrentTotalDuration,
+            "x": lambda: odometer.totalAxisTraveling.x,
+            "y": lambda: odometer.totalAxisTraveling.y,
+            "z": lambda: odometer.totalAxisTraveling.z,
+            "arcLength": lambda: odometer.totalArcLength
+        }
+        for toolIndex in range(odometer.max_extruders):
+            counterFunctions["t" + str(toolIndex)] = lambda toolIndex=toolIndex: odometer.totalExtrusionTraveleing[toolIndex]
+        return counterFunctions
+
+    # seconds, not truncated, otherwise each pause would lose up to one second
+    def _calcTotalDuration(self, nowTime=None):
+        if (nowTime == None):
+            nowTime = self._clock()
+        return self.totalDuration + max(nowTime - self.startTime, 0.0)
 
 
 if __name__ == "__main__":
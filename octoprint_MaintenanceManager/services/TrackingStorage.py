@@ -0,0 +1,291 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import abc
+import json
+import os
+import threading
+
+STORAGE_BACKEND_JSON = "json"
+STORAGE_BACKEND_SQLITE = "sqlite"
+
+# database of the SqliteTrackingStorage, here so the JSON backend can check for it without importing sqlite3
+SQLITE_DATABASE_FILENAME = "trackingValues.sqlite"
+
+
+def createTrackingStorage(backend, folder, logger=None):
+    """
+    Storage of the given backend (STORAGE_BACKEND_*), unknown backends fall back to JSON. After a switch of the
+    backend, the values of the previous one are migrated (both directions, see SqliteTrackingStorage).
+
+    JSON -> SQLite -> JSON, the files of the previous storage are renamed to "<name>.migrated":
+
+    >>> import shutil, tempfile
+    >>> folder = tempfile.mkdtemp()
+    >>> storage = createTrackingStorage(STORAGE_BACKEND_JSON, folder)
+    >>> storage.save({"x": 1.0, "y": 2.0})
+    >>> storage.close()
+    >>> storage = createTrackingStorage(STORAGE_BACKEND_SQLITE, folder)
+    >>> storage.load()  # doctest: +ELLIPSIS
+    Tracking values imported from '...trackingValues.json' into '...trackingValues.sqlite'
+    {'x': 1.0, 'y': 2.0}
+    >>> sorted(os.listdir(folder))  # doctest: +NORMALIZE_WHITESPACE
+    ['trackingValues.json.migrated',
+     'trackingValues.sqlite', 'trackingValues.sqlite-shm', 'trackingValues.sqlite-wal']
+    >>> storage.save({"x": 3.0, "y": 2.0})
+    >>> storage.close()
+    >>> storage = createTrackingStorage(STORAGE_BACKEND_JSON, folder)  # doctest: +ELLIPSIS
+    Tracking values exported from '...trackingValues.sqlite' into '...trackingValues.json'
+    >>> storage.load() == {"x": 3.0, "y": 2.0}
+    True
+    >>> storage.close()
+    >>> sorted(os.listdir(folder))  # doctest: +NORMALIZE_WHITESPACE
+    ['trackingValues.json', 'trackingValues.json.journal', 'trackingValues.json.migrated',
+     'trackingValues.sqlite.migrated']
+    >>> shutil.rmtree(folder)
+    """
+    if (backend == STORAGE_BACKEND_SQLITE):
+        from octoprint_MaintenanceManager.services.SqliteTrackingStorage import SqliteTrackingStorage
+        return SqliteTrackingStorage(folder, logger=logger)
+    if (backend != STORAGE_BACKEND_JSON):
+        message = "Unknown storage backend '" + str(backend) + "', using '" + STORAGE_BACKEND_JSON + "'"
+        if (logger != None):
+            logger.warning(message)
+        else:
+            print(message)
+    jsonStorage = JsonTrackingStorage(folder, logger=logger)
+    if (os.path.exists(os.path.join(folder, SQLITE_DATABASE_FILENAME))):
+        # the database was used last
+        from octoprint_MaintenanceManager.services.SqliteTrackingStorage import SqliteTrackingStorage
+        SqliteTrackingStorage(folder, logger=logger).exportToJsonStorage(jsonStorage)
+    return jsonStorage
+
+
+class TrackingStorage(abc.ABC):
+    """
+    Interface of the storage of the tracking values, a flat dict (see TrackingService._collectCurrentValues). Values
+    that are not JSON serializable (datetime) are stored as str.
+
+    Implementations: JsonTrackingStorage (default) and SqliteTrackingStorage.
+    """
+
+    # returns the values dict or None if nothing was stored, yet
+    @abc.abstractmethod
+    def load(self):
+        pass
+
+    # store the values, implementations should only write the changed ones
+    @abc.abstractmethod
+    def save(self, values):
+        pass
+
+    # write all values and leave the storage in its most compact form (e.g. at shutdown)
+    @abc.abstractmethod
+    def compact(self, values):
+        pass
+
+    @abc.abstractmethod
+    def close(self):
+        pass
+
+
+class JsonTrackingStorage(TrackingStorage):
+    """
+    Crash-safe storage of the tracking values in JSON files.
+
+    - Snapshot: the complete values as JSON, always written to a temp-file and renamed afterwards (atomic), so a
+      power cut leaves either the old or the new snapshot, but never a truncated one.
+    - Journal: append-only file with one compact JSON line per save, containing only the changed values.
+      During load, the journal is replayed on top of the snapshot. An incomplete last line (power cut) is ignored.
+    - Compaction: after JOURNAL_COMPACTION_SIZE entries the values are written as new snapshot and the journal is
+      cleared.
+
+    Each journal entry has a sequence number and the snapshot stores the last included one, so entries that are
+    already part of the snapshot (crash between snapshot rename and journal clearing) are not replayed.
+
+    save is called by the storage timer and by the event thread (pause/stop), compact/close at shutdown, so all
+    access is serialized by a lock.
+    """
+
+    JOURNAL_COMPACTION_SIZE = 100
+
+    SEQUENCE_KEY = "journalSequence"
+
+    SNAPSHOT_FILENAME = "trackingValues.json"
+
+    def __init__(self, folder, snapshotFilename=SNAPSHOT_FILENAME, logger=None):
+        self._logger = logger
+        self.snapshotFileLocation = os.path.join(folder, snapshotFilename)
+        self.journalFileLocation = self.snapshotFileLocation + ".journal"
+        self._persistedValues = {}
+        self._journalEntryCount = 0
+        self._journalFile = None
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Returns the values dict or None if nothing was stored, yet.
+
+        Recovery after a power cut during the write of a journal entry, the incomplete last entry is ignored:
+
+        >>> import shutil, tempfile
+        >>> folder = tempfile.mkdtemp()
+        >>> storage = JsonTrackingStorage(folder)
+        >>> storage.load() is None
+        True
+        >>> storage.save({"x": 1.0, "y": 2.0})
+        >>> storage.save({"x": 3.0, "y": 2.0})
+        >>> storage.close()
+        >>> with open(storage.journalFileLocation, "at") as journalFile:
+        ...     _ = journalFile.write('{"seq":3,"changed":{"x":')
+        >>> storage = JsonTrackingStorage(folder)
+        >>> storage.load()
+        Ignoring incomplete tracking journal entry '{"seq":3,"changed":{"x":'
+        {'x': 3.0, 'y': 2.0}
+        >>> storage.close()
+
+        The replayed journal is part of the snapshot now (sequence 2). After a crash between the snapshot rename and
+        the clearing of the journal, the entries up to this sequence are skipped:
+
+        >>> with open(storage.journalFileLocation, "wt") as journalFile:
+        ...     _ = journalFile.write('{"seq":2,"changed":{"x":99.0}}\\n{"seq":3,"changed":{"y":7.0}}\\n')
+        >>> storage = JsonTrackingStorage(folder)
+        >>> storage.load()
+        {'x': 3.0, 'y': 7.0}
+        >>> storage.close()
+
+        A corrupt snapshot is moved aside and the storage starts empty:
+
+        >>> with open(storage.snapshotFileLocation, "wt") as snapshotFile:
+        ...     _ = snapshotFile.write('{"x": 3.0, "y"')
+        >>> storage = JsonTrackingStorage(folder)
+        >>> storage.load() is None  # doctest: +ELLIPSIS
+        Tracking values '...trackingValues.json' are corrupt, moved to '...trackingValues.json.corrupt': ...
+        True
+        >>> os.path.exists(storage.snapshotFileLocation + ".corrupt")
+        True
+        >>> storage.close()
+        >>> shutil.rmtree(folder)
+        """
+        with self._lock:
+            return self._load()
+
+    def save(self, values):
+        with self._lock:
+            self._save(values)
+
+    def compact(self, values):
+        with self._lock:
+            self._compact(values)
+
+    def close(self):
+        with self._lock:
+            if (self._journalFile != None):
+                self._journalFile.close()
+                self._journalFile = None
+
+    def _load(self):
+        values = None
+        try:
+            with open(self.snapshotFileLocation, "rt") as snapshotFile:
+                values = json.load(snapshotFile)
+            self._sequence = values.pop(self.SEQUENCE_KEY, 0)
+        except FileNotFoundError:
+            # Firsttime we expect FileNotFoundError
+            pass
+        except ValueError as e:
+            # e.g. truncated file of an older plugin version, keep it for a manual recovery
+            corruptFileLocation = self.snapshotFileLocation + ".corrupt"
+            self._logError("Tracking values '" + self.snapshotFileLocation + "' are corrupt, moved to '" +
+                           corruptFileLocation + "': " + str(e))
+            os.replace(self.snapshotFileLocation, corruptFileLocation)
+
+        journalEntries = [journalEntry for journalEntry in self._readJournal() if journalEntry["seq"] > self._sequence]
+        if (len(journalEntries) > 0):
+            if (values == None):
+                values = {}
+            for journalEntry in journalEntries:
+                values.update(journalEntry["changed"])
+                self._sequence = journalEntry["seq"]
+            # replayed, so start with a fresh snapshot and an empty journal
+            self._compact(values)
+        elif (values != None):
+            self._persistedValues = dict(values)
+        return values
+
+    # only the changed values are appended to the journal
+    def _save(self, values):
+        changedValues = {}
+        for key, value in values.items():
+            if (key not in self._persistedValues or self._persistedValues[key] != value):
+                changedValues[key] = value
+        if (len(changedValues) == 0):
+            return
+
+        if (self._journalEntryCount >= self.JOURNAL_COMPACTION_SIZE):
+            self._compact(values)
+            return
+
+        if (self._journalFile == None):
+            self._journalFile = open(self.journalFileLocation, "at")
+        self._sequence += 1
+        journalEntry = {"seq": self._sequence, "changed": changedValues}
+        self._journalFile.write(json.dumps(journalEntry, separators=(",", ":"), default=str) + "\n")
+        self._journalFile.flush()
+        os.fsync(self._journalFile.fileno())
+        self._journalEntryCount += 1
+        self._persistedValues = dict(values)
+
+    # write all values as an atomic snapshot and clear the journal
+    def _compact(self, values):
+        temporaryFileLocation = self.snapshotFileLocation + ".tmp"
+        with open(temporaryFileLocation, "wt") as temporaryFile:
+            snapshotValues = dict(values)
+            snapshotValues[self.SEQUENCE_KEY] = self._sequence
+            temporaryFile.write(json.dumps(snapshotValues, indent=4, default=str))
+            temporaryFile.flush()
+            os.fsync(temporaryFile.fileno())
+        os.replace(temporaryFileLocation, self.snapshotFileLocation)
+        self._syncFolder()
+
+        # the snapshot contains everything, so the journal is not needed anymore
+        if (self._journalFile != None):
+            self._journalFile.close()
+        self._journalFile = open(self.journalFileLocation, "wt")
+        self._journalEntryCount = 0
+        self._persistedValues = dict(values)
+
+    def _readJournal(self):
+        journalEntries = []
+        try:
+            with open(self.journalFileLocation, "rt") as journalFile:
+                for line in journalFile:
+                    try:
+                        journalEntries.append(json.loads(line))
+                    except ValueError:
+                        # incomplete last entry, e.g. power cut during the write
+                        self._logError("Ignoring incomplete tracking journal entry '" + line.strip() + "'")
+                        break
+        except FileNotFoundError:
+            pass
+        return journalEntries
+
+    def _syncFolder(self):
+        # make the rename durable, not supported on all platforms (e.g. Windows)
+        try:
+            folderDescriptor = os.open(os.path.dirname(self.snapshotFileLocation), os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(folderDescriptor)
+        except OSError:
+            pass
+        finally:
+            os.close(folderDescriptor)
+
+    def _logError(self, message):
+        if (self._logger != None):
+            self._logger.error(message)
+        else:
+            print(message)
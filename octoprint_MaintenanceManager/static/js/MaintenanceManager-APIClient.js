@@ -44,4 +44,48 @@ function MaintenanceManagerAPIClient(pluginId, baseUrl) {
         });
     }
 
+    // numbers instead of formatted text (mm, seconds)
+    this.callRawTrackingInformation = function (responseHandler){
+        var urlToCall = this.baseUrl + "plugin/"+this.pluginId+"/trackingInformation?" + _buildRequestQuery({format: "raw"});
+        $.ajax({
+            url: urlToCall,
+            type: "GET"
+        }).always(function( data ){
+            responseHandler(data)
+        });
+    }
+
+    // all maintenance rules with their state
+    this.callMaintenanceRules = function (responseHandler){
+        var urlToCall = this.baseUrl + "plugin/"+this.pluginId+"/maintenanceRules";
+        $.ajax({
+            url: urlToCall,
+            type: "GET"
+        }).always(function( data ){
+            responseHandler(data)
+        });
+    }
+
+    // the maintenance was done, the next interval starts now
+    this.callMaintenanceDone = function (ruleId, responseHandler){
+        var urlToCall = this.baseUrl + "plugin/"+this.pluginId+"/maintenanceRules/" + encodeURIComponent(ruleId) + "/done";
+        $.ajax({
+            url: urlToCall,
+            type: "POST"
+        }).always(function( data ){
+            responseHandler(data)
+        });
+    }
+
+    // travel of a G-code file (raw numbers, mm), state "pending" until the analysis is done
+    this.callJobForecast = function (origin, path, responseHandler){
+        var urlToCall = this.baseUrl + "plugin/"+this.pluginId+"/jobForecast?" + _buildRequestQuery({origin: origin, path: path});
+        $.ajax({
+            url: urlToCall,
+            type: "GET"
+        }).always(function( data ){
+            responseHandler(data)
+        });
+    }
+
 }
@@ -18,25 +18,96 @@ $(function() {
 
         self.trackingDisplay = null;
         self.trackingDisplayVisible = false;
+        // values pushed via plugin message, polling is only used as fallback while the socket is disconnected. The
+        // server sends nothing if nothing changed, so the age of the last message says nothing about the connection
+        self.trackingInformation = null;
+        self.pushConnected = true;
+        // travel the selected file will add
+        self.selectedFile = null;
+        self.jobForecast = null;
+        var JOB_FORECAST_POLLING_INTERVAL = 2000;
+        // maintenance rules with their state, see MaintenanceService
+        self.maintenanceRules = [];
+        self.counterNames = ["printTime", "x", "y", "z", "arcLength", "t0", "t1", "t2", "t3", "t4", "t5", "t6", "t7", "t8", "t9"];
         self.trackingDisplayCloseFunction = function(){
             self.trackingDisplayVisible = false;
         }
 
+        ///////////////////////////////////////////////////// formatting, same as StringUtils.py
+        // "15.11.2020 20:21"
+        self.formatDateTime = function(isoDateTime){
+            if (!isoDateTime){
+                return "";
+            }
+            var date = new Date(isoDateTime);
+            var pad = function(value){
+                return (value < 10 ? "0" : "") + value;
+            }
+            return pad(date.getDate()) + "." + pad(date.getMonth() + 1) + "." + date.getFullYear() + " " +
+                   pad(date.getHours()) + ":" + pad(date.getMinutes());
+        }
+
+        // 10d12h23m2s
+        self.secondsToText = function(secs){
+            var days = Math.floor(secs / 86400);
+            var hours = Math.floor((secs - days * 86400) / 3600);
+            var minutes = Math.floor((secs - days * 86400 - hours * 3600) / 60);
+            var seconds = Math.floor(secs - days * 86400 - hours * 3600 - minutes * 60);
+
+            if (days > 0){
+                return days + "d" + hours + "h" + minutes + "m" + seconds + "s";
+            }
+            if (hours > 0){
+                return hours + "h" + minutes + "m" + seconds + "s";
+            }
+            if (minutes > 0){
+                return minutes + "m" + seconds + "s";
+            }
+            return seconds + "s";
+        }
+
+        // 1k 234m 5cm 6mm
+        self.mmToText = function(mm){
+            var kilo = Math.floor(mm / 1000000);
+            var meter = Math.floor((mm - kilo * 1000000) / 1000);
+            var centi = Math.floor((mm - kilo * 1000000 - meter * 1000) / 10);
+            var milli = Math.floor(mm - kilo * 1000000 - meter * 1000 - centi * 10);
+
+            if (kilo > 0){
+                return kilo + "k " + meter + "m " + centi + "cm " + milli + "mm";
+            }
+            if (meter > 0){
+                return meter + "m " + centi + "cm " + milli + "mm";
+            }
+            if (centi > 0){
+                return centi + "cm " + milli + "mm";
+            }
+            return milli + "mm";
+        }
+
+        // trackingInformation with raw numbers (mm, seconds)
         self.updateTrackingDisplayText = function(trackingInformation){
             var trackingSince  = "-";
             var totalPrintTime  = "-";
             var xMovement  = "-";
             var yMovement  = "-";
             var zMovement  = "-";
-            var eMovement  = "-";
+            var toolMovements  = "<li>T0: <b>-</b></li>";
 
             if (trackingInformation){
-                trackingSince = trackingInformation["trackingSince"];
-                totalPrintTime = trackingInformation["totalPrintTime"];
-                xMovement = trackingInformation["xMovement"];
-                yMovement = trackingInformation["yMovement"];
-                zMovement = trackingInformation["zMovement"];
-                eMovement = trackingInformation["eMovement"];
+                trackingSince = self.formatDateTime(trackingInformation["trackingSince"]);
+                totalPrintTime = self.secondsToText(trackingInformation["totalPrintTime"]);
+                xMovement = self.mmToText(trackingInformation["axisTraveling"]["x"]);
+                yMovement = self.mmToText(trackingInformation["axisTraveling"]["y"]);
+                zMovement = self.mmToText(trackingInformation["axisTraveling"]["z"]);
+                // T0 is always listed, the other tools only if they were used
+                toolMovements = "";
+                var extrusionTraveling = trackingInformation["extrusionTraveling"];
+                for (var toolIndex = 0; toolIndex < extrusionTraveling.length; toolIndex++){
+                    if (toolIndex == 0 || extrusionTraveling[toolIndex] != 0){
+                        toolMovements += "<li>T" + toolIndex + ": <b>" + self.mmToText(extrusionTraveling[toolIndex]) + "</b></li>";
+                    }
+                }
             }
 
             self.trackingDisplay.update("Tracking since: <b>" + trackingSince + "</b><br>" +
@@ -46,8 +117,132 @@ $(function() {
                             "<li>X: <b>" + xMovement + "</b></li>" +
                             "<li>Y: <b>" + yMovement + "</b></li>" +
                             "<li>Z: <b>" + zMovement + "</b></li>" +
-                            "<li>T0: <b>" + eMovement + "</b></li>" +
-                            "</ul>");
+                            toolMovements +
+                            "</ul>" +
+                            self.maintenanceRulesText() +
+                            self.jobForecastText());
+        }
+
+        // printTime in seconds, all other counters in mm
+        self.counterValueToText = function(counterName, value){
+            if (counterName == "printTime"){
+                return self.secondsToText(value);
+            }
+            return self.mmToText(value);
+        }
+
+        // current value of a counter from the (raw) trackingInformation
+        self.counterValue = function(trackingInformation, counterName){
+            if (counterName == "printTime"){
+                return trackingInformation["totalPrintTime"];
+            }
+            if (counterName == "arcLength"){
+                return trackingInformation["arcLength"];
+            }
+            if (counterName.charAt(0) == "t"){
+                return trackingInformation["extrusionTraveling"][parseInt(counterName.substring(1))];
+            }
+            return trackingInformation["axisTraveling"][counterName];
+        }
+
+        self.maintenanceRulesText = function(){
+            if (self.maintenanceRules.length == 0){
+                return "";
+            }
+            var rules = "";
+            for (var ruleIndex = 0; ruleIndex < self.maintenanceRules.length; ruleIndex++){
+                var rule = self.maintenanceRules[ruleIndex];
+                // remaining of the last rules request, or calculated with the current (pushed) values
+                var remaining = rule.remaining;
+                if (self.trackingInformation != null){
+                    remaining = rule.nextDueValue - self.counterValue(self.trackingInformation, rule.counter);
+                }
+                remaining = remaining <= 0 ? "<b>due</b>" : "in <b>" + self.counterValueToText(rule.counter, remaining) + "</b>";
+                rules += "<li>" + _.escape(rule.name) + ": " + remaining + "</li>";
+            }
+            return "Maintenance:<br>" +
+                   "<ul>" + rules + "</ul>";
+        }
+
+        self.loadMaintenanceRules = function(){
+            self.apiClient.callMaintenanceRules(function(responseData){
+                if (responseData.maintenanceRules){
+                    self.maintenanceRules = responseData.maintenanceRules;
+                }
+            });
+        }
+
+        ///////////////////////////////////////////////////// maintenance rules in the settings
+        self.addMaintenanceRule = function(){
+            self.pluginSettings.maintenanceRules.push({
+                id: ko.observable(String(Date.now())),
+                name: ko.observable(""),
+                counter: ko.observable("x"),
+                interval: ko.observable(1000000)
+            });
+        }
+
+        self.removeMaintenanceRule = function(rule){
+            self.pluginSettings.maintenanceRules.remove(rule);
+        }
+
+        self.markMaintenanceDone = function(rule){
+            self.apiClient.callMaintenanceDone(rule.id(), function(responseData){
+                self.loadMaintenanceRules();
+            });
+        }
+
+        self.jobForecastText = function(){
+            if (self.jobForecast == null || self.jobForecast.job == null){
+                return "";
+            }
+            var job = self.jobForecast.job;
+            var toolMovements = "";
+            for (var toolIndex = 0; toolIndex < job.extrusionTraveling.length; toolIndex++){
+                if (job.extrusionTraveling[toolIndex] != 0){
+                    toolMovements += "<li>T" + toolIndex + ": <b>" + self.mmToText(job.extrusionTraveling[toolIndex]) + "</b></li>";
+                }
+            }
+            return "Selected job will add:<br>" +
+                   "<ul>" +
+                   "<li>X: <b>" + self.mmToText(job.axisTraveling.x) + "</b></li>" +
+                   "<li>Y: <b>" + self.mmToText(job.axisTraveling.y) + "</b></li>" +
+                   "<li>Z: <b>" + self.mmToText(job.axisTraveling.z) + "</b></li>" +
+                   toolMovements +
+                   "</ul>" +
+                   self.dueRulesText(self.jobForecast.dueRules);
+        }
+
+        self.dueRulesText = function(dueRules){
+            if (dueRules == null || dueRules.length == 0){
+                return "";
+            }
+            var ruleNames = [];
+            for (var ruleIndex = 0; ruleIndex < dueRules.length; ruleIndex++){
+                ruleNames.push(_.escape(dueRules[ruleIndex].name));
+            }
+            return "Maintenance due after this job: <b>" + ruleNames.join(", ") + "</b><br>";
+        }
+
+        self.loadJobForecast = function(origin, path){
+            self.apiClient.callJobForecast(origin, path, function(responseData){
+                if (self.selectedFile == null || self.selectedFile.origin != origin || self.selectedFile.path != path){
+                    // meanwhile another file was selected
+                    return;
+                }
+                if (responseData.jobForecast == null){
+                    return;
+                }
+                self.jobForecast = responseData.jobForecast;
+                if (self.jobForecast.state == "pending"){
+                    window.setTimeout(function(){
+                        self.loadJobForecast(origin, path);
+                    }, JOB_FORECAST_POLLING_INTERVAL);
+                }
+                if (self.trackingDisplayVisible && self.trackingInformation != null){
+                    self.updateTrackingDisplayText(self.trackingInformation);
+                }
+            });
         }
 
         self._initUpdater = function(){
@@ -75,12 +270,16 @@ $(function() {
             self.updateTrackingDisplayWorker = function() {
                 // var clockVisible = self.settingsViewModel.settings.plugins.DisplayLayerProgress.showTimeInNavBar();
                 if (self.trackingDisplayVisible) {
-                    self.apiClient.callTrackingInformation(function(responseData){
-                        if (responseData.trackingInformation){
-                            var trackingInformaiton = responseData.trackingInformation;
-                            self.updateTrackingDisplayText(trackingInformaiton);
-                        }
-                    });
+                    // poll only at the beginning or if the push messages can't arrive
+                    var pushActive = self.pluginSettings != null && self.pluginSettings.pushUpdateMaxRate() > 0;
+                    if (self.trackingInformation == null || pushActive == false || self.pushConnected == false) {
+                        self.apiClient.callRawTrackingInformation(function(responseData){
+                            if (responseData.trackingInformation){
+                                self.trackingInformation = responseData.trackingInformation;
+                                self.updateTrackingDisplayText(self.trackingInformation);
+                            }
+                        });
+                    }
                     window.setTimeout(self.updateTrackingDisplayWorker, 1000);
                 } else {
                     // // hide clock and stop clock
@@ -106,11 +305,41 @@ $(function() {
 
         self.onAllBound = function(){
 
+            self.loadMaintenanceRules();
+
             // init timer
             self._initUpdater();
 
         }
 
+        self.onServerDisconnect = function(){
+            self.pushConnected = false;
+        }
+
+        self.onServerReconnect = function(){
+            self.pushConnected = true;
+            // changes pushed during the disconnect are lost, start again with a complete poll
+            self.trackingInformation = null;
+        }
+
+        self.onEventSettingsUpdated = function(payload){
+            self.loadMaintenanceRules();
+        }
+
+        self.onEventFileSelected = function(payload){
+            self.selectedFile = {
+                origin: payload.origin,
+                path: payload.path
+            };
+            self.jobForecast = null;
+            self.loadJobForecast(payload.origin, payload.path);
+        }
+
+        self.onEventFileDeselected = function(payload){
+            self.selectedFile = null;
+            self.jobForecast = null;
+        }
+
         // receive data from server
         self.onDataUpdaterPluginMessage = function (plugin, data) {
 
@@ -118,9 +347,27 @@ $(function() {
                 return;
             }
 
-            // if ("" == data.action){
-            //
-            // }
+            if ("trackingInformation" == data.action){
+                // only the changed values are pushed
+                if (self.trackingInformation == null){
+                    // wait for the first complete poll
+                    return;
+                }
+                $.extend(self.trackingInformation, data.changed);
+                if (self.trackingDisplayVisible){
+                    self.updateTrackingDisplayText(self.trackingInformation);
+                }
+            }
+
+            if ("maintenanceDue" == data.action){
+                new PNotify({
+                    title: "Maintenance due",
+                    text: _.escape(data.rule.name) + " (every " + self.counterValueToText(data.rule.counter, data.rule.interval) + ")",
+                    type: "notice",
+                    hide: false
+                });
+                self.loadMaintenanceRules();
+            }
 
         }
 
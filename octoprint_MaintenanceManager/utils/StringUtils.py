@@ -61,6 +61,3 @@ def mmToText(mm):
     #          ("{}m".format(minutes) if not days and minutes else "") + \
     #          ("{}s".format(seconds) if not days and not hours and seconds else "0s")
 	return result
-
-mm = 1111111
-print(mmToText(mm))
@@ -1,9 +1,11 @@
-
 # coding=utf-8
 from __future__ import absolute_import
 
 import math
 import re
+import time
+from array import array
+from collections import namedtuple
 # copied from gcodeinterpreter.py Version OP 1.7.2
 
 class Vector3D(object):
@@ -36,6 +38,8 @@ class Vector3D(object):
     True
     """
 
+    __slots__ = ("x", "y", "z")
+
     def __init__(self, *args):
         if len(args) == 3:
             (self.x, self.y, self.z) = args
@@ -121,35 +125,173 @@ regex_command = re.compile(
 )
 """Regex for a GCODE command."""
 
+regex_comment = re.compile(r"\([^)]*\)")
+"""Regex for a GCODE inline comment, e.g. "(this is a comment)"."""
+
+STATE_COMMANDS = frozenset(("G20", "G21", "G28", "G90", "G91", "G92", "M82", "M83", "M605"))
+"""GCODE commands that change the position or modes of the Odometer, but are no move."""
+
+COMMAND_PREFIXES = frozenset(("G0", "G1", "G2", "G3", "G9", "M8", "M6") + tuple("T" + str(digit) for digit in range(10)))
+"""First two characters of all GCODE commands the Odometer is interested in. All other lines are rejected before
+parsing."""
+
+
+def parseGCodeLine(line):
+    """
+    Splits a GCODE line in one pass into its command and all of its parameter words. Comments (";..." and
+    "(...)") are dropped before, so a letter inside a comment is never taken as a parameter.
+
+    Returns a tuple (gcode, tool, parameters). Parameter words without a valid number (e.g. "X" in "G28 X") are
+    included with the value None.
+
+    Examples:
+
+    >>> parseGCodeLine("G1 X10.5 Y-3 E0.25 F1800 ; move X to the Y")
+    ('G1', None, {'X': 10.5, 'Y': -3.0, 'E': 0.25, 'F': 1800.0})
+    >>> parseGCodeLine("G0 (go to X) Z0.3")
+    ('G0', None, {'Z': 0.3})
+    >>> parseGCodeLine("T1")
+    ('T', 1, {})
+    >>> parseGCodeLine("G28.1 X Ynan")
+    ('G28', None, {'X': None, 'Y': None})
+    >>> parseGCodeLine("; only a comment")
+    (None, None, {})
+    """
+    commentPosition = line.find(";")
+    if commentPosition >= 0:
+        line = line[:commentPosition]
+    if "(" in line:
+        line = regex_comment.sub(" ", line)
+
+    words = line.split()
+    if not words:
+        return None, None, {}
+
+    gcode = tool = None
+    command = words[0]
+    if command[1:].isdecimal():
+        if command[0] in "GM":
+            gcode = command
+        elif command[0] == "T":
+            gcode = "T"
+            tool = int(command[1:])
+    else:
+        # e.g. sub-codes like "G28.1"
+        match = regex_command.match(command)
+        if match:
+            values = match.groupdict()
+            if values["codeGM"]:
+                gcode = values["codeGM"]
+            elif values["codeT"]:
+                gcode = values["codeT"]
+                tool = int(values["tool"])
+
+    parameters = {}
+    for word in words[1:]:
+        try:
+            value = float(word[1:])
+        except ValueError:
+            value = None
+        else:
+            if not math.isfinite(value):
+                value = None
+        parameters[word[0]] = value
+
+    return gcode, tool, parameters
+
+
+def _integrateAbsSin(angle):
+    """
+    Integral of |sin(t)| from 0 to angle, closed form: every half turn adds 2.
+
+    >>> _integrateAbsSin(math.pi) == 2.0
+    True
+    >>> round(_integrateAbsSin(2.5 * math.pi) - _integrateAbsSin(0.5 * math.pi), 9)
+    4.0
+    """
+    halfTurns = math.floor(angle / math.pi)
+    return 2.0 * halfTurns + 1.0 - math.cos(angle - halfTurns * math.pi)
+
+
+def _calcArcCenterOffset(startPos, endPos, radius, clockwise):
+    # R-form of G2/G3, same as the firmware (Marlin): a negative radius selects the longer arc
+    deltaX = endPos.x - startPos.x
+    deltaY = endPos.y - startPos.y
+    if radius == 0.0 or (deltaX == 0.0 and deltaY == 0.0):
+        return 0.0, 0.0
+    direction = -1.0 if clockwise != (radius < 0) else 1.0
+    distance = math.sqrt(deltaX * deltaX + deltaY * deltaY)
+    # distance from the middle point to the center, 0 if the radius is too small
+    height = math.sqrt(max(0.0, radius * radius - distance * distance / 4.0))
+    centerX = (startPos.x + endPos.x) / 2.0 + direction * height * -deltaY / distance
+    centerY = (startPos.y + endPos.y) / 2.0 + direction * height * deltaX / distance
+    return centerX - startPos.x, centerY - startPos.y
+
+
+OdometerSnapshot = namedtuple("OdometerSnapshot",
+                              ["axisTravelingX", "axisTravelingY", "axisTravelingZ", "extrusionTraveling", "arcLength",
+                               "sequence"])
+"""Immutable, coherent copy of all totals of an Odometer (extrusionTraveling is a tuple, index = tool id)."""
+
 
 class Odometer(object):
 
-    def __init__(self, extrusionChangedListener=None, totalAxisTraveling = None, totalExtrusionTraveleing = None):
+    SNAPSHOT_READ_ATTEMPTS = 10
+
+    def __init__(self, extrusionChangedListener=None, totalAxisTraveling = None, totalExtrusionTraveleing = None,
+                 totalArcLength = 0.0, arcAxisProjection = True):
         # self._logger = logging.getLogger(__name__)
         self.extrusionChangedListener = extrusionChangedListener
         self.max_extruders = 10
         self.g90_extruder = False
+        self._commandHandlers = self._createCommandHandlers()
+        self.lineStatistics = {"filtered": 0, "ignored": 0, "move": 0, "arc": 0, "state": 0, "tool": 0}
+        # seqlock for the totals: odd while the writer changes them, see getSnapshot
+        self.stateSequence = 0
+
+        # True: X/Y traveling of G2/G3 is the projection of the arc on the axis, False: like a linear move
+        self.arcAxisProjection = arcAxisProjection
+        self.totalArcLength = totalArcLength
 
         self.scale = 1.0    # mm or inch
         if (totalAxisTraveling == None):
             self.totalAxisTraveling = Vector3D(0.0, 0.0, 0.0)
         else:
             self.totalAxisTraveling = totalAxisTraveling
-        if (totalExtrusionTraveleing == None):
-            self.totalExtrusionTraveleing = [0.0]
-        else:
-            self.totalExtrusionTraveleing = totalExtrusionTraveleing
+        # one fixed slot per tool, only the slot of the active tool is updated when E changed
+        self.totalExtrusionTraveleing = array("d", [0.0]) * self.max_extruders
+        if (totalExtrusionTraveleing != None):
+            for toolIndex, travel in enumerate(totalExtrusionTraveleing[:self.max_extruders]):
+                self.totalExtrusionTraveleing[toolIndex] = travel
         self.reset()
+        self._lastSnapshot = self._createSnapshot(0)
 
     def set_g90_extruder(self, flag=False):
         self.g90_extruder = flag
 
+    # new Odometer with the same position and modes, but all totals 0 (e.g. to replay some lines for comparison)
+    def copyWithoutTotals(self):
+        odometer = Odometer(arcAxisProjection=self.arcAxisProjection)
+        odometer.g90_extruder = self.g90_extruder
+        odometer.scale = self.scale
+        odometer.currentE = array("d", self.currentE)
+        odometer.totalExtrusion = array("d", self.totalExtrusion)
+        odometer.maxExtrusion = array("d", self.maxExtrusion)
+        odometer.currentExtruder = self.currentExtruder
+        odometer.extruderCount = self.extruderCount
+        odometer.relativeE = self.relativeE
+        odometer.relativeMode = self.relativeMode
+        odometer.duplicationMode = self.duplicationMode
+        odometer.lastPos = Vector3D(self.lastPos.x, self.lastPos.y, self.lastPos.z)
+        odometer.pos = Vector3D(self.pos.x, self.pos.y, self.pos.z)
+        return odometer
+
     def reset(self):
-        self.currentE = [0.0]
-        self.totalExtrusion = [0.0]
-        self.lastTotalExtrusion = [0.0]
-        self.maxExtrusion = [0.0]
+        self.currentE = array("d", [0.0]) * self.max_extruders
+        self.totalExtrusion = array("d", [0.0]) * self.max_extruders
+        self.maxExtrusion = array("d", [0.0]) * self.max_extruders
         self.currentExtruder = 0    # Tool Id
+        self.extruderCount = 1      # highest used Tool Id + 1
         self.relativeE = False
         self.relativeMode = False
         self.duplicationMode = False
@@ -170,227 +312,407 @@ class Odometer(object):
         pass
 
     def processGCodeLine(self, line):
+        if line[:2] not in COMMAND_PREFIXES:
+            # e.g. M105, M117 or comments are rejected before parsing
+            if not line[:1].isspace() or line.lstrip()[:2] not in COMMAND_PREFIXES:
+                self.lineStatistics["filtered"] += 1
+                return
+
+        gcode, tool, parameters = parseGCodeLine(line)
+        commandHandler = self._commandHandlers.get(gcode)
+        if commandHandler is None:
+            self.lineStatistics["ignored"] += 1
+            return
+
+        path, handler = commandHandler
+        self.lineStatistics[path] += 1
+        self.stateSequence += 1
+        try:
+            handler(gcode, tool, parameters)
+        finally:
+            self.stateSequence += 1
+
+    # number of processed lines for each path: filtered (rejected by prefix), ignored (parsed, but no handler),
+    # move, arc, state, tool
+    def getLineStatistics(self):
+        return dict(self.lineStatistics)
+
+    def _createCommandHandlers(self):
+        commandHandlers = {
+            "G0": ("move", self._processLinearMove),
+            "G1": ("move", self._processLinearMove),
+            "G2": ("arc", self._processArcMove),
+            "G3": ("arc", self._processArcMove),
+            "T": ("tool", self._processToolChange),
+        }
+        for gcode in STATE_COMMANDS:
+            commandHandlers[gcode] = ("state", self._processStateCommand)
+        return commandHandlers
+
+    # G0, G1
+    def _processLinearMove(self, gcode, tool, parameters):
+        x = parameters.get("X")
+        y = parameters.get("Y")
+        z = parameters.get("Z")
+        e = parameters.get("E")
+
+        if x is not None or y is not None or z is not None:
+            # this is a move
+            move = True
+        else:
+            # print head stays on position
+            move = False
 
-        # save last position
-        self.lastPos = self.pos
-        self.lastTotalExtrusion = self.totalExtrusion.copy()
+        if move:
+            self._moveTo(x, y, z)
 
-        move = False
-        match = regex_command.search(line)
-        gcode = tool = None
-        if match:
-            values = match.groupdict()
-            if "codeGM" in values and values["codeGM"]:
-                gcode = values["codeGM"]
-            elif "codeT" in values and values["codeT"]:
-                gcode = values["codeT"]
-                tool = int(values["tool"])
+        # if f is not None and f != 0:
+        #     feedrate = f
 
-        # G codes
-        if gcode in ("G0", "G1"):  # Move
-            x = self._getCodeFloat(line, "X")
-            y = self._getCodeFloat(line, "Y")
-            z = self._getCodeFloat(line, "Z")
-            e = self._getCodeFloat(line, "E")
-            f = self._getCodeFloat(line, "F")
-
-            if x is not None or y is not None or z is not None:
-                # this is a move
-                move = True
-            else:
-                # print head stays on position
-                move = False
-
-            oldPos = self.pos
-
-            # Use new coordinates if provided. If not provided, use prior coordinates (minus tool offset)
-            # in absolute and 0.0 in relative mode.
-            newPos = Vector3D(
-                x * self.scale if x is not None else (0.0 if self.relativeMode else self.pos.x),
-                y * self.scale if y is not None else (0.0 if self.relativeMode else self.pos.y),
-                z * self.scale if z is not None else (0.0 if self.relativeMode else self.pos.z),
-            )
-
-            if self.relativeMode:
-                # Relative mode: add to current position
-                self.pos += newPos
+        if e is not None:
+            if self.relativeMode or self.relativeE:
+                # e is already relative, nothing to do
+                pass
             else:
-                # Absolute mode: apply tool offsets
-                self.pos = newPos
+                e -= self.currentE[self.currentExtruder]
 
-            # if f is not None and f != 0:
-            #     feedrate = f
+            # If move with extrusion, calculate new min/max coordinates of model
+            # if e > 0 and move:
+            #     # extrusion and move -> oldPos & pos relevant for print area & dimensions
+            #     self._minMax.record(oldPos)
+            #     self._minMax.record(pos)
 
-            if e is not None:
-                if self.relativeMode or self.relativeE:
-                    # e is already relative, nothing to do
-                    pass
-                else:
-                    e -= self.currentE[self.currentExtruder]
-
-                # If move with extrusion, calculate new min/max coordinates of model
-                # if e > 0 and move:
-                #     # extrusion and move -> oldPos & pos relevant for print area & dimensions
-                #     self._minMax.record(oldPos)
-                #     self._minMax.record(pos)
-
-                self.totalExtrusion[self.currentExtruder] += e
-                self.currentE[self.currentExtruder] += e
-                self.maxExtrusion[self.currentExtruder] = max(
-                    self.maxExtrusion[self.currentExtruder], self.totalExtrusion[self.currentExtruder]
-                )
-
-                if self.currentExtruder == 0 and len(self.currentE) > 1 and self.duplicationMode:
-                    # Copy first extruder length to other extruders
-                    for i in range(1, len(self.currentE)):
-                        self.totalExtrusion[i] += e
-                        self.currentE[i] += e
-                        self.maxExtrusion[i] = max(self.maxExtrusion[i], self.totalExtrusion[i])
+            self._addExtrusion(e)
+        else:
+            e = 0
+
+        # # move time in x, y, z, will be 0 if no movement happened
+        # moveTimeXYZ = abs((oldPos - pos).length / feedrate)
+        #
+        # # time needed for extruding, will be 0 if no extrusion happened
+        # extrudeTime = abs(e / feedrate)
+        #
+        # # time to add is maximum of both
+        # totalMoveTimeMinute += max(moveTimeXYZ, extrudeTime)
+        #
+        # # process layers if there's extrusion
+        # if e:
+        #     self._track_layer(pos)
+
+        if (move):
+            self._addAxisTraveling()
+
+    def _processArcMove(self, gcode, tool, parameters):
+        """
+        G2, G3 (only XY plane). Center either by I/J offset or by radius R.
+
+        (arc length, X, Y, Z traveling) of some arcs, each from a start position set by G92:
+
+        >>> def arcTotals(lines):
+        ...     odometer = Odometer()
+        ...     for line in lines:
+        ...         odometer.processGCodeLine(line)
+        ...     totalAxisTraveling = odometer.getTotalAxisTraveling()
+        ...     return tuple(round(value, 3) for value in (odometer.getTotalArcLength(), totalAxisTraveling.x,
+        ...                                                totalAxisTraveling.y, totalAxisTraveling.z))
+
+        Quarter circle with I/J center offset, radius 10:
+
+        >>> arcTotals(["G92 X10 Y0", "G3 X0 Y10 I-10 J0"])
+        (15.708, 10.0, 10.0, 0.0)
+
+        Half circle with radius R (clockwise over the top), and the longer 3/4 circle with a negative R:
+
+        >>> arcTotals(["G92 X0 Y0", "G2 X20 Y0 R10"])
+        (31.416, 20.0, 20.0, 0.0)
+        >>> arcTotals(["G92 X0 Y0", "G2 X10 Y10 R-10"])[0]
+        47.124
+
+        Helical move (Z changes along the arc) and full circle (end == start):
+
+        >>> arcTotals(["G92 X10 Y0 Z0", "G3 X0 Y10 Z5 I-10 J0"])
+        (16.485, 10.0, 10.0, 5.0)
+        >>> arcTotals(["G92 X10 Y0", "G2 X10 Y0 I-10 J0"])
+        (62.832, 40.0, 40.0, 0.0)
+        """
+        x = parameters.get("X")
+        y = parameters.get("Y")
+        z = parameters.get("Z")
+        e = parameters.get("E")
+        i = parameters.get("I")
+        j = parameters.get("J")
+        r = parameters.get("R")
+
+        self._moveTo(x, y, z)
+        startPos = self.lastPos
+        endPos = self.pos
+        scale = self.scale
+
+        # center of the arc, relative to the start position
+        if r is not None:
+            offsetX, offsetY = _calcArcCenterOffset(startPos, endPos, r * scale, gcode == "G2")
+        else:
+            offsetX = i * scale if i is not None else 0.0
+            offsetY = j * scale if j is not None else 0.0
+
+        if offsetX != 0.0 or offsetY != 0.0:
+            # same calculation as the firmware (Marlin plan_arc)
+            radiusX = -offsetX
+            radiusY = -offsetY
+            radius = math.sqrt(radiusX * radiusX + radiusY * radiusY)
+            targetX = endPos.x - (startPos.x + offsetX)
+            targetY = endPos.y - (startPos.y + offsetY)
+            angularTravel = math.atan2(radiusX * targetY - radiusY * targetX, radiusX * targetX + radiusY * targetY)
+            if angularTravel < 0:
+                angularTravel += 2 * math.pi
+            if gcode == "G2":
+                angularTravel -= 2 * math.pi
+            if angularTravel == 0 and startPos.x == endPos.x and startPos.y == endPos.y:
+                # start == end -> full circle
+                angularTravel = 2 * math.pi
+
+            deltaZ = endPos.z - startPos.z
+            arcLength = abs(angularTravel) * radius
+            self.totalArcLength += math.sqrt(arcLength * arcLength + deltaZ * deltaZ)
+
+            if self.arcAxisProjection:
+                # integrate |dx| = r * |sin(angle)| and |dy| = r * |cos(angle)| along the arc
+                startAngle = math.atan2(radiusY, radiusX)
+                endAngle = startAngle + angularTravel
+                if endAngle < startAngle:
+                    startAngle, endAngle = endAngle, startAngle
+                totalAxisTraveling = self.totalAxisTraveling
+                totalAxisTraveling.x += radius * (_integrateAbsSin(endAngle) - _integrateAbsSin(startAngle))
+                totalAxisTraveling.y += radius * (_integrateAbsSin(endAngle + math.pi / 2) -
+                                                  _integrateAbsSin(startAngle + math.pi / 2))
+                totalAxisTraveling.z += abs(deltaZ)
             else:
-                e = 0
-
-            # # move time in x, y, z, will be 0 if no movement happened
-            # moveTimeXYZ = abs((oldPos - pos).length / feedrate)
-            #
-            # # time needed for extruding, will be 0 if no extrusion happened
-            # extrudeTime = abs(e / feedrate)
-            #
-            # # time to add is maximum of both
-            # totalMoveTimeMinute += max(moveTimeXYZ, extrudeTime)
-            #
-            # # process layers if there's extrusion
-            # if e:
-            #     self._track_layer(pos)
-        # - arc movement not used at the moment
-        if gcode in ("xxxG2", "xxxG3"):  # Arc Move
-            x = self._getCodeFloat(line, "X")
-            y = self._getCodeFloat(line, "Y")
-            z = self._getCodeFloat(line, "Z")
-            e = self._getCodeFloat(line, "E")
-            i = self._getCodeFloat(line, "I")
-            j = self._getCodeFloat(line, "J")
-            r = self._getCodeFloat(line, "R")
-            f = self._getCodeFloat(line, "F")
-
-            # this is a move or print head stays on position
-            move = (
-                x is not None
-                or y is not None
-                or z is not None
-                or i is not None
-                or j is not None
-                or r is not None
-            )
-
-            oldPos = self.pos
-
-            # Use new coordinates if provided. If not provided, use prior coordinates (minus tool offset)
-            # in absolute and 0.0 in relative mode.
-            newPos = Vector3D(
-                x * self.scale if x is not None else (0.0 if self.relativeMode else self.pos.x),
-                y * self.scale if y is not None else (0.0 if self.relativeMode else self.pos.y),
-                z * self.scale if z is not None else (0.0 if self.relativeMode else self.pos.z),
-            )
-
-            if self.relativeMode:
-                # Relative mode: add to current position
-                self.pos += newPos
+                # like a linear move from start to end
+                self._addAxisTraveling()
+        elif x is not None or y is not None or z is not None:
+            # no center, firmware treats it like a linear move
+            self._addAxisTraveling()
+
+        if e is not None:
+            if self.relativeMode or self.relativeE:
+                # e is already relative, nothing to do
+                pass
             else:
-                # Absolute mode: apply tool offsets
-                self.pos = newPos
-
-            # if f is not None and f != 0:
-            #     feedrate = f
-
-            # get radius and offset
-            i = 0 if i is None else i
-            j = 0 if j is None else j
-            r = math.sqrt(i * i + j * j) if r is None else r
-
-            # calculate angles
-            centerArc = Vector3D(oldPos.x + i, oldPos.y + j, oldPos.z)
-            startAngle = math.atan2(oldPos.y - centerArc.y, oldPos.x - centerArc.x)
-            endAngle = math.atan2(self.pos.y - centerArc.y, self.pos.x - centerArc.x)
+                e -= self.currentE[self.currentExtruder]
+
+            self._addExtrusion(e)
+
+    def _addAxisTraveling(self):
+        pos = self.pos
+        lastPos = self.lastPos
+        totalAxisTraveling = self.totalAxisTraveling
+        totalAxisTraveling.x = totalAxisTraveling.x + abs(pos.x - lastPos.x)
+        totalAxisTraveling.y = totalAxisTraveling.y + abs(pos.y - lastPos.y)
+        totalAxisTraveling.z = totalAxisTraveling.z + abs(pos.z - lastPos.z)
+        # print("LastPosition: " + str(self.lastPos)+ " NewPosition:" + str(self.pos))
+        # print("TotalTraveling: " + str(self.totalAxisTraveling))
+
+    def processGCodeLines(self, lines):
+        """
+        Processes all lines of an iterable (list, file, generator...) and returns the number of processed lines.
+
+        Same result as calling processGCodeLine for each line, but the state is kept in local variables during the
+        loop and the totals are written back only once at the end.
+
+        Examples:
+
+        >>> lines = ["G1 X10 Y5 E1", "G91", "G1 X-5 E2", "M83", "G1 Z0.2 E0.5"]
+        >>> odometer = Odometer()
+        >>> odometer.processGCodeLines(lines)
+        5
+        >>> singleLineOdometer = Odometer()
+        >>> for line in lines:
+        ...     singleLineOdometer.processGCodeLine(line)
+        >>> odometer.getTotalAxisTraveling() == singleLineOdometer.getTotalAxisTraveling()
+        True
+        >>> odometer.getTotalExtrusionTraveling() == singleLineOdometer.getTotalExtrusionTraveling()
+        True
+        >>> odometer.getLineStatistics() == singleLineOdometer.getLineStatistics()
+        True
+        """
+        pos = self.pos
+        posX, posY, posZ = pos.x, pos.y, pos.z
+        scale = self.scale
+        relativeMode = self.relativeMode
+        relativeE = self.relativeE
+        currentExtruder = self.currentExtruder
+        currentE = self.currentE
+        totalExtrusion = self.totalExtrusion
+        maxExtrusion = self.maxExtrusion
+        totalAxisTraveling = self.totalAxisTraveling
+        totalX, totalY, totalZ = totalAxisTraveling.x, totalAxisTraveling.y, totalAxisTraveling.z
+        # local copy, so readers never see a half processed batch
+        totalExtrusionTraveling = array("d", self.totalExtrusionTraveleing)
+
+        commandHandlers = self._commandHandlers
+        lineStatistics = self.lineStatistics
+
+        lineCount = filteredCount = ignoredCount = moveCount = 0
+        try:
+            for line in lines:
+                lineCount += 1
+                if line[:2] not in COMMAND_PREFIXES:
+                    if not line[:1].isspace() or line.lstrip()[:2] not in COMMAND_PREFIXES:
+                        filteredCount += 1
+                        continue
+
+                gcode, tool, parameters = parseGCodeLine(line)
+
+                if gcode == "G1" or gcode == "G0":
+                    moveCount += 1
+                    x = parameters.get("X")
+                    y = parameters.get("Y")
+                    z = parameters.get("Z")
+                    e = parameters.get("E")
+
+                    if x is not None or y is not None or z is not None:
+                        if relativeMode:
+                            newX = posX + (x * scale if x is not None else 0.0)
+                            newY = posY + (y * scale if y is not None else 0.0)
+                            newZ = posZ + (z * scale if z is not None else 0.0)
+                        else:
+                            newX = x * scale if x is not None else posX
+                            newY = y * scale if y is not None else posY
+                            newZ = z * scale if z is not None else posZ
+                        totalX = totalX + abs(newX - posX)
+                        totalY = totalY + abs(newY - posY)
+                        totalZ = totalZ + abs(newZ - posZ)
+                        posX, posY, posZ = newX, newY, newZ
+
+                    if e is not None:
+                        if not (relativeMode or relativeE):
+                            e -= currentE[currentExtruder]
+
+                        if e != 0.0:
+                            lastTotal = totalExtrusion[currentExtruder]
+                            total = lastTotal + e
+                            totalExtrusion[currentExtruder] = total
+                            currentE[currentExtruder] += e
+                            if total > maxExtrusion[currentExtruder]:
+                                maxExtrusion[currentExtruder] = total
+                            totalExtrusionTraveling[currentExtruder] += abs(lastTotal - total)
+
+                            if currentExtruder == 0 and self.duplicationMode:
+                                self._addDuplicatedExtrusion(e, totalExtrusionTraveling)
 
-            if gcode == "G2":
-                startAngle, endAngle = endAngle, startAngle
-            if startAngle < 0:
-                startAngle += math.pi * 2
-            if endAngle < 0:
-                endAngle += math.pi * 2
-
-            # from now on we only think in counter-clockwise direction
-            if e is not None:
-                if self.relativeMode or self.relativeE:
-                    # e is already relative, nothing to do
-                    pass
                 else:
-                    e -= self.currentE[self.currentExtruder]
-
-                # If move with extrusion, calculate new min/max coordinates of model
-                # if e > 0 and move:
-                #     # extrusion and move -> oldPos & pos relevant for print area & dimensions
-                #     self._minMax.record(oldPos)
-                #     self._minMax.record(self.pos)
-                #     self._addArcMinMax(
-                #         self._minMax, startAngle, endAngle, centerArc, r
-                #     )
-
-                self.totalExtrusion[self.currentExtruder] += e
-                self.currentE[self.currentExtruder] += e
-                self.maxExtrusion[self.currentExtruder] = max(
-                    self.maxExtrusion[self.currentExtruder], self.totalExtrusion[self.currentExtruder]
-                )
-
-                if self.currentExtruder == 0 and len(self.currentE) > 1 and self.duplicationMode:
-                    # Copy first extruder length to other extruders
-                    for i in range(1, len(self.currentE)):
-                        self.totalExtrusion[i] += e
-                        self.currentE[i] += e
-                        self.maxExtrusion[i] = max(self.maxExtrusion[i], self.totalExtrusion[i])
-            else:
-                e = 0
-
-            # # move time in x, y, z, will be 0 if no movement happened
-            # moveTimeXYZ = abs((oldPos - pos).length / feedrate)
-            #
-            # # time needed for extruding, will be 0 if no extrusion happened
-            # extrudeTime = abs(e / feedrate)
-            #
-            # # time to add is maximum of both
-            # totalMoveTimeMinute += max(moveTimeXYZ, extrudeTime)
-            #
-            # # process layers if there's extrusion
-            # if e:
-            #     self._track_layer(
-            #         pos,
-            #         {
-            #             "startAngle": startAngle,
-            #             "endAngle": endAngle,
-            #             "center": centerArc,
-            #             "radius": r,
-            #         },
-            #     )
-
-        elif gcode == "G20":  # Units are inches
+                    commandHandler = commandHandlers.get(gcode)
+                    if commandHandler is None:
+                        ignoredCount += 1
+                        continue
+                    # rare, so use the single line implementation with the current state
+                    path, handler = commandHandler
+                    lineStatistics[path] += 1
+                    self.stateSequence += 1
+                    try:
+                        pos.x, pos.y, pos.z = posX, posY, posZ
+                        totalAxisTraveling.x, totalAxisTraveling.y, totalAxisTraveling.z = totalX, totalY, totalZ
+                        self.totalExtrusionTraveleing[:] = totalExtrusionTraveling
+                        handler(gcode, tool, parameters)
+                        posX, posY, posZ = pos.x, pos.y, pos.z
+                        totalX, totalY, totalZ = totalAxisTraveling.x, totalAxisTraveling.y, totalAxisTraveling.z
+                        totalExtrusionTraveling[:] = self.totalExtrusionTraveleing
+                    finally:
+                        self.stateSequence += 1
+                    scale = self.scale
+                    relativeMode = self.relativeMode
+                    relativeE = self.relativeE
+                    currentExtruder = self.currentExtruder
+        finally:
+            # write back the state
+            self.stateSequence += 1
+            pos.x, pos.y, pos.z = posX, posY, posZ
+            totalAxisTraveling.x = totalX
+            totalAxisTraveling.y = totalY
+            totalAxisTraveling.z = totalZ
+            self.totalExtrusionTraveleing[:] = totalExtrusionTraveling
+            self.stateSequence += 1
+            lineStatistics["filtered"] += filteredCount
+            lineStatistics["ignored"] += ignoredCount
+            lineStatistics["move"] += moveCount
+
+        return lineCount
+
+    # Use new coordinates if provided. If not provided, keep the prior coordinates. The position is updated in place,
+    # the prior position is copied into lastPos
+    def _moveTo(self, x, y, z):
+        pos = self.pos
+        lastPos = self.lastPos
+        lastPos.x = pos.x
+        lastPos.y = pos.y
+        lastPos.z = pos.z
+
+        scale = self.scale
+        if self.relativeMode:
+            # Relative mode: add to current position
+            if x is not None:
+                pos.x = pos.x + x * scale
+            if y is not None:
+                pos.y = pos.y + y * scale
+            if z is not None:
+                pos.z = pos.z + z * scale
+        else:
+            # Absolute mode
+            if x is not None:
+                pos.x = x * scale
+            if y is not None:
+                pos.y = y * scale
+            if z is not None:
+                pos.z = z * scale
+
+    # e is the relative extrusion of the current tool
+    def _addExtrusion(self, e):
+        if e == 0.0:
+            return
+        toolIndex = self.currentExtruder
+        lastTotal = self.totalExtrusion[toolIndex]
+        total = lastTotal + e
+        self.totalExtrusion[toolIndex] = total
+        self.currentE[toolIndex] += e
+        if total > self.maxExtrusion[toolIndex]:
+            self.maxExtrusion[toolIndex] = total
+        self.totalExtrusionTraveleing[toolIndex] += abs(lastTotal - total)
+
+        if toolIndex == 0 and self.duplicationMode:
+            self._addDuplicatedExtrusion(e, self.totalExtrusionTraveleing)
+
+    # copy first extruder length to other extruders
+    def _addDuplicatedExtrusion(self, e, totalExtrusionTraveling):
+        for toolIndex in range(1, self.extruderCount):
+            lastTotal = self.totalExtrusion[toolIndex]
+            total = lastTotal + e
+            self.totalExtrusion[toolIndex] = total
+            self.currentE[toolIndex] += e
+            if total > self.maxExtrusion[toolIndex]:
+                self.maxExtrusion[toolIndex] = total
+            totalExtrusionTraveling[toolIndex] += abs(lastTotal - total)
+
+    # commands that only change the position or the modes, but are no move
+    def _processStateCommand(self, gcode, tool, parameters):
+        if gcode == "G20":  # Units are inches
             self.scale = 25.4
         elif gcode == "G21":  # Units are mm
             self.scale = 1.0
         elif gcode == "G28":  # Home
-            x = self._getCodeFloat(line, "X")
-            y = self._getCodeFloat(line, "Y")
-            z = self._getCodeFloat(line, "Z")
-            origin = Vector3D(0.0, 0.0, 0.0)
+            x = parameters.get("X")
+            y = parameters.get("Y")
+            z = parameters.get("Z")
             if x is None and y is None and z is None:
-                self.pos = origin
+                self.pos.x = 0.0
+                self.pos.y = 0.0
+                self.pos.z = 0.0
             else:
-                self.pos = Vector3D(self.pos)
                 if x is not None:
-                    self.pos.x = origin.x
+                    self.pos.x = 0.0
                 if y is not None:
-                    self.pos.y = origin.y
+                    self.pos.y = 0.0
                 if z is not None:
-                    self.pos.z = origin.z
+                    self.pos.z = 0.0
         elif gcode == "G90":  # Absolute position
             self.relativeMode = False
             if self.g90_extruder:
@@ -401,10 +723,10 @@ class Odometer(object):
                 self.relativeE = True
 
         elif gcode == "G92":    # Set Position
-            x = self._getCodeFloat(line, "X")
-            y = self._getCodeFloat(line, "Y")
-            z = self._getCodeFloat(line, "Z")
-            e = self._getCodeFloat(line, "E")
+            x = parameters.get("X")
+            y = parameters.get("Y")
+            z = parameters.get("Z")
+            e = parameters.get("E")
 
             if e is None and x is None and y is None and z is None:
                 # no parameters, set all axis to 0
@@ -427,111 +749,91 @@ class Odometer(object):
             self.relativeE = False
         elif gcode == "M83":  # Relative E
             self.relativeE = True
-
-        if (move):
-            currentAxisTraveling = self.pos - self.lastPos
-            self.totalAxisTraveling.x = self.totalAxisTraveling.x + abs(currentAxisTraveling.x)
-            self.totalAxisTraveling.y = self.totalAxisTraveling.y + abs(currentAxisTraveling.y)
-            self.totalAxisTraveling.z = self.totalAxisTraveling.z + abs(currentAxisTraveling.z)
-            # print("LastPosition: " + str(self.lastPos)+ " NewPosition:" + str(self.pos))
-            # print("Moved: " + str(currentAxisTraveling))
-            # print("TotalTraveling: " + str(self.totalAxisTraveling))
-
-
-        currentExtrusionTraveling = self._calcCurrentExtrusionTraveleing(self.totalExtrusion, self.lastTotalExtrusion)
-        self.totalExtrusionTraveleing = self._calcTotalExtrusionTraveling(currentExtrusionTraveling, self.totalExtrusionTraveleing)
-        # print("******")
-        # print("CurrentExtrusion: " + str(self.currentE))
-        # print("TotalExtrusion: " + str(self.totalExtrusion))
-        # # print("MaxExtrusion: " + str(self.maxExtrusion))
-        # print("currentExtrusionTraveling: " + str(currentExtrusionTraveling))
-        # print("totalExtrusionTraveleing: " + str(self.totalExtrusionTraveleing))
-        # print("******")
-        pass
+        elif gcode == "M605":  # Dual nozzle mode, S2 duplication and S3 mirrored: T0 extrusion is done by T1 as well
+            mode = parameters.get("S")
+            if mode is not None:
+                self.duplicationMode = mode in (2.0, 3.0)
+                if self.duplicationMode:
+                    self.extruderCount = max(self.extruderCount, 2)
+
+    def _processToolChange(self, gcode, tool, parameters):
+        """
+        T0..T9, unknown tools are ignored. Each tool has its own E position and extrusion totals.
+
+        >>> odometer = Odometer()
+        >>> for line in ["G1 E5", "T1", "G1 E3", "T9", "G1 E1", "T10", "G1 E3", "T1", "G1 E4"]:
+        ...     odometer.processGCodeLine(line)
+        >>> odometer.getSnapshot().extrusionTraveling
+        (5.0, 4.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 3.0)
+        >>> odometer.currentExtruder, odometer.extruderCount
+        (1, 10)
+
+        In duplication mode (M605 S2) the extrusion of T0 is added to T1 as well:
+
+        >>> for line in ["T0", "M605 S2", "G1 E7"]:
+        ...     odometer.processGCodeLine(line)
+        >>> odometer.getSnapshot().extrusionTraveling[:2]
+        (7.0, 6.0)
+        """
+        if tool < self.max_extruders:
+            self.currentExtruder = tool
+            self.extruderCount = max(self.extruderCount, tool + 1)
 
 
     def getTotalAxisTraveling(self):
         return self.totalAxisTraveling
 
+    def getSnapshot(self):
+        """
+        Coherent copy of all totals, can be called from any thread while another thread processes lines.
+
+        Seqlock reader: the values are only taken, if the stateSequence was even (no write in progress) and did not
+        change during the copy. The writer is never blocked, if the reader does not get a coherent copy after a few
+        attempts, the last coherent snapshot is returned.
+
+        >>> odometer = Odometer()
+        >>> odometer.processGCodeLine("G1 X10 Y5 E2")
+        >>> snapshot = odometer.getSnapshot()
+        >>> (snapshot.axisTravelingX, snapshot.axisTravelingY, snapshot.extrusionTraveling[0])
+        (10.0, 5.0, 2.0)
+        """
+        for attempt in range(self.SNAPSHOT_READ_ATTEMPTS):
+            sequence = self.stateSequence
+            if (sequence & 1 == 0):
+                snapshot = self._createSnapshot(sequence)
+                if (sequence == self.stateSequence):
+                    self._lastSnapshot = snapshot
+                    return snapshot
+            # give the writer the chance to finish
+            time.sleep(0)
+        return self._lastSnapshot
+
+    def _createSnapshot(self, sequence):
+        totalAxisTraveling = self.totalAxisTraveling
+        return OdometerSnapshot(totalAxisTraveling.x, totalAxisTraveling.y, totalAxisTraveling.z,
+                                tuple(self.totalExtrusionTraveleing), self.totalArcLength, sequence)
+
+    # length of all arc moves (G2/G3), helical Z included
+    def getTotalArcLength(self):
+        return self.totalArcLength
+
+    # list with the extrusion traveling of each tool (index = tool id)
     def getTotalExtrusionTraveling(self):
-        return self.totalExtrusionTraveleing
+        return self.totalExtrusionTraveleing.tolist()
 
 
     def _fireExtrusionChangedEvent(self):
         if (self.extrusionChangedListener != None):
             self.extrusionChangedListener(self.getExtrusionAmount())
 
-    def _calcCurrentExtrusionTraveleing(self, totalExtrusion, lastTotalExtrusion):
-        result = []
-        for toolIndex in range(len(totalExtrusion)):
-            total = totalExtrusion[toolIndex]
-            last = lastTotalExtrusion[toolIndex]
-            result.append(abs(last - total))
-        return result
-
-    def _calcTotalExtrusionTraveling(self, currentExtrusionTraveling, totalExtrusionTraveleing):
-        result = []
-        for toolIndex in range(len(currentExtrusionTraveling)):
-            currentTravel = currentExtrusionTraveling[toolIndex]
-            totalTravel = totalExtrusionTraveleing[toolIndex]
-            result.append(totalTravel + currentTravel)
-        return result
-
-
-    def _getCodeInt(self, line, code):
-        return self._getCode(line, code, int)
-
-    def _getCodeFloat(self, line, code):
-        return self._getCode(line, code, float)
-
-    def _getCode(self, line, code, c):
-        n = line.find(code) + 1
-        if n < 1:
-            return None
-        m = line.find(" ", n)
-        try:
-            if m < 0:
-                result = c(line[n:])
-            else:
-                result = c(line[n:m])
-        except ValueError:
-            return None
-
-        if math.isnan(result) or math.isinf(result):
-            return None
-
-        return result
-
-
-
 
 if __name__ == "__main__":
-    print("START !!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-    odometer = Odometer()
-
-    odometer.processGCodeLine("G0 X12")
-    # odometer.processGCodeLine("G0 X-12")
-    # odometer.processGCodeLine("G91")
-    # odometer.processGCodeLine("G0 X-1")
-    # odometer.processGCodeLine("G0 X12")
-
-    # odometer.processGCodeLine("G0 E12")
-    # odometer.processGCodeLine("G91")
-    # odometer.processGCodeLine("G0 E-13")
+    # totals of a G-code file, usage: python odometer.py <G-code file>
+    import sys
 
-
-
-    # odometer.processGCodeLine("G2 X125 Y32 I10.5 J10.5")
-    # odometer.processGCodeLine("G0 F1500 ; set the feedrate to 1500 mm/min")
-    # odometer.processGCodeLine("G1 X90.6 Y13.8 ; move to 90.6mm on the X axis and 13.8mm on the Y axis")
-
-    # filename = "/Users/o0632/Library/Application Support/OctoPrint/uploads/prusa22-messschieber_boden.gcode"
-    filename = "/Users/o0632/0_Projekte/3DDruck/OctoPrint/OctoPrint-MaintenanceManager/testdata/xyzCalibration_cube.gcode"
-    lines = None
-    with open(filename) as file:
-        lines = file.readlines()
-    for line in lines:
-        odometer.processGCodeLine(line)
+    odometer = Odometer()
+    with open(sys.argv[1]) as file:
+        odometer.processGCodeLines(file)
 
     print("Axis-Traveling: " + str(odometer.getTotalAxisTraveling()))
     print("Extrusion-Traveling: " + str(odometer.getTotalExtrusionTraveling()))